@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+from .config import settings
+
+
+class ChunkCache:
+    """以 SQLite 保存每個分塊的辨識結果，總大小超過上限時依 LRU 淘汰。
+
+    多個 API 行程與 Celery worker 可共用同一個檔案，由 SQLite 自身的鎖處理並行寫入。
+    """
+
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_last_access ON chunks(last_access)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """離開時 commit（例外時 rollback）並關閉連線；sqlite3 連線本身的 with 只處理交易、不會關閉。"""
+        with closing(sqlite3.connect(self.path, timeout=10.0, check_same_thread=False)) as conn, conn:
+            yield conn
+
+    @staticmethod
+    def make_key(
+        content_hash: str,
+        offset_s: float,
+        duration_s: float,
+        backend: str,
+        model: str,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        raw = json.dumps(
+            {
+                "content": content_hash,
+                # 以毫秒為單位，避免浮點誤差造成同一分塊對不到
+                "offset_ms": int(round(float(offset_s) * 1000)),
+                "duration_ms": int(round(float(duration_s) * 1000)),
+                "backend": backend,
+                "model": model,
+                "params": params or {},
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT value FROM chunks WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE chunks SET last_access = ? WHERE key = ?", (time.time(), key))
+        try:
+            return json.loads(row[0])
+        except Exception:
+            return None
+
+    def put(self, key: str, value: Any) -> None:
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if self.max_bytes and size > self.max_bytes:
+            return
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chunks (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, size, time.time()),
+            )
+            if self.max_bytes:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = int(conn.execute("SELECT COALESCE(SUM(size), 0) FROM chunks").fetchone()[0])
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute("SELECT key, size FROM chunks ORDER BY last_access ASC").fetchall()
+        stale: list[tuple[str]] = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= int(size)
+        conn.executemany("DELETE FROM chunks WHERE key = ?", stale)
+
+
+_cache: Optional[ChunkCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_chunk_cache() -> Optional[ChunkCache]:
+    """取得行程內共用的分塊快取；未啟用或無法開啟時回傳 None。"""
+    global _cache
+    if not settings.chunk_cache_enabled:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ChunkCache(settings.chunk_cache_path, settings.chunk_cache_max_bytes)
+            except Exception:
+                return None
+        return _cache
@@ -17,6 +17,12 @@ celery_app.conf.update(
     accept_content=["json"],
     timezone="UTC",
     enable_utc=True,
+    beat_schedule={
+        "sweep-spool": {
+            "task": "sweep_spool",
+            "schedule": max(60.0, settings.spool_ttl_seconds / 4),
+        },
+    },
 )
 
 
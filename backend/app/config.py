@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import tempfile
 from dataclasses import dataclass
 from typing import List
 from pathlib import Path
@@ -29,11 +30,100 @@ def _parse_csv(value: str | None) -> List[str]:
 @dataclass
 class Settings:
     redis_url: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    # 任務狀態存放處：memory（單一行程）或 redis（多個 API 行程 / Celery worker 共用）；留空時依 USE_CELERY 決定
+    task_store: str = os.getenv("TASK_STORE", "")
+    task_key_prefix: str = os.getenv("TASK_KEY_PREFIX", "stt:task:")
+    task_ttl_seconds: int = int(os.getenv("TASK_TTL_SECONDS", str(7 * 24 * 3600)))
+    # WebSocket 狀態推播：收到變更通知後至少間隔此秒數才再推送（合併串流時的密集寫入）
+    status_push_interval_s: float = float(os.getenv("STATUS_PUSH_INTERVAL_S", "0.2"))
+    # 沒有任何變更時，每隔此秒數仍重新讀取並推送一次（保持連線，也補上可能漏掉的通知）
+    status_keepalive_s: float = float(os.getenv("STATUS_KEEPALIVE_S", "15"))
     remote_server_url: str = os.getenv("REMOTE_SERVER_URL", "http://localhost:8001")
+    # 遠端伺服器註冊的模型名稱（default、model1…或 model id）；留空使用伺服器預設模型
+    remote_model: str = os.getenv("REMOTE_MODEL", "")
+    # 多個遠端節點（逗號分隔）；留空時只使用 REMOTE_SERVER_URL
+    remote_server_urls: str = os.getenv("REMOTE_SERVER_URLS", "")
+    # 節點池：背景健康檢查間隔、故障節點剔除秒數、分塊改送其他節點的次數
+    remote_health_interval_s: float = float(os.getenv("REMOTE_HEALTH_INTERVAL_S", "10"))
+    # 第一次健康檢查（第一個任務會等它取得節點能力）的逾時；所有節點同時檢查，總等待不隨節點數累加
+    remote_health_startup_timeout_s: float = float(os.getenv("REMOTE_HEALTH_STARTUP_TIMEOUT_S", "2"))
+    remote_eject_seconds: float = float(os.getenv("REMOTE_EJECT_SECONDS", "30"))
+    remote_retries: int = int(os.getenv("REMOTE_RETRIES", "2"))
+    # 每個任務同時送出的分塊數，以及整個行程對遠端伺服器的總上限
+    remote_inflight: int = int(os.getenv("REMOTE_INFLIGHT", "4"))
+    remote_global_inflight: int = int(os.getenv("REMOTE_GLOBAL_INFLIGHT", "16"))
+    # 遠端回 429（佇列已滿）時依 Retry-After 等待後重送的次數上限
+    remote_busy_retries: int = int(os.getenv("REMOTE_BUSY_RETRIES", "6"))
+    # 遠端伺服器於 /healthz 宣告支援時，改以原始 PCM 上傳到 /transcribe/pcm
+    remote_pcm_ingest: bool = _parse_bool(os.getenv("REMOTE_PCM_INGEST", None), default=True)
+    # chunked：每個分塊一次請求；stream：整段上傳到 /transcribe/stream，由伺服器切窗並以 NDJSON 回傳
+    remote_mode: str = os.getenv("REMOTE_MODE", "chunked")
     vertex_project: str = os.getenv("VERTEX_PROJECT", "vscc-faq")
     vertex_location: str = os.getenv("VERTEX_LOCATION", "global")
     vertex_genai_model: str = os.getenv("VERTEX_GENAI_MODEL", "gemini-2.5-flash-lite")
+    # 每個任務同時送出的 Vertex 分塊請求數
+    vertex_inflight: int = int(os.getenv("VERTEX_INFLIGHT", "4"))
+    # 整個行程的每分鐘請求數 / token 數上限（權杖桶）；0 表示不限制
+    vertex_rpm: float = float(os.getenv("VERTEX_RPM", "0"))
+    vertex_tpm: float = float(os.getenv("VERTEX_TPM", "0"))
+    # 429 / 5xx 以指數退避（含 jitter）重試的次數與等待範圍
+    vertex_retries: int = int(os.getenv("VERTEX_RETRIES", "5"))
+    vertex_backoff_base_s: float = float(os.getenv("VERTEX_BACKOFF_BASE_S", "1"))
+    vertex_backoff_max_s: float = float(os.getenv("VERTEX_BACKOFF_MAX_S", "30"))
+    # 分塊上傳格式：wav（未壓縮）、flac（無損）或 opus（有損，位元率由 VERTEX_OPUS_BITRATE_KBPS 指定）
+    vertex_audio_codec: str = os.getenv("VERTEX_AUDIO_CODEC", "wav")
+    vertex_opus_bitrate_kbps: int = int(os.getenv("VERTEX_OPUS_BITRATE_KBPS", "24"))
+    # 打包模式：每個 Vertex 請求最多合併的連續分塊數（1 表示每塊一個請求）與合併後的總秒數上限
+    vertex_pack_chunks: int = int(os.getenv("VERTEX_PACK_CHUNKS", "1"))
+    vertex_pack_max_s: float = float(os.getenv("VERTEX_PACK_MAX_S", "300"))
+    # 以串流 API 取得逐字稿，文字片段一到就寫入 partial_text；閒置逾時為兩個片段間的最長等待秒數
+    vertex_stream: bool = _parse_bool(os.getenv("VERTEX_STREAM", None), default=True)
+    vertex_stream_idle_timeout_s: float = float(os.getenv("VERTEX_STREAM_IDLE_TIMEOUT_S", "30"))
+    # hedged requests：分塊超過該後端滾動分位數（HEDGE_QUANTILE）仍未完成時，另送一份到
+    # 其他遠端節點或另一個後端（HEDGE_TARGET：auto / endpoint / backend），先成功者勝出
+    hedge_enabled: bool = _parse_bool(os.getenv("HEDGE_ENABLED", None), default=False)
+    hedge_target: str = os.getenv("HEDGE_TARGET", "auto")
+    hedge_quantile: float = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+    # 每個後端至少累積 HEDGE_MIN_SAMPLES 筆延遲後才開始 hedging；門檻不低於 HEDGE_MIN_DELAY_S
+    hedge_min_samples: int = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    hedge_min_delay_s: float = float(os.getenv("HEDGE_MIN_DELAY_S", "2"))
+    hedge_window: int = int(os.getenv("HEDGE_WINDOW", "200"))
+    # 備援請求數上限（相對於主請求數的比例），避免花費倍增
+    hedge_budget_ratio: float = float(os.getenv("HEDGE_BUDGET_RATIO", "0.1"))
+    # 主請求失敗時改送備援（failover）的上限，另計預算；後端整個掛掉時不會讓每個分塊都打兩次
+    hedge_failover_budget_ratio: float = float(os.getenv("HEDGE_FAILOVER_BUDGET_RATIO", "0.2"))
     use_celery: bool = _parse_bool(os.getenv("USE_CELERY", None), default=False)
+    # 上傳檔案落地的 spool 目錄與串流寫入區塊大小
+    spool_dir: str = os.getenv("SPOOL_DIR", str(Path(tempfile.gettempdir()) / "stt_spool"))
+    spool_block_size: int = int(os.getenv("SPOOL_BLOCK_SIZE", str(1024 * 1024)))
+    # 使用 Celery 時 API 與 worker 需共用 SPOOL_DIR；逾時未清除的 spool 檔會被定期回收（仍在排隊或執行中的任務除外）
+    spool_ttl_seconds: float = float(os.getenv("SPOOL_TTL_SECONDS", str(24 * 3600)))
+    # 可續傳上傳的工作階段超過此秒數沒有任何 PUT 才回收（以最後活動時間計，而非建立時間）
+    upload_session_ttl_seconds: float = float(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+    # 每個任務的暫存工作區（預設為系統暫存目錄下的 stt_workspace），任務結束時整個刪除
+    workspace_dir: str = os.getenv("WORKSPACE_DIR", "")
+    # worker 當機遺留的工作區超過此秒數才回收；仍在執行中的任務不受影響
+    workspace_ttl_seconds: float = float(os.getenv("WORKSPACE_TTL_SECONDS", str(24 * 3600)))
+    # 單一任務工作區的容量上限；需容納整段解碼後的 PCM（16 kHz int16 約 115 MB / 小時）
+    workspace_quota_bytes: int = int(os.getenv("WORKSPACE_QUOTA_BYTES", str(4 * 1024 * 1024 * 1024)))
+    # 分塊管線：擷取/編碼預先處理的分塊數（佇列深度）
+    pipeline_prefetch_depth: int = int(os.getenv("PIPELINE_PREFETCH_DEPTH", "2"))
+    # 分塊逐字稿快取（以音訊內容雜湊 + 解碼參數為鍵）
+    chunk_cache_enabled: bool = _parse_bool(os.getenv("CHUNK_CACHE_ENABLED", None), default=True)
+    chunk_cache_path: str = os.getenv("CHUNK_CACHE_PATH", str(Path(tempfile.gettempdir()) / "stt_chunk_cache.sqlite3"))
+    chunk_cache_max_bytes: int = int(os.getenv("CHUNK_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    # 分塊邊界對齊絕對時間格線，讓不同起訖時間的重跑能共用快取；預設關閉，維持從 start_time 起算的分塊
+    chunk_grid_align: bool = _parse_bool(os.getenv("CHUNK_GRID_ALIGN", None), default=False)
+    # 對齊格線後首段短於此秒數時與下一段合併再平分成兩段（每段仍不超過 chunk_length）
+    chunk_min_lead_in_s: float = float(os.getenv("CHUNK_MIN_LEAD_IN_S", "1.0"))
+    # 分塊方式：fixed（固定長度）或 vad（在靜音處切開並略過純靜音區段）
+    chunking_mode: str = os.getenv("CHUNKING_MODE", "fixed")
+    vad_energy_margin_db: float = float(os.getenv("VAD_ENERGY_MARGIN_DB", "10"))
+    # 噪音底估計的上限（dBFS），幾乎沒有靜音的錄音不會把小聲的語音判為靜音
+    vad_noise_floor_max_db: float = float(os.getenv("VAD_NOISE_FLOOR_MAX_DB", "-45"))
+    vad_min_silence_s: float = float(os.getenv("VAD_MIN_SILENCE_S", "0.3"))
+    # 語音區段之間的靜音超過此秒數時另起新分塊，不把長靜音一併送出
+    vad_max_gap_s: float = float(os.getenv("VAD_MAX_GAP_S", "2.0"))
     cors_origins: List[str] = None
 
 
@@ -2,13 +2,18 @@ from __future__ import annotations
 
 import asyncio
 import uuid
-from typing import Optional, Literal
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Literal
 
-from fastapi import FastAPI, UploadFile, File, WebSocket, WebSocketDisconnect, Query, BackgroundTasks, HTTPException
+from fastapi import FastAPI, UploadFile, File, WebSocket, WebSocketDisconnect, Query, BackgroundTasks, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
 
-from .storage import TaskStore
+from .storage import TaskStore, delete_file_silent
+from .spool import SpooledFile, spool_upload, sweep_spool
+from .utils.workspace import sweep_stale_workspaces
+from .uploads import UploadError, create_session, session_status, write_range, finalize_session, discard_session, sweep_upload_sessions
 from .utils.formatting import generate_srt
 from .config import settings
 from .tasks import transcribe_remote_task,  transcribe_vertex_task
@@ -28,16 +33,49 @@ app.add_middleware(
 
 
 
-@app.post("/api/v1/transcribe")
-async def create_transcription_task(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
+_ALLOWED_EXTENSIONS = (".wav", ".mp3", ".m4a", ".flac")
+
+
+def _has_allowed_extension(filename: str | None) -> bool:
+    return bool(filename) and any(filename.lower().endswith(ext) for ext in _ALLOWED_EXTENSIONS)
+
+
+@dataclass
+class TranscriptionOptions:
+    model_choice: str
+    start_time: Optional[str]
+    end_time: Optional[str]
+    language_code: Optional[str]
+    chunk_length: Optional[float]
+    chunking: Optional[str]
+    prompt: Optional[str]
+    temperature: Optional[float]
+    top_p: Optional[float]
+    max_output_tokens: Optional[int]
+    thinking_budget: Optional[int]
+    safety_off: Optional[bool]
+
+    def vertex_params(self) -> Dict[str, Any]:
+        """Vertex 請求參數（已套用預設值）；remote_llm 任務 hedging 改送 Vertex 時也使用同一組。"""
+        return {
+            "language_code": self.language_code or "zh-TW",
+            "prompt": self.prompt,
+            "temperature": float(self.temperature or 0),
+            "top_p": float(self.top_p or 0.95),
+            "max_output_tokens": int(self.max_output_tokens or 65535),
+            "thinking_budget": int(self.thinking_budget or 0),
+            "safety_off": bool(self.safety_off if self.safety_off is not None else True),
+        }
+
+
+def transcription_options(
     model_choice: Literal["vertex_ai", "remote_llm"] = Query(...),
     start_time: Optional[str] = Query(default=None, description="HH:MM:SS"),
     end_time: Optional[str] = Query(default=None, description="HH:MM:SS"),
     language_code: Optional[str] = Query(default="zh-TW"),
     # 共同參數
     chunk_length: Optional[float] = Query(default=30.0, description="分塊秒數"),
+    chunking: Optional[Literal["fixed", "vad"]] = Query(default=None, description="分塊方式；未指定時依 CHUNKING_MODE"),
     # Vertex 參數
     prompt: Optional[str] = Query(default=None, description="提示詞"),
     temperature: Optional[float] = Query(default=1.0),
@@ -45,34 +83,59 @@ async def create_transcription_task(
     max_output_tokens: Optional[int] = Query(default=65535),
     thinking_budget: Optional[int] = Query(default=0),
     safety_off: Optional[bool] = Query(default=True),
-):
-    if file.content_type is None or not any(
-        file.filename.lower().endswith(ext) for ext in (".wav", ".mp3", ".m4a", ".flac")
-    ):
-        raise HTTPException(status_code=400, detail="不支援的音訊格式，請上傳 wav/mp3/m4a/flac。")
-
-    task_id = str(uuid.uuid4())
-    TaskStore.initialize_task(task_id=task_id, model_choice=model_choice, start_time=start_time, end_time=end_time)
-
-    # 將實際工作交給背景執行
-    contents = await file.read()
+) -> TranscriptionOptions:
+    """/transcribe 與 /uploads/{id}/finalize 共用的轉錄參數。"""
+    return TranscriptionOptions(
+        model_choice=model_choice,
+        start_time=start_time,
+        end_time=end_time,
+        language_code=language_code,
+        chunk_length=chunk_length,
+        chunking=chunking,
+        prompt=prompt,
+        temperature=temperature,
+        top_p=top_p,
+        max_output_tokens=max_output_tokens,
+        thinking_budget=thinking_budget,
+        safety_off=safety_off,
+    )
+
+
+def _dispatch_transcription(
+    background_tasks: BackgroundTasks,
+    task_id: str,
+    spooled: SpooledFile,
+    opts: TranscriptionOptions,
+) -> None:
+    model_choice = opts.model_choice
     if settings.use_celery:
+        # broker 只傳遞檔案描述（路徑、大小、雜湊），worker 直接讀取共用 spool 目錄
+        source = spooled.to_dict()
         if model_choice == "remote_llm":
-            transcribe_remote_task.delay(task_id, contents, start_time, end_time)
+            transcribe_remote_task.delay(
+                task_id,
+                source,
+                opts.start_time,
+                opts.end_time,
+                opts.chunk_length,
+                opts.chunking,
+                opts.vertex_params(),
+            )
         elif model_choice == "vertex_ai":
             transcribe_vertex_task.delay(
                 task_id,
-                contents,
-                start_time,
-                end_time,
-                language_code,
-                prompt,
-                temperature,
-                top_p,
-                max_output_tokens,
-                thinking_budget,
-                safety_off,
-                chunk_length,
+                source,
+                opts.start_time,
+                opts.end_time,
+                opts.language_code,
+                opts.prompt,
+                opts.temperature,
+                opts.top_p,
+                opts.max_output_tokens,
+                opts.thinking_budget,
+                opts.safety_off,
+                opts.chunk_length,
+                opts.chunking,
             )
 
     else:
@@ -80,56 +143,167 @@ async def create_transcription_task(
             background_tasks.add_task(
                 transcribe_with_remote_llm,
                 task_id=task_id,
-                raw_bytes=contents,
-                start_time=start_time,
-                end_time=end_time,
-                chunk_length_s=float(chunk_length or 30.0),
+                src_path=spooled.path,
+                content_sha256=spooled.sha256,
+                start_time=opts.start_time,
+                end_time=opts.end_time,
+                chunk_length_s=float(opts.chunk_length or 30.0),
+                chunking=opts.chunking,
+                vertex_params=opts.vertex_params(),
             )
         elif model_choice == "vertex_ai":
             background_tasks.add_task(
                 transcribe_with_vertex_ai,
                 task_id=task_id,
-                raw_bytes=contents,
-                start_time=start_time,
-                end_time=end_time,
-                chunk_length_s=float(chunk_length or 30.0),
-                language_code=language_code or "zh-TW",
-                prompt=prompt,
-                temperature=float(temperature or 0),
-                top_p=float(top_p or 0.95),
-                max_output_tokens=int(max_output_tokens or 65535),
-                thinking_budget=int(thinking_budget or 0),
-                safety_off=bool(safety_off if safety_off is not None else True),
+                src_path=spooled.path,
+                content_sha256=spooled.sha256,
+                start_time=opts.start_time,
+                end_time=opts.end_time,
+                chunk_length_s=float(opts.chunk_length or 30.0),
+                chunking=opts.chunking,
+                **opts.vertex_params(),
             )
+        # 背景任務依序執行，轉錄結束後再移除 spool 檔
+        background_tasks.add_task(delete_file_silent, spooled.path)
+
+    # 順便回收逾時遺留的 spool 檔
+    background_tasks.add_task(sweep_spool)
+    background_tasks.add_task(sweep_upload_sessions)
+    background_tasks.add_task(sweep_stale_workspaces)
+
+
+@app.post("/api/v1/transcribe")
+async def create_transcription_task(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    opts: TranscriptionOptions = Depends(transcription_options),
+):
+    if file.content_type is None or not _has_allowed_extension(file.filename):
+        raise HTTPException(status_code=400, detail="不支援的音訊格式，請上傳 wav/mp3/m4a/flac。")
+
+    task_id = str(uuid.uuid4())
+    # 以固定區塊串流落地到 spool 檔，避免整個檔案以 bytes 留在記憶體；
+    # 寫入完成後才建立任務，用戶端斷線或磁碟已滿時不會留下永遠停在 processing 的任務（spool 檔由 spool_upload 清除）
+    spooled = await spool_upload(file, task_id)
+    await run_in_threadpool(
+        TaskStore.initialize_task,
+        task_id=task_id,
+        model_choice=opts.model_choice,
+        start_time=opts.start_time,
+        end_time=opts.end_time,
+    )
+
+    # 將實際工作交給背景執行
+    _dispatch_transcription(background_tasks, task_id, spooled, opts)
 
     return {"task_id": task_id}
 
 
-@app.websocket("/ws/v1/status/{task_id}")
-async def websocket_status(websocket: WebSocket, task_id: str):
-    await websocket.accept()
+# 可續傳上傳：建立工作階段 → 以 Content-Range 任意順序 PUT 各段 → 查詢已收範圍 → finalize 成轉錄任務
+@app.post("/api/v1/uploads")
+async def create_upload_session(
+    filename: str = Query(..., description="原始檔名（用於判斷格式）"),
+    size: int = Query(..., description="檔案總位元組數"),
+):
+    if not _has_allowed_extension(filename):
+        raise HTTPException(status_code=400, detail="不支援的音訊格式，請上傳 wav/mp3/m4a/flac。")
     try:
-        while True:
-            task = TaskStore.get_task(task_id)
-            if task is None:
-                await websocket.send_json({"status": "failed", "error": "未知的任務 ID"})
-                break
-
-            await websocket.send_json(
-                {
-                    "status": task["status"],
-                    "progress": task["progress"],
-                    "partial_text": task.get("partial_text", ""),
-                    "tokens": task.get("tokens", {"input": 0, "output": 0}),
-                    "error": task.get("error", ""),
-                    "segments": task.get("segments", []),
-                }
-            )
+        meta = create_session(filename, size)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return {"upload_id": meta["upload_id"], "size": meta["size"], "part_size": settings.spool_block_size * 8}
+
+
+@app.put("/api/v1/uploads/{upload_id}")
+async def upload_part(upload_id: str, request: Request):
+    try:
+        return await write_range(upload_id, request.headers.get("content-range"), request.stream())
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+@app.get("/api/v1/uploads/{upload_id}")
+async def get_upload_status(upload_id: str):
+    try:
+        return session_status(upload_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+@app.delete("/api/v1/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    try:
+        session_status(upload_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    discard_session(upload_id)
+    return {"upload_id": upload_id, "status": "aborted"}
+
 
-            if task["status"] in ("completed", "failed"):
-                break
+@app.post("/api/v1/uploads/{upload_id}/finalize")
+async def finalize_upload(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    opts: TranscriptionOptions = Depends(transcription_options),
+):
+    task_id = str(uuid.uuid4())
+    try:
+        # 計算雜湊需讀完整個檔案，放到 threadpool 以免阻塞事件迴圈
+        spooled = await run_in_threadpool(finalize_session, upload_id, task_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    await run_in_threadpool(
+        TaskStore.initialize_task,
+        task_id=task_id,
+        model_choice=opts.model_choice,
+        start_time=opts.start_time,
+        end_time=opts.end_time,
+    )
+    _dispatch_transcription(background_tasks, task_id, spooled, opts)
+    return {"task_id": task_id}
+
+
+@app.websocket("/ws/v1/status/{task_id}")
+async def websocket_status(
+    websocket: WebSocket,
+    task_id: str,
+    text: int = Query(0, ge=0),
+    segments: int = Query(0, ge=0),
+    epoch: int = Query(0, ge=0),
+):
+    """依游標推送增量：每則訊息只含游標之後新增的 text 與 segments，以及新的 cursor。
 
-            await asyncio.sleep(0.5)
+    重新連線時把最後收到的 cursor 以查詢參數帶回（?text=&segments=&epoch=）即可續傳；
+    游標失效時訊息的 reset 為 True，text / segments 為完整內容，用戶端應整段取代。
+    推送由 TaskStore 的變更通知驅動，而非固定間隔輪詢。
+    """
+    await websocket.accept()
+    cursor = {"text": text, "segments": segments, "epoch": epoch}
+    try:
+        with TaskStore.subscribe(task_id) as subscription:
+            while True:
+                # 先清除再讀取：讀取期間的寫入會讓下一次 wait 立即返回
+                subscription.clear()
+                delta = await run_in_threadpool(
+                    TaskStore.get_task_delta,
+                    task_id,
+                    text_offset=cursor["text"],
+                    segment_offset=cursor["segments"],
+                    text_epoch=cursor["epoch"],
+                )
+                if delta is None:
+                    await websocket.send_json({"status": "failed", "error": "未知的任務 ID"})
+                    break
+
+                cursor = delta["cursor"]
+                await websocket.send_json(delta)
+
+                if delta["status"] in ("completed", "failed", "canceled"):
+                    break
+
+                if await subscription.wait(settings.status_keepalive_s):
+                    await asyncio.sleep(settings.status_push_interval_s)
     except WebSocketDisconnect:
         # 使用者關閉頁面或連線中斷，這裡不需額外處理
         return
@@ -140,7 +314,8 @@ async def get_result(
     task_id: str,
     format: Literal["plain", "timestamped", "srt"] = Query("plain"),
 ):
-    task = TaskStore.get_task(task_id)
+    # RedisTaskStore 為同步用戶端，放到 threadpool 以免阻塞事件迴圈（含 WebSocket 推送）
+    task = await run_in_threadpool(TaskStore.get_task, task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="找不到此任務")
     if task["status"] != "completed":
@@ -180,6 +355,14 @@ async def get_result(
     raise HTTPException(status_code=400, detail="不支援的輸出格式")
 
 
+@app.get("/api/v1/stats/{task_id}")
+async def get_task_stats(task_id: str):
+    task = await run_in_threadpool(TaskStore.get_task, task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="找不到此任務")
+    return {"status": task["status"], "meta": task.get("meta", {})}
+
+
 @app.get("/healthz")
 async def healthz():
     return {"ok": True}
@@ -187,12 +370,12 @@ async def healthz():
 
 @app.post("/api/v1/cancel/{task_id}")
 async def cancel_task(task_id: str):
-    task = TaskStore.get_task(task_id)
+    task = await run_in_threadpool(TaskStore.get_task, task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="找不到此任務")
     if task.get("status") in ("completed", "failed", "canceled"):
         return {"status": task.get("status")}
-    TaskStore.mark_canceled(task_id)
+    await run_in_threadpool(TaskStore.mark_canceled, task_id)
     return {"status": "canceled"}
 
 
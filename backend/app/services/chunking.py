@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import math
+from typing import Any, Iterator, Optional
+
+from ..config import settings
+from ..utils.pcm_store import PcmStore
+from ..utils.formatting import parse_hhmmss
+
+
+def requested_time_range(start_time_str: Optional[str], end_time_str: Optional[str]) -> tuple[float, Optional[float]]:
+    """解析使用者指定的區段；end 為 None 表示到檔尾，實際長度由解碼結果決定。"""
+    start_s = max(0.0, parse_hhmmss(start_time_str)) if start_time_str else 0.0
+    end_s = parse_hhmmss(end_time_str) if end_time_str else None
+    if end_s is not None:
+        end_s = max(start_s, end_s)
+    return start_s, end_s
+
+
+def iter_offsets(start_s: float, end_s: float, chunk_length_s: float) -> Iterator[tuple[float, float]]:
+    """依 chunk_length_s 切出 (offset, duration)，offset 為音訊的絕對秒數。
+
+    啟用 CHUNK_GRID_ALIGN 時，邊界對齊到從 0 秒起算的固定格線（首段可能較短），
+    如此不同 start_time 的重跑會切出相同的分塊，可直接命中分塊快取。
+    首段短於 CHUNK_MIN_LEAD_IN_S 時與下一段合併後平分成兩段，避免送出只有零點幾秒、把字切斷的片段；
+    任何分塊都不超過 chunk_length_s（遠端與 Vertex 都依此假設），之後的邊界仍在格線上。
+    """
+    chunk = max(1.0, float(chunk_length_s))
+    offset = float(start_s)
+    if settings.chunk_grid_align:
+        boundary = math.floor(offset / chunk + 1e-9) * chunk + chunk
+        if offset < boundary < end_s and boundary - offset < chunk - 1e-6:
+            if boundary - offset < max(0.0, settings.chunk_min_lead_in_s):
+                boundary = min(end_s, boundary + chunk)
+                if boundary - offset > chunk:
+                    half = (boundary - offset) / 2.0
+                    yield offset, half
+                    offset += half
+            yield offset, boundary - offset
+            offset = boundary
+    while offset < end_s:
+        remain = end_s - offset
+        duration = min(chunk, remain)
+        yield offset, duration
+        offset += duration
+
+
+def plan_chunks(
+    store: PcmStore,
+    start_s: float,
+    end_s: float,
+    chunk_length_s: float,
+    mode: Optional[str] = None,
+) -> tuple[list[tuple[float, float]], dict[str, Any]]:
+    """依分塊模式規劃 (offset, duration)；vad 模式只回傳含語音的區段，offset 仍為絕對秒數。"""
+    mode = (mode or settings.chunking_mode or "fixed").lower()
+    if mode == "vad":
+        from ..utils.vad import VadConfig, plan_vad_chunks
+
+        config = VadConfig(
+            energy_margin_db=settings.vad_energy_margin_db,
+            noise_floor_max_db=settings.vad_noise_floor_max_db,
+            min_silence_s=settings.vad_min_silence_s,
+            max_gap_s=settings.vad_max_gap_s,
+        )
+        return plan_vad_chunks(store.samples(), store.sample_rate, store.offset_s, chunk_length_s, config)
+    if mode != "fixed":
+        raise ValueError(f"未知的分塊模式：{mode}")
+    spans = list(iter_offsets(start_s, end_s, chunk_length_s))
+    return spans, {"mode": "fixed", "chunks": len(spans)}
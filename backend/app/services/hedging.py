@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Generic, Optional, TypeVar
+
+from ..config import settings
+
+
+R = TypeVar("R")
+
+
+class HedgeCanceled(Exception):
+    """輸掉的那一方收到取消訊號後拋出；結果會被丟棄。"""
+
+
+class LatencyTracker:
+    """某個後端最近 window 次成功請求的耗時，用來估計滾動分位數。"""
+
+    def __init__(self, window: int = 200) -> None:
+        self._samples: Deque[float] = deque(maxlen=max(1, int(window)))
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(float(seconds))
+
+    def quantile(self, q: float, min_samples: int) -> Optional[float]:
+        """樣本不足 min_samples 時回傳 None（尚未暖機，不做 hedging）。"""
+        with self._lock:
+            if len(self._samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_latency_tracker(backend: str) -> LatencyTracker:
+    """行程共用、依後端（remote_llm / vertex_ai）分開的延遲統計。"""
+    with _trackers_lock:
+        tracker = _trackers.get(backend)
+        if tracker is None:
+            tracker = _trackers[backend] = LatencyTracker(settings.hedge_window)
+        return tracker
+
+
+class Hedger(Generic[R]):
+    """單一任務的 hedged request 執行器。
+
+    主請求超過該後端滾動 p95（HEDGE_QUANTILE）仍未完成時，另外送出一份備援請求（另一個遠端節點
+    或另一個後端），先成功者勝出，另一方收到取消訊號。備援請求數不超過主請求數的 HEDGE_BUDGET_RATIO；
+    主請求失敗時改用備援請求（failover），另計 HEDGE_FAILOVER_BUDGET_RATIO 的預算，超過時直接拋出主請求的錯誤。
+    """
+
+    def __init__(self, backend: str, *, workers: int) -> None:
+        self.backend = backend
+        self.enabled = settings.hedge_enabled
+        self.quantile = min(0.999, max(0.5, settings.hedge_quantile))
+        self.min_samples = settings.hedge_min_samples
+        self.min_delay_s = max(0.0, settings.hedge_min_delay_s)
+        self.budget_ratio = max(0.0, settings.hedge_budget_ratio)
+        self.failover_budget_ratio = max(0.0, settings.hedge_failover_budget_ratio)
+        self._executor = ThreadPoolExecutor(max_workers=max(2, workers * 2), thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self.primaries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.budget_denied = 0
+        self.hedges_declined = 0
+        self.failover_denied = 0
+        self.canceled_losers = 0
+        # 備援勝出時記錄 (主請求 future, 主請求開始時間, 勝出時間點)，在 stats() 計算省下的時間
+        self._wins: list[tuple[Future, float, float]] = []
+        self.hedge_targets: Dict[str, int] = {}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _threshold(self) -> Optional[float]:
+        p = get_latency_tracker(self.backend).quantile(self.quantile, self.min_samples)
+        return None if p is None else max(self.min_delay_s, p)
+
+    def _allow_hedge_locked(self) -> bool:
+        return self.hedges < self.budget_ratio * self.primaries
+
+    def _allow_failover_locked(self) -> bool:
+        return self.failovers < self.failover_budget_ratio * self.primaries
+
+    def _timed(self, backend: str, fn: Callable[[threading.Event], R], cancel: threading.Event) -> tuple[R, float]:
+        started = time.perf_counter()
+        result = fn(cancel)
+        elapsed = time.perf_counter() - started
+        get_latency_tracker(backend).record(elapsed)
+        return result, elapsed
+
+    def call(
+        self,
+        primary: Callable[[threading.Event], R],
+        hedge: Optional[Callable[[threading.Event], R]] = None,
+        *,
+        hedge_backend: Optional[str] = None,
+        hedge_label: Optional[str] = None,
+        may_hedge: Optional[Callable[[], bool]] = None,
+    ) -> tuple[R, bool]:
+        """執行主請求（必要時加上備援），回傳 (結果, 是否由備援勝出)。
+
+        may_hedge 在預算允許、即將送出備援前呼叫，回傳 False 時不送（failover 不受影響）。
+        """
+        hedge_backend = hedge_backend or self.backend
+        with self._lock:
+            self.primaries += 1
+        if not self.enabled or hedge is None:
+            return self._timed(self.backend, primary, threading.Event())[0], False
+
+        primary_cancel = threading.Event()
+        hedge_cancel = threading.Event()
+        started = time.perf_counter()
+        primary_future: Future = self._executor.submit(self._timed, self.backend, primary, primary_cancel)
+        threshold = self._threshold()
+        done, _ = wait([primary_future], timeout=threshold)
+        if primary_future in done and primary_future.exception() is None:
+            return primary_future.result()[0], False
+
+        failover = primary_future in done
+        with self._lock:
+            if failover:
+                if self._allow_failover_locked():
+                    self.failovers += 1
+                else:
+                    self.failover_denied += 1
+                    hedge = None
+            elif self._allow_hedge_locked():
+                if may_hedge is None or may_hedge():
+                    self.hedges += 1
+                else:
+                    self.hedges_declined += 1
+                    hedge = None
+            else:
+                self.budget_denied += 1
+                hedge = None
+            if hedge is not None and hedge_label:
+                self.hedge_targets[hedge_label] = self.hedge_targets.get(hedge_label, 0) + 1
+        if hedge is None:
+            return primary_future.result()[0], False
+
+        hedge_future: Future = self._executor.submit(self._timed, hedge_backend, hedge, hedge_cancel)
+        pending = {primary_future, hedge_future}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    continue
+                if future is primary_future:
+                    hedge_cancel.set()
+                    self._note_loser(hedge_future)
+                    return future.result()[0], False
+                primary_cancel.set()
+                self._note_loser(primary_future)
+                with self._lock:
+                    self.hedge_wins += 1
+                    if not failover:
+                        self._wins.append((primary_future, started, time.perf_counter() - started))
+                return future.result()[0], True
+        # 兩者皆失敗：以主請求的錯誤為準
+        return primary_future.result()[0], False
+
+    def _note_loser(self, future: Future) -> None:
+        def done(f: Future) -> None:
+            if isinstance(f.exception(), HedgeCanceled):
+                with self._lock:
+                    self.canceled_losers += 1
+
+        future.add_done_callback(done)
+
+    def _latency_saved_locked(self) -> float:
+        """主請求最終完成者以實際耗時計算；仍在進行者以目前已耗時為下限；被取消或失敗者不計入。"""
+        now = time.perf_counter()
+        saved = 0.0
+        for future, started, won_at in self._wins:
+            if not future.done():
+                saved += max(0.0, now - started - won_at)
+            elif future.exception() is None:
+                saved += max(0.0, future.result()[1] - won_at)
+        return saved
+
+    def stats(self) -> Dict[str, Any]:
+        threshold = self._threshold()
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "backend": self.backend,
+                "threshold_s": round(threshold, 3) if threshold is not None else None,
+                "primaries": self.primaries,
+                "hedges": self.hedges,
+                "hedge_rate": round(self.hedges / self.primaries, 4) if self.primaries else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+                "budget_denied": self.budget_denied,
+                "failover_denied": self.failover_denied,
+                "hedges_declined": self.hedges_declined,
+                "canceled_losers": self.canceled_losers,
+                "latency_saved_s": round(self._latency_saved_locked(), 3),
+                "targets": dict(self.hedge_targets),
+            }
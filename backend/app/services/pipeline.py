@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Generic, Iterable, Optional, TypeVar
+
+
+T = TypeVar("T")
+P = TypeVar("P")
+R = TypeVar("R")
+
+_DONE = object()
+
+
+@dataclass
+class StageStats:
+    items: int = 0
+    busy_s: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, elapsed: float) -> None:
+        with self._lock:
+            self.items += 1
+            self.busy_s += elapsed
+
+    def to_dict(self, wall_s: float, workers: int = 1) -> Dict[str, Any]:
+        capacity = max(1e-9, wall_s * max(1, workers))
+        return {
+            "items": self.items,
+            "busy_s": round(self.busy_s, 3),
+            "utilization": round(min(1.0, self.busy_s / capacity), 3),
+        }
+
+
+class PipelineCanceled(Exception):
+    pass
+
+
+class ChunkPipeline(Generic[T, P, R]):
+    """三段式分塊管線：produce（擷取/編碼）→ consume（送出推論）→ commit（依序寫回 TaskStore）。
+
+    produce 在獨立執行緒中預先處理最多 depth 個分塊並放入有界佇列；consume 由 workers 個執行緒
+    取用；commit 一律在呼叫 run() 的執行緒上依分塊順序執行，因此結果寫回的順序與時間軸一致。
+    workers > 1 時回應可能亂序抵達，先完成者暫存在重組緩衝區；consume 最多領先 commit 2 × workers
+    個分塊，避免單一慢分塊讓緩衝區無限成長。
+    """
+
+    def __init__(
+        self,
+        produce: Callable[[T], P],
+        consume: Callable[[T, P], R],
+        commit: Callable[[T, R], None],
+        *,
+        depth: int = 2,
+        workers: int = 1,
+        should_cancel: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.produce = produce
+        self.consume = consume
+        self.commit = commit
+        self.depth = max(1, int(depth))
+        self.workers = max(1, int(workers))
+        self.should_cancel = should_cancel or (lambda: False)
+        self.produce_stats = StageStats()
+        self.consume_stats = StageStats()
+        self.commit_stats = StageStats()
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=self.depth)
+        self._results: Dict[int, Any] = {}
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._produced = 0
+        self._producer_done = False
+        self._queue_depth_sum = 0
+        self._queue_depth_samples = 0
+        self._wall_s = 0.0
+        self._committed = 0
+        self._max_ahead = self.workers * 2
+        self._active = 0
+        self._max_active = 0
+
+    def _fail(self, exc: BaseException) -> None:
+        with self._cond:
+            if self._error is None:
+                self._error = exc
+            self._stop.set()
+            self._cond.notify_all()
+
+    def _put(self, entry: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(entry, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _producer(self, items: Iterable[T]) -> None:
+        try:
+            for index, item in enumerate(items):
+                if self._stop.is_set():
+                    break
+                t0 = time.perf_counter()
+                payload = self.produce(item)
+                self.produce_stats.add(time.perf_counter() - t0)
+                if not self._put((index, item, payload)):
+                    break
+                with self._cond:
+                    self._produced = index + 1
+        except BaseException as e:  # noqa: BLE001 - 例外交由 run() 重新拋出
+            self._fail(e)
+        finally:
+            with self._cond:
+                self._producer_done = True
+                self._cond.notify_all()
+            for _ in range(self.workers):
+                self._put(_DONE)
+
+    def _consumer(self) -> None:
+        while not self._stop.is_set():
+            try:
+                entry = self._queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if entry is _DONE:
+                return
+            index, item, payload = entry
+            with self._cond:
+                while index >= self._committed + self._max_ahead and not self._stop.is_set():
+                    self._cond.wait(timeout=0.2)
+                if self._stop.is_set():
+                    return
+                self._active += 1
+                self._max_active = max(self._max_active, self._active)
+            try:
+                t0 = time.perf_counter()
+                result = self.consume(item, payload)
+                self.consume_stats.add(time.perf_counter() - t0)
+            except BaseException as e:  # noqa: BLE001
+                self._fail(e)
+                return
+            finally:
+                with self._cond:
+                    self._active -= 1
+            with self._cond:
+                self._results[index] = (item, result)
+                self._cond.notify_all()
+
+    def run(self, items: Iterable[T]) -> Dict[str, Any]:
+        """執行整個管線並回傳各階段統計；任務被取消時拋出 PipelineCanceled。"""
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self._producer, args=(items,), daemon=True)]
+        threads += [threading.Thread(target=self._consumer, daemon=True) for _ in range(self.workers)]
+        for t in threads:
+            t.start()
+
+        next_index = 0
+        try:
+            while True:
+                with self._cond:
+                    while (
+                        next_index not in self._results
+                        and self._error is None
+                        and not (self._producer_done and next_index >= self._produced)
+                    ):
+                        self._cond.wait(timeout=0.5)
+                        if self.should_cancel():
+                            raise PipelineCanceled()
+                    if self._error is not None:
+                        raise self._error
+                    if next_index not in self._results:
+                        break
+                    item, result = self._results.pop(next_index)
+                    self._queue_depth_sum += self._queue.qsize()
+                    self._queue_depth_samples += 1
+                if self.should_cancel():
+                    raise PipelineCanceled()
+                t0 = time.perf_counter()
+                self.commit(item, result)
+                self.commit_stats.add(time.perf_counter() - t0)
+                next_index += 1
+                with self._cond:
+                    self._committed = next_index
+                    self._cond.notify_all()
+        finally:
+            self._stop.set()
+            for t in threads:
+                t.join(timeout=1.0)
+            self._wall_s = time.perf_counter() - started
+        return self.stats()
+
+    def stats(self) -> Dict[str, Any]:
+        wall = self._wall_s
+        return {
+            "wall_s": round(wall, 3),
+            "depth": self.depth,
+            "workers": self.workers,
+            "max_in_flight": self._max_active,
+            "avg_queue_depth": round(self._queue_depth_sum / max(1, self._queue_depth_samples), 2),
+            "produce": self.produce_stats.to_dict(wall),
+            "consume": self.consume_stats.to_dict(wall, self.workers),
+            "commit": self.commit_stats.to_dict(wall),
+        }
@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import httpx
+
+from ..config import settings
+
+
+@dataclass
+class Endpoint:
+    url: str
+    outstanding: int = 0
+    ejected_until: float = 0.0
+    consecutive_failures: int = 0
+    requests: int = 0
+    errors: int = 0
+    capabilities: Dict[str, Any] = field(default_factory=dict)
+    last_check: float = 0.0
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def supports(self, capability: str) -> bool:
+        return bool(self.capabilities.get(capability))
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "available": self.available(now),
+            "ejected_for_s": round(max(0.0, self.ejected_until - now), 1),
+            "requests": self.requests,
+            "errors": self.errors,
+            "model": self.capabilities.get("model"),
+        }
+
+
+class NoEndpointAvailable(RuntimeError):
+    pass
+
+
+# 連線層錯誤與 5xx 視為節點故障：暫時剔除並改送其他節點
+_RETRYABLE_STATUS = {500, 502, 503, 504}
+
+
+class RemotePool:
+    """行程共用的遠端 ASR 節點池：單一連線池化的 httpx.Client，依「未完成請求最少」分派。
+
+    失敗的節點暫時剔除 eject_s 秒，該分塊改送其他節點；背景執行緒定期呼叫各節點 /healthz，
+    恢復的節點重新加入並更新其宣告的能力（pcm_ingest、stream 等）。
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        *,
+        max_connections: int = 32,
+        global_inflight: int = 16,
+        health_interval_s: float = 10.0,
+        startup_timeout_s: float = 2.0,
+        eject_s: float = 30.0,
+        retries: int = 2,
+    ) -> None:
+        if not urls:
+            raise ValueError("至少需要一個遠端節點")
+        self.endpoints = [Endpoint(url=u.rstrip("/")) for u in urls]
+        self.health_interval_s = max(1.0, float(health_interval_s))
+        self.startup_timeout_s = max(0.1, float(startup_timeout_s))
+        self.eject_s = max(0.0, float(eject_s))
+        self.retries = max(0, int(retries))
+        # 同一行程內所有任務共用的遠端請求名額（REMOTE_GLOBAL_INFLIGHT）
+        self.slots = threading.BoundedSemaphore(max(1, global_inflight))
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = httpx.Client(timeout=httpx.Timeout(120.0), limits=limits)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+
+    # ---- 健康檢查 ----
+
+    def check_health(self, endpoint: Endpoint, timeout_s: float = 5.0) -> bool:
+        try:
+            resp = self.client.get(f"{endpoint.url}/healthz", timeout=timeout_s)
+            resp.raise_for_status()
+            info = resp.json()
+        except Exception:
+            self._mark_failure(endpoint)
+            return False
+        with self._lock:
+            endpoint.capabilities = info if isinstance(info, dict) else {}
+            endpoint.last_check = time.time()
+            endpoint.consecutive_failures = 0
+            endpoint.ejected_until = 0.0
+        return True
+
+    def check_all(self, timeout_s: float = 5.0) -> None:
+        """同時檢查所有節點，耗時約為最慢的一個（不超過 timeout_s），不會被無回應的節點逐一累加。"""
+        threads = [
+            threading.Thread(target=self.check_health, args=(e, timeout_s), name="remote-pool-check", daemon=True)
+            for e in self.endpoints
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def start(self) -> None:
+        if self._health_thread is not None:
+            return
+        # 第一個任務需要節點宣告的能力（stream、pcm_ingest）才能選擇送法，因此同步等待，但只等較短的逾時
+        self.check_all(self.startup_timeout_s)
+
+        def loop() -> None:
+            while not self._stop.wait(self.health_interval_s):
+                self.check_all()
+
+        self._health_thread = threading.Thread(target=loop, name="remote-pool-health", daemon=True)
+        self._health_thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        self.client.close()
+
+    # ---- 分派 ----
+
+    def _mark_failure(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.errors += 1
+            endpoint.consecutive_failures += 1
+            # 連續失敗越多次剔除越久，上限為 eject_s 的 8 倍
+            factor = min(8, 2 ** (endpoint.consecutive_failures - 1))
+            endpoint.ejected_until = time.time() + self.eject_s * factor
+
+    def _pick(self, exclude: set[str], require: Optional[str]) -> Endpoint:
+        now = time.time()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.url not in exclude]
+            if require:
+                candidates = [e for e in candidates if e.supports(require)]
+            if not candidates:
+                raise NoEndpointAvailable(f"沒有可用的遠端節點（需要：{require or '任一'}）")
+            available = [e for e in candidates if e.available(now)]
+            if available:
+                chosen = min(available, key=lambda e: (e.outstanding, e.requests))
+            else:
+                # 全部被剔除時仍選最早恢復的節點，避免單節點部署因一次錯誤整批失敗
+                chosen = min(candidates, key=lambda e: e.ejected_until)
+            chosen.outstanding += 1
+            chosen.requests += 1
+            return chosen
+
+    def _release(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.outstanding -= 1
+
+    def available_count(self) -> int:
+        now = time.time()
+        with self._lock:
+            return sum(1 for e in self.endpoints if e.available(now))
+
+    def any_supports(self, capability: str) -> bool:
+        now = time.time()
+        with self._lock:
+            return any(e.supports(capability) and e.available(now) for e in self.endpoints)
+
+    def model_name(self) -> str:
+        """快取鍵使用的模型名稱：節點共用同一模型，增減節點不應讓快取失效。"""
+        if settings.remote_model:
+            return settings.remote_model
+        for e in self.endpoints:
+            if e.capabilities.get("model"):
+                return str(e.capabilities["model"])
+        return ",".join(sorted(e.url for e in self.endpoints))
+
+    def request(
+        self,
+        send: Callable[[httpx.Client, Endpoint], httpx.Response],
+        *,
+        require: Optional[str] = None,
+        exclude: Optional[set[str]] = None,
+    ) -> httpx.Response:
+        """以 send(client, endpoint) 送出請求；節點故障時剔除並改送下一個節點，最多 retries 次。
+
+        回 429 的節點只是忙碌、不剔除：先改試其他節點，全部忙碌時把 429 交回呼叫端依 Retry-After 退避。
+        exclude 為不可使用的節點（例如 hedging 時主請求所在的節點）。
+        """
+        tried: set[str] = set(exclude or ())
+        last_error: Optional[BaseException] = None
+        busy: Optional[httpx.Response] = None
+        for _ in range(self.retries + 1):
+            try:
+                endpoint = self._pick(tried, require)
+            except NoEndpointAvailable:
+                break
+            tried.add(endpoint.url)
+            try:
+                with self.slots:
+                    resp = send(self.client, endpoint)
+            except httpx.TransportError as e:
+                self._mark_failure(endpoint)
+                last_error = e
+                continue
+            finally:
+                self._release(endpoint)
+            if resp.status_code in _RETRYABLE_STATUS:
+                self._mark_failure(endpoint)
+                last_error = httpx.HTTPStatusError(
+                    f"{endpoint.url} 回應 {resp.status_code}", request=resp.request, response=resp
+                )
+                continue
+            if resp.status_code == 429:
+                busy = resp
+                continue
+            with self._lock:
+                endpoint.consecutive_failures = 0
+            return resp
+        if busy is not None:
+            return busy
+        if last_error is not None:
+            raise last_error
+        raise NoEndpointAvailable("沒有可用的遠端節點")
+
+    @contextmanager
+    def stream(self, method: str, path: str, *, require: Optional[str] = None, **kwargs: Any) -> Iterator[httpx.Response]:
+        """串流請求不在中途重試；連線失敗時剔除該節點後拋出，由呼叫端決定是否整段重送。"""
+        endpoint = self._pick(set(), require)
+        try:
+            with self.slots, self.client.stream(method, f"{endpoint.url}{path}", **kwargs) as resp:
+                if resp.status_code in _RETRYABLE_STATUS:
+                    self._mark_failure(endpoint)
+                yield resp
+        except httpx.TransportError:
+            self._mark_failure(endpoint)
+            raise
+        finally:
+            self._release(endpoint)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            return {"endpoints": [e.to_dict(now) for e in self.endpoints]}
+
+
+_pool: Optional[RemotePool] = None
+_pool_lock = threading.Lock()
+
+
+def remote_server_urls() -> List[str]:
+    urls = [u.strip() for u in settings.remote_server_urls.split(",") if u.strip()]
+    return urls or [settings.remote_server_url]
+
+
+def get_remote_pool() -> RemotePool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RemotePool(
+                remote_server_urls(),
+                max_connections=max(1, settings.remote_global_inflight) * 2,
+                global_inflight=settings.remote_global_inflight,
+                health_interval_s=settings.remote_health_interval_s,
+                startup_timeout_s=settings.remote_health_startup_timeout_s,
+                eject_s=settings.remote_eject_seconds,
+                retries=settings.remote_retries,
+            )
+            _pool.start()
+        return _pool
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from ..storage import TaskStore
+
+
+class OrderedTextSink:
+    """把多個同時進行中的分塊串流文字，依分塊順序即時寫入 TaskStore 的 partial_text。
+
+    只有「下一個待提交」的分塊（head）的串流片段會立即顯示；其他分塊的片段先暫存，
+    輪到它成為 head 時一次補上。commit() 必須依分塊順序呼叫（由 ChunkPipeline 保證）。
+    hold() 之後該分塊的片段只暫存、到 commit 才以最終結果寫入，用於結果可能改由 hedging 備援決定的分塊。
+    """
+
+    def __init__(self, task_id: str) -> None:
+        self.task_id = task_id
+        self._lock = threading.Lock()
+        self._head = 0
+        self._pending: Dict[int, str] = {}
+        self._held: Set[int] = set()
+        # head 分塊已寫入 partial_text 的字數
+        self._shown = 0
+
+    def feed(self, index: int, delta: str) -> None:
+        if not delta:
+            return
+        with self._lock:
+            if index < self._head:
+                return
+            self._pending[index] = self._pending.get(index, "") + delta
+            if index == self._head and index not in self._held:
+                TaskStore.update_partial_text(self.task_id, delta, append=True)
+                self._shown += len(delta)
+
+    def hold(self, index: int) -> bool:
+        """停止即時顯示分塊 index 的片段；已有片段顯示時回傳 False（此時改寫結果會讓所有用戶端重設游標）。"""
+        with self._lock:
+            if index < self._head or (index == self._head and self._shown):
+                return False
+            self._held.add(index)
+            return True
+
+    def reset(self, index: int) -> None:
+        """分塊重試前清掉先前嘗試已串流的片段。"""
+        with self._lock:
+            self._pending.pop(index, None)
+            if index == self._head:
+                self._rollback_locked()
+
+    def commit(
+        self,
+        index: int,
+        text: str,
+        *,
+        segments: Optional[List[Dict[str, Any]]] = None,
+        progress: Optional[float] = None,
+    ) -> None:
+        """提交分塊 index 的最終文字，連同其 segments 與進度以一次 commit_chunk 寫入。"""
+        with self._lock:
+            if index != self._head:
+                raise RuntimeError(f"分塊 {index} 未依序提交（目前應為 {self._head}）")
+            streamed = self._pending.pop(index, "")[: self._shown]
+            if text.startswith(streamed):
+                appended = text[len(streamed) :]
+            else:
+                # 最終結果與已顯示的片段不一致（例如失敗後回傳空字串）：改以最終結果為準
+                self._rollback_locked()
+                appended = text
+            self._held.discard(index)
+            self._head += 1
+            # 下一個分塊已串流的片段一併補上
+            ahead = "" if self._head in self._held else self._pending.get(self._head, "")
+            self._shown = len(ahead)
+            TaskStore.commit_chunk(self.task_id, segments=segments or [], text=appended + ahead, progress=progress)
+
+    def _rollback_locked(self) -> None:
+        if not self._shown:
+            return
+        task = TaskStore.get_task(self.task_id)
+        if task is not None:
+            current = task.get("partial_text", "")
+            TaskStore.update_partial_text(self.task_id, current[: len(current) - self._shown], append=False)
+        self._shown = 0
@@ -1,121 +1,394 @@
 from __future__ import annotations
 
-import os
+import json
+import threading
 import time
-import tempfile
-from typing import Optional
+from typing import Any, Callable, Iterator, Optional
 
 import httpx
 
+from ..cache import ChunkCache, get_chunk_cache
 from ..config import settings
-from ..storage import TaskStore
-from ..utils.formatting import parse_hhmmss
-from ..utils.ffmpeg import (
-    ensure_ffmpeg_available,
-    ffprobe_duration_seconds,
-    ffmpeg_extract_segment_to_wav,
-)
+from ..storage import TaskStore, file_sha256
+from ..utils.audio import SAMPLE_RATE, PcmBuffer, pcm_to_wav_bytes
+from ..utils.pcm_store import decode_range_to_store
+from ..utils.workspace import TaskWorkspace
+from .chunking import plan_chunks, requested_time_range
+from .pipeline import ChunkPipeline, PipelineCanceled
+from .hedging import HedgeCanceled, Hedger
+from .remote_pool import Endpoint, RemotePool, get_remote_pool
 
 
-def _resolve_time_range(total_seconds: float, start_time_str: Optional[str], end_time_str: Optional[str]) -> tuple[float, float]:
-    start_s = parse_hhmmss(start_time_str) if start_time_str else 0.0
-    end_s = parse_hhmmss(end_time_str) if end_time_str else total_seconds
-    start_s = max(0.0, min(start_s, total_seconds))
-    end_s = max(start_s, min(end_s, total_seconds))
-    return start_s, end_s
+def _commit_remote_chunks(
+    task_id: str, chunks: list[dict[str, Any]], offset: float, start_s: float, progress: Optional[float] = None
+) -> None:
+    """
+    chunks =
+    [
+        {
+        "text": "中文範例說明。",
+        "timestamp": [
+            0 | None,
+            2.56 | None
+        ]
+        }
+    ]
+    """
+    concatenated_text = ""
+    segments = []
+    for chunk in chunks:
+        text = str(chunk.get("text", ""))
+        timestamp = chunk.get("timestamp", (None, None))
+        start_chunk = offset - start_s + (timestamp[0] if timestamp and timestamp[0] is not None else 0)
+        end_chunk = offset - start_s + (timestamp[1] if timestamp and timestamp[1] is not None else 30)
+
+        segments.append({"start": start_chunk, "end": end_chunk, "text": text})
+        concatenated_text += text + " "
+
+    # segments、partial_text 與進度一次寫入（Redis 下為單次往返）
+    TaskStore.commit_chunk(task_id, segments=segments, text=concatenated_text.strip(), progress=progress)
+
+
+def _accepts_pcm(endpoint: Endpoint) -> bool:
+    if not settings.remote_pcm_ingest:
+        return False
+    info = endpoint.capabilities.get("pcm_ingest") or {}
+    return "s16le" in (info.get("formats") or [])
+
+
+def _model_params() -> dict[str, str]:
+    return {"model": settings.remote_model} if settings.remote_model else {}
+
+
+def _post_chunk(client: httpx.Client, endpoint: Endpoint, payload: dict[str, Any]) -> httpx.Response:
+    """payload["pcm"] 為原始 int16 PCM；節點宣告支援時直接上傳，否則包成 WAV 走 multipart。"""
+    if _accepts_pcm(endpoint):
+        # 伺服器直接轉成陣列，省去暫存檔與第二次 ffmpeg 解碼
+        resp = client.post(
+            f"{endpoint.url}/transcribe/pcm",
+            params=_model_params(),
+            content=payload["pcm"],
+            headers={
+                "Content-Type": "application/octet-stream",
+                "X-Sample-Rate": str(SAMPLE_RATE),
+                "X-Sample-Format": "s16le",
+            },
+        )
+        if resp.status_code not in (404, 405):
+            return resp
+        # 端點不存在（例如節點已換成舊版伺服器）時退回 WAV 上傳
+    files = {"file": ("chunk.wav", pcm_to_wav_bytes(payload["pcm"]), "audio/wav")}
+    return client.post(f"{endpoint.url}/transcribe/", params=_model_params(), files=files)
+
+
+_MAX_BACKOFF_S = 30.0
+
+
+def _retry_after_seconds(resp: httpx.Response) -> float:
+    try:
+        return min(_MAX_BACKOFF_S, max(0.5, float(resp.headers.get("Retry-After", "1"))))
+    except ValueError:
+        return 1.0
+
 
+def _send_with_backoff(
+    send: Callable[[], httpx.Response], cancel: Optional[threading.Event] = None
+) -> httpx.Response:
+    """所有節點的佇列都已滿（429）時依 Retry-After 等待後重送；等待期間不佔用並行名額。"""
+    for attempt in range(max(0, settings.remote_busy_retries) + 1):
+        resp = send()
+        if resp.status_code != 429 or attempt >= settings.remote_busy_retries:
+            return resp
+        delay = _retry_after_seconds(resp)
+        if cancel is None:
+            time.sleep(delay)
+        elif cancel.wait(delay):
+            raise HedgeCanceled()
+    return resp
+
+
+def request_chunk(
+    pool: RemotePool,
+    pcm: bytes,
+    *,
+    exclude: Optional[set[str]] = None,
+    cancel: Optional[threading.Event] = None,
+    on_endpoint: Optional[Callable[[str], None]] = None,
+) -> list[dict[str, Any]]:
+    """把一個 PCM 分塊送到節點池並回傳 chunks；cancel 被設定時不再送出（hedging 的輸家）。"""
+    payload = {"pcm": pcm}
+
+    def send(client: httpx.Client, endpoint: Endpoint) -> httpx.Response:
+        if cancel is not None and cancel.is_set():
+            raise HedgeCanceled()
+        if on_endpoint is not None:
+            on_endpoint(endpoint.url)
+        return _post_chunk(client, endpoint, payload)
+
+    resp = _send_with_backoff(lambda: pool.request(send, exclude=exclude), cancel)
+    resp.raise_for_status()
+    return resp.json().get("chunks", [])
+
+
+def chunks_text(chunks: list[dict[str, Any]]) -> str:
+    return " ".join(str(c.get("text", "")) for c in chunks).strip()
+
+
+def _hedge_target(pool: RemotePool) -> Optional[str]:
+    """auto：有多個節點時改送另一個節點，否則改送 Vertex。"""
+    target = (settings.hedge_target or "auto").lower()
+    if target in ("auto", "endpoint") and len(pool.endpoints) > 1:
+        return "endpoint"
+    if target in ("auto", "backend"):
+        return "backend"
+    return None
+
+
+_STREAM_BLOCK = 1024 * 1024
+
+
+def _iter_pcm_blocks(view: memoryview) -> Iterator[bytes]:
+    for i in range(0, len(view), _STREAM_BLOCK):
+        yield bytes(view[i : i + _STREAM_BLOCK])
+
+
+def _transcribe_stream(
+    task_id: str,
+    pool: RemotePool,
+    pcm: PcmBuffer,
+    start_s: float,
+    end_s: float,
+    chunk_length_s: float,
+    cache: Optional[ChunkCache],
+    content_hash: str,
+) -> bool:
+    """整段送到 /transcribe/stream，逐行寫回 TaskStore；任務被取消時回傳 False。"""
+    total = end_s - start_s
+    params = {"chunk_length_s": chunk_length_s, "stride_length_s": round(chunk_length_s / 6.0, 3), **_model_params()}
+    key = None
+    if cache is not None:
+        key = ChunkCache.make_key(
+            content_hash, start_s, total, backend="remote_llm_stream", model=pool.model_name(), params=params
+        )
 
-def _iter_offsets(start_s: float, end_s: float, chunk_length_s: float):
-    chunk = max(1.0, float(chunk_length_s))
-    offset = float(start_s)
-    while offset < end_s:
-        remain = end_s - offset
-        duration = min(chunk, remain)
-        yield offset, duration
-        offset += duration
+    def commit_line(msg: dict[str, Any]) -> None:
+        offset = start_s + float(msg.get("offset", 0.0))
+        processed = float(msg.get("offset", 0.0)) + float(msg.get("duration", 0.0))
+        _commit_remote_chunks(
+            task_id, msg.get("chunks", []), offset, start_s, progress=min(100.0, processed / total * 100.0)
+        )
+
+    started = time.perf_counter()
+    cached = cache.get(key) if cache is not None and key else None
+    if cached is not None:
+        for msg in cached:
+            commit_line(msg)
+        TaskStore.update_meta(task_id, "pipeline", {"mode": "stream", "lines": len(cached), "cached": True})
+        return True
+
+    lines: list[dict[str, Any]] = []
+    first_line_s = None
+    done = False
+    headers = {"Content-Type": "application/octet-stream", "X-Sample-Rate": str(SAMPLE_RATE), "X-Sample-Format": "s16le"}
+    # 整段可能要推論數分鐘，讀取逾時只限制「兩行之間」的間隔而非整個請求
+    timeout = httpx.Timeout(120.0, read=600.0)
+    attempts = max(0, settings.remote_busy_retries) + pool.retries + 1
+    for attempt in range(attempts):
+        delay = None
+        try:
+            with pool.stream(
+                "POST",
+                "/transcribe/stream",
+                require="stream",
+                content=_iter_pcm_blocks(pcm.slice(start_s, total)),
+                headers=headers,
+                params=params,
+                timeout=timeout,
+            ) as resp:
+                if resp.status_code == 429 and attempt < attempts - 1:
+                    # 節點佇列已滿：在名額外等待 Retry-After 後整段重送
+                    delay = _retry_after_seconds(resp)
+                else:
+                    resp.raise_for_status()
+                    for raw_line in resp.iter_lines():
+                        if not raw_line.strip():
+                            continue
+                        msg = json.loads(raw_line)
+                        kind = msg.get("type")
+                        if kind == "error":
+                            raise RuntimeError(f"遠端串流推論失敗：{msg.get('message')}")
+                        if kind == "done":
+                            done = True
+                            break
+                        if TaskStore.is_canceled(task_id):
+                            return False
+                        if first_line_s is None:
+                            first_line_s = time.perf_counter() - started
+                        commit_line(msg)
+                        lines.append(msg)
+        except httpx.TransportError:
+            # 尚未寫回任何結果時可整段改送其他節點；已寫回部分結果則不重送以免重複
+            if lines or attempt >= attempts - 1:
+                raise
+            continue
+        if delay is None:
+            break
+        time.sleep(delay)
+    if not done:
+        raise RuntimeError("遠端串流在完成前中斷")
+    if cache is not None and key and all(_is_cacheable(m.get("chunks", [])) for m in lines):
+        cache.put(key, lines)
+    TaskStore.update_meta(
+        task_id,
+        "pipeline",
+        {
+            "mode": "stream",
+            "lines": len(lines),
+            "first_line_s": round(first_line_s or 0.0, 3),
+            "wall_s": round(time.perf_counter() - started, 3),
+        },
+    )
+    return True
+
+
+def _is_cacheable(chunks: list[dict[str, Any]]) -> bool:
+    # 遠端伺服器發生例外時仍回 200，內容為 "Error: ..."，這類結果不可快取
+    return not any(str(c.get("text", "")).startswith("Error:") for c in chunks)
 
 
 def transcribe_with_remote_llm(
     task_id: str,
-    raw_bytes: bytes,
+    src_path: str,
     start_time: Optional[str] = None,
     end_time: Optional[str] = None,
     chunk_length_s: float = 30.0,
+    content_sha256: Optional[str] = None,
+    chunking: Optional[str] = None,
+    vertex_params: Optional[dict[str, Any]] = None,
 ) -> None:
+    """vertex_params 為任務的 Vertex 參數（language_code、top_p 等），只在 hedging 改送 Vertex 時使用。"""
+    store = None
+    # 任務的暫存檔（解碼後的 PCM store）都放在工作區，結束時整個刪除並受容量上限約束
+    workspace = TaskWorkspace(task_id)
     try:
-        ensure_ffmpeg_available()
-
-        # 將原始 bytes 落地為暫存檔，交由 ffmpeg 處理
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".bin") as src:
-            src.write(raw_bytes)
-            src_path = src.name
-
-        total_seconds = ffprobe_duration_seconds(src_path)
-        start_s, end_s = _resolve_time_range(total_seconds, start_time, end_time)
+        # 來源檔由呼叫端（spool）負責保存與清除；整個區段只解碼一次，各分塊為其切片
+        requested_start, requested_end = requested_time_range(start_time, end_time)
+        # 解碼結果寫入 mmap 檔，分塊只是其中的切片，長錄音也不會佔滿 Python heap
+        store = decode_range_to_store(src_path, requested_start, requested_end, workspace=workspace)
+        pcm = store.buffer
+        start_s, end_s = pcm.offset_s, pcm.end_s
         if end_s - start_s <= 0.0:
             TaskStore.mark_failed(task_id, error_message="音訊長度為 0，請確認檔案或時間區段設定。")
-            os.remove(src_path)
             return
+        # vad 模式只送出含語音的區段；offset 仍為絕對秒數，時間軸換算不變
+        spans, chunking_stats = plan_chunks(store, start_s, end_s, chunk_length_s, chunking)
+        TaskStore.update_meta(task_id, "chunking", chunking_stats)
 
-        processed = 0.0
-
-        with httpx.Client(base_url=settings.remote_server_url, timeout=httpx.Timeout(120.0)) as client:
-            for offset, duration in _iter_offsets(start_s, end_s, chunk_length_s):
-                if TaskStore.is_canceled(task_id):
-                    TaskStore.mark_failed(task_id, error_message="任務已取消")
-                    return
-                chunk_wav = ffmpeg_extract_segment_to_wav(src_path, offset_seconds=offset, duration_seconds=duration)
-                try:
-                    with open(chunk_wav, "rb") as f:
-                        files = {"file": ("chunk.wav", f, "audio/wav")}
-                        resp = client.post("/transcribe/", files=files)
-                    resp.raise_for_status()
-                    data = resp.json()
-                    """
-                    data =
-                    {
-                        "chunks": [
-                            {
-                            "text": "中文範例說明。",
-                            "timestamp": [
-                                0 | None, 
-                                2.56 | None
-                            ]
-                            }
-                        ]
-                    }
-                    """
-                    chunks = data.get("chunks", [])
-                    concatenated_text = ""
-                    for chunk in chunks:
-                        text = str(chunk.get("text", ""))
-                        timestamp = chunk.get("timestamp", (None, None))
-                        start_chunk = offset - start_s + (timestamp[0] if timestamp and timestamp[0] is not None else 0)
-                        end_chunk = offset - start_s + (timestamp[1] if timestamp and timestamp[1] is not None else 30)
-
-                        TaskStore.append_segment(task_id, start=start_chunk, end=end_chunk, text=text)
-                        concatenated_text += text + " "
-
-                    TaskStore.update_partial_text(task_id, concatenated_text.strip(), append=True)
-
-                    processed = offset + duration - start_s
-                    progress = (processed / (end_s - start_s)) * 100.0
-                    TaskStore.update_progress(task_id, progress=progress)
-                finally:
-                    try:
-                        os.remove(chunk_wav)
-                    except Exception:
-                        pass
-
-                time.sleep(0.05)
+        # 行程共用的節點池：連線重複使用，分塊依各節點未完成請求數分派
+        pool = get_remote_pool()
+        cache = get_chunk_cache()
+        content_hash = (content_sha256 or file_sha256(src_path)) if cache is not None else ""
+        cache_model = pool.model_name()
+
+        def cache_key_for(offset: float, duration: float) -> Optional[str]:
+            if cache is None:
+                return None
+            return ChunkCache.make_key(content_hash, offset, duration, backend="remote_llm", model=cache_model)
+
+        # 串流模式需有節點支援且為連續的固定分塊；vad 的不連續區段仍逐塊送出
+        if settings.remote_mode == "stream" and pool.any_supports("stream") and chunking_stats.get("mode") == "fixed":
+            TaskStore.update_meta(task_id, "remote_ingest", "stream")
+            if not _transcribe_stream(task_id, pool, pcm, start_s, end_s, chunk_length_s, cache, content_hash):
+                TaskStore.mark_failed(task_id, error_message="任務已取消")
+                return
+            TaskStore.mark_completed(task_id)
+            return
+
+        inflight = max(1, settings.remote_inflight)
+        routed: dict[str, int] = {}
+        routed_lock = threading.Lock()
+
+        def produce(span: tuple[float, float]) -> dict[str, Any]:
+            # 命中快取的分塊不需要產生音訊
+            offset, duration = span
+            key = cache_key_for(offset, duration)
+            cached = cache.get(key) if cache is not None and key else None
+            if cached is not None:
+                return {"cached": cached}
+            return {"key": key, "pcm": bytes(pcm.slice(offset, duration))}
+
+        hedger: Hedger = Hedger("remote_llm", workers=inflight)
+        hedge_target = _hedge_target(pool)
+
+        def consume(span: tuple[float, float], payload: dict[str, Any]) -> list[dict[str, Any]]:
+            if "cached" in payload:
+                return payload["cached"]
+            served: list[str] = []
+
+            def routed_to(url: str) -> None:
+                served.append(url)
+                with routed_lock:
+                    routed[url] = routed.get(url, 0) + 1
+
+            def primary(cancel: threading.Event) -> list[dict[str, Any]]:
+                return request_chunk(pool, payload["pcm"], cancel=cancel, on_endpoint=routed_to)
+
+            hedge = None
+            if hedge_target == "endpoint":
+                # 備援送到主請求以外的節點
+                def hedge(cancel: threading.Event) -> list[dict[str, Any]]:
+                    return request_chunk(pool, payload["pcm"], exclude=set(served), cancel=cancel, on_endpoint=routed_to)
+
+            elif hedge_target == "backend":
+                def hedge(cancel: threading.Event) -> list[dict[str, Any]]:
+                    from .transcription_vertex import transcribe_chunk_vertex
+
+                    text = transcribe_chunk_vertex(
+                        task_id, payload["pcm"], span[1], cancel=cancel, **(vertex_params or {})
+                    )
+                    return [{"text": text, "timestamp": [0.0, span[1]]}] if text.strip() else []
+
+            chunks, hedged = hedger.call(
+                primary,
+                hedge,
+                hedge_backend="vertex_ai" if hedge_target == "backend" else "remote_llm",
+                hedge_label=hedge_target,
+            )
+            # Vertex 勝出的結果不寫入 remote_llm 的快取
+            from_other_backend = hedged and hedge_target == "backend"
+            if cache is not None and payload["key"] and _is_cacheable(chunks) and not from_other_backend:
+                cache.put(payload["key"], chunks)
+            return chunks
+
+        # 多個分塊同時送出、回應可能亂序；commit 由管線依時間軸順序呼叫，進度只反映已寫回的分塊
+        def commit(span: tuple[float, float], chunks: list[dict[str, Any]]) -> None:
+            offset, duration = span
+            processed = offset + duration - start_s
+            _commit_remote_chunks(task_id, chunks, offset, start_s, progress=(processed / (end_s - start_s)) * 100.0)
+
+        pipeline = ChunkPipeline(
+            produce,
+            consume,
+            commit,
+            depth=max(settings.pipeline_prefetch_depth, inflight),
+            workers=inflight,
+            should_cancel=lambda: TaskStore.is_canceled(task_id),
+        )
+        try:
+            pipeline.run(spans)
+        except PipelineCanceled:
+            TaskStore.mark_failed(task_id, error_message="任務已取消")
+            return
+        finally:
+            TaskStore.update_meta(task_id, "pipeline", pipeline.stats())
+            TaskStore.update_meta(task_id, "remote_endpoints", routed)
+            TaskStore.update_meta(task_id, "hedging", hedger.stats())
+            hedger.close()
 
         TaskStore.mark_completed(task_id)
     except Exception as e:
         TaskStore.mark_failed(task_id, error_message=str(e))
     finally:
-        try:
-            os.remove(src_path)  # type: ignore[name-defined]
-        except Exception:
-            pass
-
-
+        if store is not None:
+            store.close()
+        workspace.cleanup()
@@ -1,47 +1,33 @@
 from __future__ import annotations
 
+import json
+import threading
 import time
-import tempfile
 from typing import Optional
 
-from ..storage import TaskStore
-from ..utils.formatting import parse_hhmmss
+from ..cache import ChunkCache, get_chunk_cache
+from ..storage import TaskStore, file_sha256
 from ..config import settings
-from ..utils.ffmpeg import (
-    ensure_ffmpeg_available,
-    ffprobe_duration_seconds,
-    ffmpeg_extract_segment_to_wav,
+from ..utils.audio import encode_pcm_payload
+from ..utils.pcm_store import decode_range_to_store
+from ..utils.workspace import TaskWorkspace
+from .chunking import plan_chunks, requested_time_range
+from .pipeline import ChunkPipeline, PipelineCanceled
+from .hedging import HedgeCanceled, Hedger
+from .text_sink import OrderedTextSink
+from .vertex_client import (
+    StreamIdleTimeout,
+    VertexCallStats,
+    call_with_retries,
+    estimate_tokens,
+    get_genai_client,
+    get_rate_limiter,
+    iter_with_idle_timeout,
 )
-from google import genai
 from google.genai import types
 
 
-def _predict_chunk_with_vertex(
-    task_id: str,
-    wav_bytes: bytes,
-    language_code: str,
-    *,
-    stream_timeout_s: float = 30.0,
-    prompt: str | None = None,
-    temperature: float = 0.7,  # 降低溫度以減少重複
-    top_p: float = 0.9,        # 稍微降低top_p
-    max_output_tokens: int = 65535,
-    thinking_budget: int = 0,
-    safety_off: bool = True,
-) -> str:
-    client = genai.Client(
-        vertexai=True,
-        project=settings.vertex_project,
-        location=(settings.vertex_location or "global"),
-    )
-
-    try:
-        audio_part = types.Part.from_bytes(data=wav_bytes, mime_type="audio/wav")
-    except Exception:
-        audio_part = types.Part.from_data(data=wav_bytes, mime_type="audio/wav")  # type: ignore
-
-
-    si_text = """Your task is to be an expert transcriptionist.
+_SYSTEM_INSTRUCTION = """Your task is to be an expert transcriptionist.
 Provide a direct transcription of the audio file. The output must ONLY contain the transcribed text.
 You MUST NOT output any preambles, notes, introductions, or self-references. For example, your output must never start with phrases like "The content of this audio is:", "Here is the transcription:", or in Chinese "這段音訊的內容是：".
 
@@ -51,23 +37,56 @@ Key requirements:
 3. CRITICAL: Avoid repeating the same phrases or words. Ensure the output is clean and non-repetitive.
 """
 
-    # 內容：音訊 + 提示（可自訂）
-    contents = [
-        types.Content(
-            role="user",
-            parts=[
-                audio_part,
-                types.Part.from_text(text='逐字稿：')
-                ],
-        )
-    ]
+# 打包模式：多段音訊放在同一個請求，各自以 [chunk i] 標記，回傳依編號對應的 JSON
+_PACKED_INSTRUCTION = """
+You will receive several consecutive audio clips. Each clip is preceded by a marker such as [chunk 0].
+Transcribe every clip independently and return a JSON array with one object per clip: {"index": <marker number>, "text": <transcription>}.
+Use an empty string for clips without speech. Never merge clips or move words between clips.
+"""
+
+_PACKED_RESPONSE_SCHEMA = types.Schema(
+    type=types.Type.ARRAY,
+    items=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "index": types.Schema(type=types.Type.INTEGER),
+            "text": types.Schema(type=types.Type.STRING),
+        },
+        required=["index", "text"],
+    ),
+)
+
+# 單一分塊的輸出上限；打包時依分塊數放大
+_CHUNK_OUTPUT_TOKENS = 500
+
+
+# 單一分塊請求的使用者提示（接在音訊之後）
+_TRANSCRIBE_PROMPT = "逐字稿："
+
+
+def _audio_part(audio_bytes: bytes, mime_type: str) -> types.Part:
+    try:
+        return types.Part.from_bytes(data=audio_bytes, mime_type=mime_type)
+    except Exception:
+        return types.Part.from_data(data=audio_bytes, mime_type=mime_type)  # type: ignore
 
-    generate_content_config = types.GenerateContentConfig(
+
+def _generate_content_config(
+    top_p: float,
+    *,
+    max_output_tokens: int = _CHUNK_OUTPUT_TOKENS,
+    system_text: str = _SYSTEM_INSTRUCTION,
+    response_schema: Optional[types.Schema] = None,
+) -> types.GenerateContentConfig:
+    extra = {}
+    if response_schema is not None:
+        extra.update(response_mime_type="application/json", response_schema=response_schema)
+    return types.GenerateContentConfig(
         temperature = 0.1,
         frequency_penalty=0.7,  # 關鍵：增加一個正值來懲罰重複
         presence_penalty=0.5,       # 關鍵：增加一個正值來鼓勵新詞彙
         top_p = top_p,
-        max_output_tokens = 500,
+        max_output_tokens = max_output_tokens,
         safety_settings = [types.SafetySetting(
         category="HARM_CATEGORY_HATE_SPEECH",
         threshold="OFF"
@@ -81,38 +100,309 @@ Key requirements:
         category="HARM_CATEGORY_HARASSMENT",
         threshold="OFF"
         )],
-        system_instruction=[types.Part.from_text(text=si_text)],
+        system_instruction=[types.Part.from_text(text=system_text)],
         #thinking_config=types.ThinkingConfig(thinking_budget=thinking_budget,),
+        **extra,
     )
-    
-    caught_error: list[Exception] = []
-    
-    try:
-        response = client.models.generate_content(
-        model = settings.vertex_genai_model,
-        contents = contents,
-        config = generate_content_config,
+
+
+def _generate(
+    task_id: str,
+    contents: list,
+    config: types.GenerateContentConfig,
+    *,
+    duration_s: float,
+    call_stats: VertexCallStats,
+    cancel: Optional[threading.Event] = None,
+):
+    """送出一次 generate_content（含限流與重試），累計 token 後回傳 (response, prompt_tokens)。"""
+    client = get_genai_client()
+    limiter = get_rate_limiter()
+    estimated_tokens = estimate_tokens(duration_s)
+
+    def attempt():
+        # 每次嘗試（含重試）都先取得 RPM / TPM 額度
+        call_stats.record_request(limiter.acquire(estimated_tokens))
+        _check_canceled(cancel)
+        return client.models.generate_content(
+            model=settings.vertex_genai_model,
+            contents=contents,
+            config=config,
         )
 
-        TaskStore.update_partial_text(task_id, response.text, append=True)
+    started = time.perf_counter()
+    response = call_with_retries(
+        attempt,
+        retries=settings.vertex_retries,
+        base_s=settings.vertex_backoff_base_s,
+        max_s=settings.vertex_backoff_max_s,
+        on_retry=lambda e, _delay: call_stats.record_retry(e),
+    )
+    call_stats.record_latency(time.perf_counter() - started)
+
+    # partial_text 由管線的 commit 階段依分塊順序寫入，這裡只累計 token
+    prompt_tokens = _account_usage(task_id, getattr(response, "usage_metadata", None) if response else None, estimated_tokens)
+    return response, prompt_tokens
+
+
+def _check_canceled(cancel: Optional[threading.Event]) -> None:
+    if cancel is not None and cancel.is_set():
+        raise HedgeCanceled()
+
+
+def _account_usage(task_id: str, usage, estimated_tokens: int) -> Optional[int]:
+    if not usage:
+        return None
+    prompt_tokens = int(getattr(usage, "prompt_token_count", 0) or 0)
+    output_tokens = int(getattr(usage, "candidates_token_count", 0) or 0)
+    TaskStore.increment_tokens(task_id, input_tokens=prompt_tokens, output_tokens=output_tokens)
+    get_rate_limiter().settle(estimated_tokens, prompt_tokens + output_tokens)
+    return prompt_tokens
 
-        if response and hasattr(response, "usage_metadata") and response.usage_metadata:
-            TaskStore.increment_tokens(
+
+def _generate_stream(
+    task_id: str,
+    contents: list,
+    config: types.GenerateContentConfig,
+    *,
+    duration_s: float,
+    call_stats: VertexCallStats,
+    idle_timeout_s: float,
+    sink: Optional[OrderedTextSink],
+    chunk_index: int,
+    cancel: Optional[threading.Event] = None,
+) -> str:
+    """以 generate_content_stream 取得逐字稿，文字片段一到就交給 sink；usage 取自最後一個片段。
+
+    兩個片段間超過 idle_timeout_s 秒沒有資料視為連線卡住，與 429/5xx 一樣退避重試，
+    重試前先清掉該分塊已顯示的片段。
+    """
+    client = get_genai_client()
+    limiter = get_rate_limiter()
+    estimated_tokens = estimate_tokens(duration_s)
+    # 底層 HTTP read timeout 與閒置逾時一致，被放棄的串流也會在同一時間關閉連線
+    config = config.model_copy(update={"http_options": types.HttpOptions(timeout=int(idle_timeout_s * 1000))})
+
+    def attempt():
+        if sink is not None:
+            sink.reset(chunk_index)
+        call_stats.record_request(limiter.acquire(estimated_tokens))
+        _check_canceled(cancel)
+        sent = time.perf_counter()
+        pieces: list[str] = []
+        usage = None
+        stream = client.models.generate_content_stream(
+            model=settings.vertex_genai_model,
+            contents=contents,
+            config=config,
+        )
+        try:
+            for piece in iter_with_idle_timeout(stream, idle_timeout_s):
+                # hedging 的另一方已勝出時停止讀取
+                _check_canceled(cancel)
+                usage = getattr(piece, "usage_metadata", None) or usage
+                delta = piece.text or ""
+                if not delta:
+                    continue
+                if not pieces:
+                    call_stats.record_first_text(time.perf_counter() - sent)
+                pieces.append(delta)
+                if sink is not None:
+                    sink.feed(chunk_index, delta)
+        except StreamIdleTimeout:
+            call_stats.record_idle_timeout()
+            raise
+        return "".join(pieces), usage
+
+    started = time.perf_counter()
+    text, usage = call_with_retries(
+        attempt,
+        retries=settings.vertex_retries,
+        base_s=settings.vertex_backoff_base_s,
+        max_s=settings.vertex_backoff_max_s,
+        on_retry=lambda e, _delay: call_stats.record_retry(e),
+    )
+    call_stats.record_latency(time.perf_counter() - started)
+    _account_usage(task_id, usage, estimated_tokens)
+    return text
+
+
+def _predict_chunk_with_vertex(
+    task_id: str,
+    audio_bytes: bytes,
+    language_code: str,
+    *,
+    stream_timeout_s: float = 30.0,
+    prompt: str | None = None,
+    temperature: float = 0.7,  # 降低溫度以減少重複
+    top_p: float = 0.9,        # 稍微降低top_p
+    max_output_tokens: int = 65535,
+    thinking_budget: int = 0,
+    safety_off: bool = True,
+    duration_s: float = 30.0,
+    call_stats: Optional[VertexCallStats] = None,
+    mime_type: str = "audio/wav",
+    sink: Optional[OrderedTextSink] = None,
+    chunk_index: int = 0,
+    cancel: Optional[threading.Event] = None,
+    raise_errors: bool = False,
+) -> str:
+    """stream_timeout_s 為串流模式（VERTEX_STREAM）下兩個回應片段間的閒置逾時。
+
+    預設失敗時回傳空字串；raise_errors=True 時改為拋出，讓 hedging 可以改用另一個後端。
+    """
+    call_stats = call_stats or VertexCallStats()
+
+    # 內容：音訊 + 提示（可自訂）
+    contents = [
+        types.Content(
+            role="user",
+            parts=[
+                _audio_part(audio_bytes, mime_type),
+                types.Part.from_text(text=_TRANSCRIBE_PROMPT)
+                ],
+        )
+    ]
+
+    try:
+        if settings.vertex_stream:
+            return _generate_stream(
                 task_id,
-                input_tokens=int(getattr(response.usage_metadata, "prompt_token_count", 0)),
-                output_tokens=int(getattr(response.usage_metadata, "candidates_token_count", 0)),
+                contents,
+                _generate_content_config(top_p),
+                duration_s=duration_s,
+                call_stats=call_stats,
+                idle_timeout_s=stream_timeout_s,
+                sink=sink,
+                chunk_index=chunk_index,
+                cancel=cancel,
             )
-
+        response, _ = _generate(
+            task_id, contents, _generate_content_config(top_p), duration_s=duration_s, call_stats=call_stats, cancel=cancel
+        )
         # 返回完整的轉錄文本
         return response.text
-        
-    except Exception as e:
-        caught_error.append(e)
+
+    except HedgeCanceled:
+        raise
+    except Exception:
+        # 重試用盡或不可重試的錯誤：該分塊以空字串提交，不中斷整個任務
+        call_stats.record_failure()
+        if raise_errors:
+            raise
         return ""
 
+
+def transcribe_chunk_vertex(
+    task_id: str,
+    pcm: bytes,
+    duration_s: float,
+    *,
+    language_code: str = "zh-TW",
+    prompt: str | None = None,
+    temperature: float = 0,
+    top_p: float = 0.95,
+    max_output_tokens: int = 65535,
+    thinking_budget: int = 0,
+    safety_off: bool = True,
+    codec: Optional[str] = None,
+    cancel: Optional[threading.Event] = None,
+) -> str:
+    """以 Vertex 轉錄單一 PCM 分塊（供其他後端 hedging / failover 使用），失敗時拋出例外。
+
+    參數與 transcribe_with_vertex_ai 相同，由呼叫端傳入任務本身的設定；codec 未指定時依 VERTEX_AUDIO_CODEC。
+    """
+    codec = (codec or settings.vertex_audio_codec or "wav").lower()
+    audio, mime_type = encode_pcm_payload(pcm, codec, bitrate_kbps=settings.vertex_opus_bitrate_kbps)
+    return _predict_chunk_with_vertex(
+        task_id,
+        audio,
+        language_code=language_code,
+        stream_timeout_s=settings.vertex_stream_idle_timeout_s,
+        prompt=prompt,
+        temperature=temperature,
+        top_p=top_p,
+        max_output_tokens=max_output_tokens,
+        thinking_budget=thinking_budget,
+        safety_off=safety_off,
+        duration_s=duration_s,
+        mime_type=mime_type,
+        cancel=cancel,
+        raise_errors=True,
+    )
+
+
+def _parse_packed_response(text: str, count: int) -> list[Optional[str]]:
+    """把打包回應拆回各分塊；缺漏或格式錯誤的分塊為 None，由呼叫端改為逐塊重送。"""
+    texts: list[Optional[str]] = [None] * count
+    try:
+        items = json.loads(text or "")
+    except ValueError:
+        return texts
+    if not isinstance(items, list):
+        return texts
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index = item.get("index")
+        if isinstance(index, int) and 0 <= index < count and texts[index] is None:
+            texts[index] = str(item.get("text") or "")
+    return texts
+
+
+def _predict_packed_with_vertex(
+    task_id: str,
+    items: list[tuple[bytes, str, float]],
+    *,
+    top_p: float = 0.9,
+    call_stats: Optional[VertexCallStats] = None,
+) -> list[Optional[str]]:
+    """多個連續分塊（audio, mime_type, duration_s）合併為一個請求，以 JSON schema 依編號取回各分塊逐字稿。"""
+    call_stats = call_stats or VertexCallStats()
+    parts = []
+    for index, (audio_bytes, mime_type, _) in enumerate(items):
+        parts.append(types.Part.from_text(text=f"[chunk {index}]"))
+        parts.append(_audio_part(audio_bytes, mime_type))
+    parts.append(types.Part.from_text(text="逐字稿（依 chunk 編號回傳 JSON）："))
+    contents = [types.Content(role="user", parts=parts)]
+    config = _generate_content_config(
+        top_p,
+        max_output_tokens=(_CHUNK_OUTPUT_TOKENS + 100) * len(items),
+        system_text=_SYSTEM_INSTRUCTION + _PACKED_INSTRUCTION,
+        response_schema=_PACKED_RESPONSE_SCHEMA,
+    )
+    duration_s = sum(d for _, _, d in items)
+    try:
+        response, prompt_tokens = _generate(task_id, contents, config, duration_s=duration_s, call_stats=call_stats)
+    except Exception:
+        call_stats.record_failure()
+        return [None] * len(items)
+    texts = _parse_packed_response(response.text, len(items))
+    call_stats.record_pack(len(items), sum(t is not None for t in texts), prompt_tokens, duration_s)
+    return texts
+
+
+def iter_packs(
+    spans: list[tuple[float, float]], max_chunks: int, max_seconds: float
+) -> list[list[tuple[float, float]]]:
+    """依序把分塊合併為包：每包最多 max_chunks 塊、總長不超過 max_seconds（單塊超過時自成一包）。"""
+    packs: list[list[tuple[float, float]]] = []
+    current: list[tuple[float, float]] = []
+    total = 0.0
+    for span in spans:
+        if current and (len(current) >= max_chunks or total + span[1] > max_seconds):
+            packs.append(current)
+            current, total = [], 0.0
+        current.append(span)
+        total += span[1]
+    if current:
+        packs.append(current)
+    return packs
+
+
 def transcribe_with_vertex_ai(
     task_id: str,
-    raw_bytes: bytes,
+    src_path: str,
     start_time: Optional[str] = None,
     end_time: Optional[str] = None,
     chunk_length_s: float = 30.0,
@@ -123,98 +413,183 @@ def transcribe_with_vertex_ai(
     max_output_tokens: int = 65535,
     thinking_budget: int = 0,
     safety_off: bool = True,
+    content_sha256: Optional[str] = None,
+    chunking: Optional[str] = None,
 ) -> None:
+    store = None
+    # 任務的暫存檔（解碼後的 PCM store）都放在工作區，結束時整個刪除並受容量上限約束
+    workspace = TaskWorkspace(task_id)
     try:
-        ensure_ffmpeg_available()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".bin") as src:
-            src.write(raw_bytes)
-            src_path = src.name
-
-        total_seconds = ffprobe_duration_seconds(src_path)
-        start_s = parse_hhmmss(start_time) if start_time else 0.0
-        end_s = parse_hhmmss(end_time) if end_time else total_seconds
-        start_s = max(0.0, min(start_s, total_seconds))
-        end_s = max(start_s, min(end_s, total_seconds))
+        # 整個區段只解碼一次，各分塊為其切片並在記憶體中加上 WAV 檔頭
+        requested_start, requested_end = requested_time_range(start_time, end_time)
+        # 解碼結果寫入 mmap 檔，分塊只是其中的切片，長錄音也不會佔滿 Python heap
+        store = decode_range_to_store(src_path, requested_start, requested_end, workspace=workspace)
+        pcm = store.buffer
+        start_s, end_s = pcm.offset_s, pcm.end_s
         if end_s - start_s <= 0.0:
             TaskStore.mark_failed(task_id, error_message="音訊長度為 0，請確認檔案或時間區段設定。")
             return
+        # vad 模式只送出含語音的區段；offset 仍為絕對秒數，時間軸換算不變
+        spans, chunking_stats = plan_chunks(store, start_s, end_s, chunk_length_s, chunking)
+        TaskStore.update_meta(task_id, "chunking", chunking_stats)
+
+        cache = get_chunk_cache()
+        content_hash = (content_sha256 or file_sha256(src_path)) if cache is not None else ""
+        # 快取鍵取自實際送出的生成設定與提示；未傳入請求的參數（例如 temperature）不影響結果，也不應分開快取
+        cache_params = {
+            "config": _generate_content_config(top_p).model_dump(mode="json", exclude_none=True),
+            "prompt": _TRANSCRIBE_PROMPT,
+        }
+        codec = (settings.vertex_audio_codec or "wav").lower()
+        bitrate_kbps = settings.vertex_opus_bitrate_kbps
+        if codec == "opus":
+            # 有損壓縮可能影響辨識結果，不與 wav/flac 共用快取
+            cache_params["payload_codec"] = f"opus@{bitrate_kbps}k"
+        call_stats = VertexCallStats()
+
+        def produce_chunk(span: tuple[float, float]) -> dict:
+            # 命中快取的分塊不需要產生音訊
+            offset, duration = span
+            key = None
+            if cache is not None:
+                key = ChunkCache.make_key(
+                    content_hash,
+                    offset,
+                    duration,
+                    backend="vertex_ai",
+                    model=settings.vertex_genai_model,
+                    params=cache_params,
+                )
+                cached = cache.get(key)
+                if cached is not None:
+                    return {"cached": str(cached.get("text", ""))}
+            # 編碼在擷取階段完成，與其他分塊的 Vertex 請求重疊進行
+            chunk = pcm.slice(offset, duration)
+            started = time.perf_counter()
+            audio, mime_type = encode_pcm_payload(chunk, codec, bitrate_kbps=bitrate_kbps)
+            call_stats.record_payload(len(audio), len(chunk), time.perf_counter() - started)
+            return {"key": key, "audio": audio, "mime_type": mime_type}
+
+        # 串流片段依分塊順序即時寫入 partial_text
+        sink = OrderedTextSink(task_id)
+        chunk_index = {span: i for i, span in enumerate(spans)}
+
+        def predict_chunk(
+            span: tuple[float, float], payload: dict, cancel: Optional[threading.Event] = None
+        ) -> str:
+            return _predict_chunk_with_vertex(
+                task_id,
+                payload["audio"],
+                language_code=language_code,
+                stream_timeout_s=settings.vertex_stream_idle_timeout_s,
+                prompt=prompt,
+                temperature=temperature,
+                top_p=top_p,
+                max_output_tokens=max_output_tokens,
+                thinking_budget=thinking_budget,
+                safety_off=safety_off,
+                duration_s=span[1],
+                call_stats=call_stats,
+                mime_type=payload["mime_type"],
+                sink=sink,
+                chunk_index=chunk_index[span],
+                cancel=cancel,
+                raise_errors=True,
+            )
+
+        # hedging：Vertex 只有單一端點，備援送到 remote_llm 節點池
+        inflight = max(1, settings.vertex_inflight)
+        hedger: Hedger = Hedger("vertex_ai", workers=inflight)
+        hedge_to_remote = settings.hedge_enabled and (settings.hedge_target or "auto").lower() in ("auto", "backend")
+
+        def predict_hedged(span: tuple[float, float], payload: dict) -> tuple[str, bool]:
+            """回傳 (逐字稿, 是否來自其他後端)；兩個後端都失敗時以空字串提交。"""
+            hedge = None
+            if hedge_to_remote:
+                def hedge(cancel: threading.Event) -> str:
+                    from .remote_pool import get_remote_pool
+                    from .transcription_remote import chunks_text, request_chunk
+
+                    return chunks_text(request_chunk(get_remote_pool(), bytes(pcm.slice(*span)), cancel=cancel))
 
-        processed = 0.0
-        offset = start_s
-        while offset < end_s:
-            # 支援取消
-            if TaskStore.is_canceled(task_id):
-                TaskStore.mark_failed(task_id, error_message="任務已取消")
-                return
-            duration = min(chunk_length_s, end_s - offset)
-            chunk_wav = ffmpeg_extract_segment_to_wav(src_path, offset_seconds=offset, duration_seconds=duration)
             try:
-                # 在串流過程會即時把 token 追加到 partial_text
-                # 這裡先記錄呼叫前的 partial_text，若最終 text 為空，會以增量補齊段落文字
-                try:
-                    previous_partial = str(TaskStore.get_task(task_id).get("partial_text", ""))
-                except Exception:
-                    previous_partial = ""
-                with open(chunk_wav, "rb") as f:
-                    wav_bytes = f.read()
-                text = _predict_chunk_with_vertex(
+                return hedger.call(
+                    lambda cancel: predict_chunk(span, payload, cancel),
+                    hedge,
+                    hedge_backend="remote_llm",
+                    hedge_label="backend",
+                    # 串流文字已顯示的分塊不送備援；送出後主請求的片段暫存到 commit，備援勝出時不必改寫 partial_text
+                    may_hedge=lambda: sink.hold(chunk_index[span]),
+                )
+            except Exception:
+                return "", False
+
+        def produce(pack: list[tuple[float, float]]) -> list[dict]:
+            return [produce_chunk(span) for span in pack]
+
+        def consume(pack: list[tuple[float, float]], payloads: list[dict]) -> list[str]:
+            texts: list[Optional[str]] = [p.get("cached") for p in payloads]
+            pending = [i for i, p in enumerate(payloads) if "cached" not in p]
+            if len(pending) > 1:
+                packed = _predict_packed_with_vertex(
                     task_id,
-                    wav_bytes,
-                    language_code=language_code,
-                    stream_timeout_s=30.0,
-                    prompt=prompt,
-                    temperature=temperature,
+                    [(payloads[i]["audio"], payloads[i]["mime_type"], pack[i][1]) for i in pending],
                     top_p=top_p,
-                    max_output_tokens=max_output_tokens,
-                    thinking_budget=thinking_budget,
-                    safety_off=safety_off,
+                    call_stats=call_stats,
                 )
-                # 檢查是否有有效的轉錄結果
-                if text and str(text).strip():
-                    # 流式處理已返回完整文本，直接使用
-                    TaskStore.append_segment(
-                        task_id,
-                        start=offset - start_s,
-                        end=offset - start_s + duration,
-                        text=str(text).strip(),
-                    )
-                else:
-                    # 備用機制：若返回的文本為空，檢查是否有通過流式更新的 partial_text
-                    try:
-                        current_partial = str(TaskStore.get_task(task_id).get("partial_text", ""))
-                        if len(current_partial) > len(previous_partial):
-                            # 提取本次處理新增的文本部分
-                            new_text = current_partial[len(previous_partial):].strip()
-                            if new_text:
-                                TaskStore.append_segment(
-                                    task_id,
-                                    start=offset - start_s,
-                                    end=offset - start_s + duration,
-                                    text=new_text,
-                                )
-                    except Exception:
-                        pass
-                
-                processed = (offset + duration) - start_s
-                progress = (processed / (end_s - start_s)) * 100.0
-                TaskStore.update_progress(task_id, progress=progress)
-            finally:
-                try:
-                    import os
-                    os.remove(chunk_wav)
-                except Exception:
-                    pass
-            offset += duration
-            time.sleep(0.05)
+                for i, text in zip(pending, packed):
+                    texts[i] = text
+            # 未打包、或打包回應缺漏的分塊逐塊送出
+            for i in pending:
+                from_other_backend = False
+                if texts[i] is None:
+                    texts[i], from_other_backend = predict_hedged(pack[i], payloads[i])
+                text = texts[i]
+                # 空字串可能代表呼叫失敗，只快取有內容的結果；remote_llm 勝出的結果不寫入 Vertex 快取
+                if text and str(text).strip() and cache is not None and payloads[i]["key"] and not from_other_backend:
+                    cache.put(payloads[i]["key"], {"text": str(text)})
+            return [str(t or "") for t in texts]
+
+        def commit_chunk(span: tuple[float, float], text: str) -> None:
+            offset, duration = span
+            # 檢查是否有有效的轉錄結果
+            segments = []
+            if text.strip():
+                segments.append({"start": offset - start_s, "end": offset - start_s + duration, "text": text.strip()})
+            processed = (offset + duration) - start_s
+            sink.commit(chunk_index[span], text, segments=segments, progress=(processed / (end_s - start_s)) * 100.0)
+
+        def commit(pack: list[tuple[float, float]], texts: list[str]) -> None:
+            for span, text in zip(pack, texts):
+                commit_chunk(span, text)
+
+        # VERTEX_PACK_CHUNKS > 1 時把連續分塊合併成一個請求，省下每次請求重複的系統提示與往返
+        packs = iter_packs(spans, max(1, settings.vertex_pack_chunks), settings.vertex_pack_max_s)
+
+        # 多個分塊同時在途；管線仍依分塊順序提交
+        pipeline = ChunkPipeline(
+            produce,
+            consume,
+            commit,
+            depth=max(settings.pipeline_prefetch_depth, inflight),
+            workers=inflight,
+            should_cancel=lambda: TaskStore.is_canceled(task_id),
+        )
+        try:
+            pipeline.run(packs)
+        except PipelineCanceled:
+            TaskStore.mark_failed(task_id, error_message="任務已取消")
+            return
+        finally:
+            TaskStore.update_meta(task_id, "pipeline", pipeline.stats())
+            TaskStore.update_meta(task_id, "vertex", call_stats.to_dict())
+            TaskStore.update_meta(task_id, "hedging", hedger.stats())
+            hedger.close()
 
         TaskStore.mark_completed(task_id)
     except Exception as e:
         TaskStore.mark_failed(task_id, error_message=str(e))
     finally:
-        try:
-            import os
-            os.remove(src_path)  # type: ignore[name-defined]
-        except Exception:
-            pass
-
-
+        if store is not None:
+            store.close()
+        workspace.cleanup()
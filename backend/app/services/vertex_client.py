@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import math
+import queue
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+from google import genai
+from google.genai import errors as genai_errors
+
+from ..config import settings
+
+
+T = TypeVar("T")
+
+# Gemini 以每秒 32 個 token 計算音訊輸入
+AUDIO_TOKENS_PER_SECOND = 32
+# 系統提示與文字部分的估計 token 數
+PROMPT_OVERHEAD_TOKENS = 200
+
+_RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """每分鐘補充 per_minute 個單位的權杖桶；容量即為一分鐘的額度，per_minute 為 0 表示不限制。"""
+
+    def __init__(self, per_minute: float) -> None:
+        self.per_minute = max(0.0, float(per_minute))
+        self.capacity = self.per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.per_minute <= 0
+
+    def _refill_locked(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.per_minute / 60.0)
+        self._updated = now
+
+    def acquire(self, amount: float) -> float:
+        """取得 amount 個單位，不足時阻塞等待；回傳等待秒數。超過容量的請求只需等到桶滿。"""
+        if self.unlimited:
+            return 0.0
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        with self._cond:
+            while True:
+                self._refill_locked()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                delay = (amount - self._tokens) * 60.0 / self.per_minute
+                started = time.monotonic()
+                self._cond.wait(delay)
+                waited += time.monotonic() - started
+
+    def adjust(self, delta: float) -> None:
+        """依實際用量修正：delta 為正表示多扣，負值為退還估計過多的部分。"""
+        if self.unlimited or not delta:
+            return
+        with self._cond:
+            self._refill_locked()
+            # 允許暫時為負，之後的請求會等到補回為止
+            self._tokens = min(self.capacity, self._tokens - delta)
+            self._cond.notify_all()
+
+
+class VertexRateLimiter:
+    """同時套用每分鐘請求數（RPM）與每分鐘 token 數（TPM）兩個權杖桶。"""
+
+    def __init__(self, rpm: float, tpm: float) -> None:
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._lock = threading.Lock()
+        self.throttled_s = 0.0
+
+    def acquire(self, estimated_tokens: int) -> float:
+        waited = self.requests.acquire(1) + self.tokens.acquire(estimated_tokens)
+        if waited:
+            with self._lock:
+                self.throttled_s += waited
+        return waited
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        if actual_tokens is None:
+            return
+        self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+def estimate_tokens(duration_s: float) -> int:
+    return int(math.ceil(max(0.0, duration_s) * AUDIO_TOKENS_PER_SECOND)) + PROMPT_OVERHEAD_TOKENS
+
+
+class StreamIdleTimeout(TimeoutError):
+    pass
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, genai_errors.APIError):
+        return getattr(exc, "code", None) in _RETRYABLE_CODES
+    # 連線中斷、逾時等暫時性錯誤（含串流閒置逾時；requests 的例外也是 OSError）
+    return isinstance(exc, OSError)
+
+
+_STREAM_END = object()
+
+
+def iter_with_idle_timeout(stream: Iterable[T], idle_timeout_s: float) -> Iterator[T]:
+    """逐一取出串流回應；兩個片段之間超過 idle_timeout_s 秒沒有資料即拋出 StreamIdleTimeout。
+
+    串流在背景執行緒讀取，逾時後呼叫端立即返回；底層連線另以 HTTP read timeout 收尾。
+    """
+    items: "queue.Queue[Any]" = queue.Queue()
+
+    def pump() -> None:
+        try:
+            for item in stream:
+                items.put(item)
+            items.put(_STREAM_END)
+        except BaseException as e:
+            items.put(e)
+
+    threading.Thread(target=pump, name="vertex-stream", daemon=True).start()
+    while True:
+        try:
+            item = items.get(timeout=idle_timeout_s)
+        except queue.Empty:
+            raise StreamIdleTimeout(f"串流回應超過 {idle_timeout_s:g} 秒沒有新資料") from None
+        if item is _STREAM_END:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def backoff_delay(attempt: int, base_s: float, max_s: float) -> float:
+    """指數退避加上 full jitter，避免多個 worker 同時重試。"""
+    return random.uniform(0.0, min(max_s, base_s * (2 ** attempt)))
+
+
+def call_with_retries(
+    fn: Callable[[], T],
+    *,
+    retries: int,
+    base_s: float,
+    max_s: float,
+    on_retry: Optional[Callable[[BaseException, float], None]] = None,
+) -> T:
+    for attempt in range(max(0, retries) + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, base_s, max_s)
+            if on_retry is not None:
+                on_retry(e, delay)
+            time.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+_client: Optional[genai.Client] = None
+_limiter: Optional[VertexRateLimiter] = None
+_shared_lock = threading.Lock()
+
+
+def get_genai_client() -> genai.Client:
+    """行程共用的 genai.Client，重複使用其底層連線。"""
+    global _client
+    with _shared_lock:
+        if _client is None:
+            _client = genai.Client(
+                vertexai=True,
+                project=settings.vertex_project,
+                location=(settings.vertex_location or "global"),
+            )
+        return _client
+
+
+def get_rate_limiter() -> VertexRateLimiter:
+    """同一行程內所有 Vertex 任務共用 VERTEX_RPM / VERTEX_TPM 額度。"""
+    global _limiter
+    with _shared_lock:
+        if _limiter is None:
+            _limiter = VertexRateLimiter(settings.vertex_rpm, settings.vertex_tpm)
+        return _limiter
+
+
+class VertexCallStats:
+    """單一任務的 Vertex 呼叫統計，寫入 meta["vertex"]。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled_s = 0.0
+        self.retry_codes: Dict[str, int] = {}
+        self.payloads = 0
+        self.payload_bytes = 0
+        self.pcm_bytes = 0
+        self.encode_s = 0.0
+        self.latencies: List[float] = []
+        self.first_text: List[float] = []
+        self.idle_timeouts = 0
+        self.pack_requests = 0
+        self.packed_chunks = 0
+        self.pack_misses = 0
+        self.pack_overhead_tokens = 0
+        self.pack_overhead_samples = 0
+
+    def record_request(self, throttled_s: float) -> None:
+        with self._lock:
+            self.requests += 1
+            self.throttled_s += throttled_s
+
+    def record_retry(self, exc: BaseException) -> None:
+        code = str(getattr(exc, "code", None) or type(exc).__name__)
+        with self._lock:
+            self.retries += 1
+            self.retry_codes[code] = self.retry_codes.get(code, 0) + 1
+
+    def record_payload(self, payload_bytes: int, pcm_bytes: int, encode_s: float) -> None:
+        with self._lock:
+            self.payloads += 1
+            self.payload_bytes += payload_bytes
+            self.pcm_bytes += pcm_bytes
+            self.encode_s += encode_s
+
+    def record_latency(self, seconds: float) -> None:
+        """單一分塊從送出到取得結果（含重試與限流等待）的耗時。"""
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def record_pack(self, chunks: int, parsed: int, prompt_tokens: Optional[int], audio_s: float) -> None:
+        """記錄一個打包請求；prompt 扣除音訊 token 後的部分即每個請求固定的提示開銷。"""
+        with self._lock:
+            self.pack_requests += 1
+            self.packed_chunks += parsed
+            self.pack_misses += chunks - parsed
+            if prompt_tokens:
+                self.pack_overhead_tokens += max(0, prompt_tokens - int(audio_s * AUDIO_TOKENS_PER_SECOND))
+                self.pack_overhead_samples += 1
+
+    def record_first_text(self, seconds: float) -> None:
+        """串流模式下，從送出請求到收到第一段文字的耗時。"""
+        with self._lock:
+            self.first_text.append(seconds)
+
+    def record_idle_timeout(self) -> None:
+        with self._lock:
+            self.idle_timeouts += 1
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "throttled_s": round(self.throttled_s, 3),
+                "retry_codes": dict(self.retry_codes),
+                "payload": {
+                    "chunks": self.payloads,
+                    "bytes": self.payload_bytes,
+                    "pcm_bytes": self.pcm_bytes,
+                    "compression_ratio": round(self.pcm_bytes / self.payload_bytes, 2) if self.payload_bytes else None,
+                    "encode_s": round(self.encode_s, 3),
+                },
+                "latency_s": _summary(self.latencies),
+                "first_text_s": _summary(self.first_text),
+                "idle_timeouts": self.idle_timeouts,
+                "packing": self._packing_locked(),
+            }
+
+    def _packing_locked(self) -> Dict[str, Any]:
+        # 相對於每塊一個請求：打包成功的分塊原本各需一次請求
+        requests_saved = self.packed_chunks - self.pack_requests
+        overhead = self.pack_overhead_tokens / self.pack_overhead_samples if self.pack_overhead_samples else None
+        return {
+            "requests": self.pack_requests,
+            "chunks": self.packed_chunks,
+            "fallback_chunks": self.pack_misses,
+            "requests_saved": max(0, requests_saved),
+            "overhead_tokens_per_request": round(overhead) if overhead is not None else None,
+            "tokens_saved_est": max(0, round(overhead * requests_saved)) if overhead is not None else None,
+        }
+
+
+def _summary(values: List[float]) -> Dict[str, Any]:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": round(ordered[len(ordered) // 2], 3),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "max": round(ordered[-1], 3),
+    }
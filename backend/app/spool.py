@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, BinaryIO, Dict
+
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from .config import settings
+from .storage import delete_file_silent, task_is_active
+
+
+@dataclass
+class SpooledFile:
+    path: str
+    size: int
+    sha256: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SpooledFile":
+        return cls(path=str(data["path"]), size=int(data["size"]), sha256=str(data["sha256"]))
+
+    def verify(self) -> None:
+        """確認 worker 端看得到同一個檔案（共用目錄設定錯誤時提早失敗）。"""
+        try:
+            actual = os.path.getsize(self.path)
+        except OSError:
+            raise RuntimeError(f"找不到上傳暫存檔：{self.path}，請確認 API 與 worker 共用 SPOOL_DIR。")
+        if actual != self.size:
+            raise RuntimeError(f"上傳暫存檔大小不符（預期 {self.size}，實際 {actual}）。")
+
+
+def spool_dir() -> Path:
+    path = Path(settings.spool_dir)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def spool_path_for(task_id: str, suffix: str | None = None) -> Path:
+    if not suffix or not suffix.startswith("."):
+        suffix = ".bin"
+    return spool_dir() / f"{task_id}{suffix}"
+
+
+def _write_block(out: BinaryIO, hasher: "hashlib._Hash", block: bytes) -> None:
+    hasher.update(block)
+    out.write(block)
+
+
+async def spool_upload(file: UploadFile, task_id: str) -> SpooledFile:
+    """將上傳內容以固定區塊串流寫入該任務的 spool 檔，並同時計算 sha256。
+
+    記憶體用量只與區塊大小有關，與檔案大小無關；寫入與雜湊在 threadpool 執行，不阻塞事件迴圈。
+    """
+    path = spool_path_for(task_id, Path(file.filename or "").suffix.lower())
+    block_size = max(64 * 1024, int(settings.spool_block_size))
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        out = await run_in_threadpool(open, path, "wb")
+        try:
+            while True:
+                block = await file.read(block_size)
+                if not block:
+                    break
+                await run_in_threadpool(_write_block, out, hasher, block)
+                size += len(block)
+        finally:
+            await run_in_threadpool(out.close)
+    except Exception:
+        delete_file_silent(str(path))
+        raise
+    finally:
+        await file.close()
+    return SpooledFile(path=str(path), size=size, sha256=hasher.hexdigest())
+
+
+def sweep_spool(ttl_seconds: float | None = None) -> int:
+    """刪除修改時間超過 TTL 的 spool 檔（例如 worker 當機遺留），回傳刪除數量。
+
+    檔名為 {task_id}{副檔名}；任務仍在 Celery 佇列中等待或執行中時不刪除，不論檔案多舊。
+    """
+    ttl = settings.spool_ttl_seconds if ttl_seconds is None else ttl_seconds
+    if ttl <= 0:
+        return 0
+    cutoff = time.time() - ttl
+    removed = 0
+    for entry in spool_dir().iterdir():
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff and not task_is_active(entry.stem):
+                entry.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
@@ -1,23 +1,29 @@
 from __future__ import annotations
 
 import threading
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+import hashlib
 import os
-import tempfile
 
+from .config import settings
+from .task_events import TaskSubscription, task_events
 
-_lock = threading.Lock()
-_tasks: Dict[str, Dict[str, Any]] = {}
 
+class MemoryTaskStore:
+    """單一行程內的任務狀態（dict + lock）；多個 uvicorn worker 或 Celery worker 時改用 RedisTaskStore。"""
 
-class TaskStore:
-    @staticmethod
-    def initialize_task(task_id: str, model_choice: str, start_time: str | None, end_time: str | None) -> None:
-        with _lock:
-            _tasks[task_id] = {
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+
+    def initialize_task(self, task_id: str, model_choice: str, start_time: str | None, end_time: str | None) -> None:
+        with self._lock:
+            self._tasks[task_id] = {
                 "status": "processing",
                 "progress": 0.0,
                 "partial_text": "",
+                # partial_text 被整段改寫（而非附加）的次數；WebSocket 以此判斷游標是否仍有效
+                "text_epoch": 0,
                 "segments": [],
                 "tokens": {"input": 0, "output": 0},
                 "canceled": False,
@@ -27,71 +33,130 @@ class TaskStore:
                     "end_time": end_time,
                 },
             }
+        task_events.notify(task_id)
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._tasks.get(task_id)
+
+    def get_task_delta(
+        self, task_id: str, *, text_offset: int = 0, segment_offset: int = 0, text_epoch: int = 0
+    ) -> Optional[Dict[str, Any]]:
+        """回傳游標之後新增的 partial_text 與 segments，以及目前狀態與新游標。
+
+        游標失效（partial_text 曾被改寫或位移超出範圍）時 reset 為 True，text / segments 為完整內容。
+        本實作的 text 位移以字元計；游標對用戶端而言是不透明的值。
+        """
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            text = task["partial_text"]
+            segments = task["segments"]
+            epoch = int(task.get("text_epoch", 0))
+            reset = epoch != text_epoch or text_offset > len(text) or segment_offset > len(segments)
+            if reset:
+                text_offset = segment_offset = 0
+            delta: Dict[str, Any] = {
+                "status": task["status"],
+                "progress": task["progress"],
+                "tokens": dict(task.get("tokens", {"input": 0, "output": 0})),
+                "error": task.get("error", ""),
+                "text": text[text_offset:],
+                "segments": [dict(seg) for seg in segments[segment_offset:]],
+                "reset": reset,
+                "cursor": {"text": len(text), "segments": len(segments), "epoch": epoch},
+            }
+        return delta
 
-    @staticmethod
-    def get_task(task_id: str) -> Optional[Dict[str, Any]]:
-        with _lock:
-            return _tasks.get(task_id)
+    def subscribe(self, task_id: str) -> TaskSubscription:
+        """訂閱任務變更（寫入同一行程，直接由各寫入方法通知）。"""
+        return task_events.subscribe(task_id)
 
-    @staticmethod
-    def append_segment(task_id: str, start: float, end: float, text: str) -> None:
-        with _lock:
-            task = _tasks.get(task_id)
+    def append_segment(self, task_id: str, start: float, end: float, text: str) -> None:
+        with self._lock:
+            task = self._tasks.get(task_id)
             if not task:
                 return
             safe_text = "" if text is None else str(text)
             task["segments"].append({"start": start, "end": end, "text": safe_text})
-
-    @staticmethod
-    def update_progress(task_id: str, progress: float) -> None:
-        with _lock:
-            task = _tasks.get(task_id)
+        task_events.notify(task_id)
+
+    def commit_chunk(
+        self,
+        task_id: str,
+        *,
+        segments: List[Dict[str, Any]],
+        text: str = "",
+        progress: Optional[float] = None,
+    ) -> None:
+        """一個分塊的結果一次寫入：segments（start/end/text）、附加到 partial_text 的文字與進度。"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if not task:
+                return
+            for seg in segments:
+                task["segments"].append(
+                    {"start": seg["start"], "end": seg["end"], "text": "" if seg.get("text") is None else str(seg["text"])}
+                )
+            if text:
+                task["partial_text"] += text
+            if progress is not None:
+                task["progress"] = float(max(0.0, min(100.0, progress)))
+        task_events.notify(task_id)
+
+    def update_progress(self, task_id: str, progress: float) -> None:
+        with self._lock:
+            task = self._tasks.get(task_id)
             if not task:
                 return
             task["progress"] = float(max(0.0, min(100.0, progress)))
+        task_events.notify(task_id)
 
-    @staticmethod
-    def mark_completed(task_id: str) -> None:
-        with _lock:
-            task = _tasks.get(task_id)
+    def mark_completed(self, task_id: str) -> None:
+        with self._lock:
+            task = self._tasks.get(task_id)
             if not task:
                 return
             task["status"] = "completed"
             task["progress"] = 100.0
+        task_events.notify(task_id)
 
-    @staticmethod
-    def mark_failed(task_id: str, error_message: str) -> None:
-        with _lock:
-            task = _tasks.get(task_id)
+    def mark_failed(self, task_id: str, error_message: str) -> None:
+        with self._lock:
+            task = self._tasks.get(task_id)
             if not task:
                 return
             task["status"] = "failed"
             task["error"] = error_message
+        task_events.notify(task_id)
 
-    @staticmethod
-    def update_partial_text(task_id: str, text: str, *, append: bool = True) -> None:
-        with _lock:
-            task = _tasks.get(task_id)
+    def update_partial_text(self, task_id: str, text: str, *, append: bool = True) -> None:
+        with self._lock:
+            task = self._tasks.get(task_id)
             if not task:
                 return
             safe_text = "" if text is None else str(text)
             if append:
                 task["partial_text"] += safe_text
-
-    @staticmethod
-    def increment_tokens(task_id: str, input_tokens: int = 0, output_tokens: int = 0) -> None:
-        with _lock:
-            task = _tasks.get(task_id)
+            else:
+                task["partial_text"] = safe_text
+                task["text_epoch"] = int(task.get("text_epoch", 0)) + 1
+        task_events.notify(task_id)
+
+    def increment_tokens(self, task_id: str, input_tokens: int = 0, output_tokens: int = 0) -> None:
+        with self._lock:
+            task = self._tasks.get(task_id)
             if not task:
                 return
             tokens = task.setdefault("tokens", {"input": 0, "output": 0})
             tokens["input"] = int(tokens.get("input", 0)) + int(max(0, input_tokens))
             tokens["output"] = int(tokens.get("output", 0)) + int(max(0, output_tokens))
+        task_events.notify(task_id)
 
-    @staticmethod
-    def set_tokens(task_id: str, input_tokens: int | None = None, output_tokens: int | None = None) -> None:
-        with _lock:
-            task = _tasks.get(task_id)
+    def set_tokens(self, task_id: str, input_tokens: int | None = None, output_tokens: int | None = None) -> None:
+        with self._lock:
+            task = self._tasks.get(task_id)
             if not task:
                 return
             tokens = task.setdefault("tokens", {"input": 0, "output": 0})
@@ -99,38 +164,74 @@ class TaskStore:
                 tokens["input"] = int(max(0, input_tokens))
             if output_tokens is not None:
                 tokens["output"] = int(max(0, output_tokens))
+        task_events.notify(task_id)
+
+    def update_meta(self, task_id: str, key: str, value: Any) -> None:
+        """在 meta 底下記錄附加資訊（例如管線各階段的使用率統計）。"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if not task:
+                return
+            task.setdefault("meta", {})[key] = value
 
-    @staticmethod
-    def mark_canceled(task_id: str) -> None:
-        with _lock:
-            task = _tasks.get(task_id)
+    def mark_canceled(self, task_id: str) -> None:
+        with self._lock:
+            task = self._tasks.get(task_id)
             if not task:
                 return
             task["canceled"] = True
             task["status"] = "canceled"
+        task_events.notify(task_id)
 
-    @staticmethod
-    def is_canceled(task_id: str) -> bool:
-        with _lock:
-            task = _tasks.get(task_id)
+    def is_canceled(self, task_id: str) -> bool:
+        with self._lock:
+            task = self._tasks.get(task_id)
             if not task:
                 return False
             return bool(task.get("canceled", False))
 
 
 
-def save_temp_upload(contents: bytes, suffix: str | None = None) -> str:
-    """將上傳檔案 bytes 儲存為臨時檔，回傳檔案路徑。"""
-    if not suffix or not suffix.startswith("."):
-        suffix = ".bin"
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp.write(contents)
-        return tmp.name
+def task_store_backend() -> str:
+    """TASK_STORE 未設定時，使用 Celery 則預設 redis（worker 與 API 不同行程），否則 memory。"""
+    backend = (settings.task_store or ("redis" if settings.use_celery else "memory")).lower()
+    if backend not in ("memory", "redis"):
+        raise ValueError(f"未知的 TASK_STORE：{backend}（可用：memory, redis）")
+    return backend
+
+
+def _create_task_store():
+    if task_store_backend() == "redis":
+        from .storage_redis import RedisTaskStore
+
+        return RedisTaskStore(settings.redis_url, prefix=settings.task_key_prefix, ttl_seconds=settings.task_ttl_seconds)
+    return MemoryTaskStore()
+
+
+# 行程內共用的任務狀態存放處；介面與原本的靜態方法相同（TaskStore.get_task(...) 等）
+TaskStore = _create_task_store()
+
+
+def task_is_active(task_id: str) -> bool:
+    """任務仍在排隊或執行中（processing）；定期回收時跳過這類任務的 spool 檔與工作區。"""
+    try:
+        task = TaskStore.get_task(task_id)
+    except Exception:
+        # 任務狀態暫時讀不到（例如 Redis 斷線）時寧可留到下一輪
+        return True
+    return task is not None and task.get("status") == "processing"
 
 
-def read_file_bytes(path: str) -> bytes:
+def file_sha256(path: str, block_size: int = 1024 * 1024) -> str:
+    """以固定區塊讀取檔案計算 sha256，不會一次載入整個檔案。"""
+    hasher = hashlib.sha256()
     with open(path, "rb") as f:
-        return f.read()
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
 
 
 def delete_file_silent(path: str) -> None:
@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import redis
+
+from .task_events import TaskSubscription, task_events
+
+
+# 任務仍存在（狀態 hash 未過期、未被刪除）才套用寫入，避免遲到的寫入讓未知或已過期的任務「復活」。
+# KEYS：任務的四個鍵（第一個為狀態 hash）；ARGV：TTL、通知頻道，之後每個指令為「參數個數, 指令, 參數...」
+_GUARDED_WRITE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  return 0
+end
+local unpack = table.unpack or unpack
+local i = 3
+while i <= #ARGV do
+  local n = tonumber(ARGV[i])
+  redis.call(unpack(ARGV, i + 1, i + n))
+  i = i + n + 1
+end
+for _, key in ipairs(KEYS) do
+  redis.call('EXPIRE', key, ARGV[1])
+end
+redis.call('PUBLISH', ARGV[2], '1')
+return 1
+"""
+
+
+class RedisTaskStore:
+    """以 Redis 保存任務狀態，API（可多個 uvicorn worker）與 Celery worker 看到同一份資料。
+
+    每個任務使用四個鍵（皆有 TTL）：
+      {prefix}{id}           hash：status、progress、canceled、error、tokens_input、tokens_output、text_epoch
+      {prefix}{id}:text      string：partial_text，以 APPEND 累加
+      {prefix}{id}:segments  list：每個 segment 一筆 JSON，只會 RPUSH
+      {prefix}{id}:meta      hash：meta 的每個 key 一個欄位，值為 JSON
+    initialize_task 以 pipeline 建立任務；其餘寫入經由 Lua 腳本，任務不存在時不做任何事（同 MemoryTaskStore），
+    一個分塊的提交（commit_chunk）仍只需一次往返。
+    每次寫入同時 PUBLISH 到 {prefix}{id}:changed；API 行程以一個監聽執行緒 PSUBSCRIBE 後轉給 task_events。
+    """
+
+    def __init__(self, url: str, *, prefix: str = "stt:task:", ttl_seconds: int = 7 * 24 * 3600) -> None:
+        # get_task_delta 以位元組位移 GETRANGE，游標失效時可能切在多位元組字元中間；該結果會被捨棄，解碼不應拋錯
+        self.redis = redis.Redis.from_url(url, decode_responses=True, encoding_errors="replace")
+        self.prefix = prefix
+        self.ttl_seconds = max(60, int(ttl_seconds))
+        self._listener: Optional[threading.Thread] = None
+        self._listener_lock = threading.Lock()
+        self._guarded_write = self.redis.register_script(_GUARDED_WRITE)
+
+    def _keys(self, task_id: str) -> tuple[str, str, str, str]:
+        base = f"{self.prefix}{task_id}"
+        return base, f"{base}:text", f"{base}:segments", f"{base}:meta"
+
+    def _pipeline(self):
+        return self.redis.pipeline(transaction=False)
+
+    def _channel(self, task_id: str) -> str:
+        return f"{self.prefix}{task_id}:changed"
+
+    def _commit(self, pipe, task_id: str, *keys: str) -> None:
+        for key in keys:
+            pipe.expire(key, self.ttl_seconds)
+        # 變更通知與寫入同一次往返；沒有訂閱者時 PUBLISH 幾乎沒有成本
+        pipe.publish(self._channel(task_id), "1")
+        pipe.execute()
+
+    def _write(self, task_id: str, ops: List[tuple]) -> bool:
+        """以一次 EVALSHA 套用 ops（每個為一條 Redis 指令）並延長 TTL、發出通知；任務不存在時回傳 False。"""
+        if not ops:
+            return False
+        args: List[Any] = [self.ttl_seconds, self._channel(task_id)]
+        for op in ops:
+            args.append(len(op))
+            args.extend(op)
+        return bool(self._guarded_write(keys=list(self._keys(task_id)), args=args))
+
+    def initialize_task(self, task_id: str, model_choice: str, start_time: str | None, end_time: str | None) -> None:
+        h, text, segments, meta = self._keys(task_id)
+        pipe = self._pipeline()
+        pipe.delete(h, text, segments, meta)
+        pipe.hset(
+            h,
+            mapping={
+                "status": "processing",
+                "progress": 0.0,
+                "canceled": 0,
+                "tokens_input": 0,
+                "tokens_output": 0,
+                "text_epoch": 0,
+            },
+        )
+        pipe.set(text, "")
+        pipe.hset(
+            meta,
+            mapping={
+                "model_choice": json.dumps(model_choice),
+                "start_time": json.dumps(start_time),
+                "end_time": json.dumps(end_time),
+            },
+        )
+        self._commit(pipe, task_id, h, text, meta)
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """回傳任務快照（與 MemoryTaskStore 相同的 dict 結構）；一次往返讀取四個鍵。"""
+        h, text, segments, meta = self._keys(task_id)
+        pipe = self._pipeline()
+        pipe.hgetall(h)
+        pipe.get(text)
+        pipe.lrange(segments, 0, -1)
+        pipe.hgetall(meta)
+        fields, partial_text, raw_segments, raw_meta = pipe.execute()
+        if not fields or "status" not in fields:
+            return None
+        task: Dict[str, Any] = {
+            "status": fields["status"],
+            "progress": float(fields.get("progress") or 0.0),
+            "partial_text": partial_text or "",
+            "segments": [json.loads(s) for s in raw_segments],
+            "tokens": {
+                "input": int(fields.get("tokens_input") or 0),
+                "output": int(fields.get("tokens_output") or 0),
+            },
+            "canceled": fields.get("canceled") == "1",
+            "text_epoch": int(fields.get("text_epoch") or 0),
+            "meta": {k: json.loads(v) for k, v in raw_meta.items()},
+        }
+        if "error" in fields:
+            task["error"] = fields["error"]
+        return task
+
+    def get_task_delta(
+        self, task_id: str, *, text_offset: int = 0, segment_offset: int = 0, text_epoch: int = 0
+    ) -> Optional[Dict[str, Any]]:
+        """回傳游標之後新增的 partial_text 與 segments（結構同 MemoryTaskStore.get_task_delta）。
+
+        以 MULTI 一次往返取得一致的快照；text 位移為 UTF-8 位元組數。游標失效時再讀一次完整內容。
+        """
+        h, text_key, segments_key, _ = self._keys(task_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hgetall(h)
+        pipe.strlen(text_key)
+        pipe.getrange(text_key, max(0, text_offset), -1)
+        pipe.llen(segments_key)
+        pipe.lrange(segments_key, max(0, segment_offset), -1)
+        fields, text_len, text, segments_len, raw_segments = pipe.execute()
+        if not fields or "status" not in fields:
+            return None
+        epoch = int(fields.get("text_epoch") or 0)
+        reset = epoch != text_epoch or text_offset > text_len or segment_offset > segments_len
+        if reset:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.hgetall(h)
+            pipe.strlen(text_key)
+            pipe.get(text_key)
+            pipe.llen(segments_key)
+            pipe.lrange(segments_key, 0, -1)
+            fields, text_len, text, segments_len, raw_segments = pipe.execute()
+            if not fields or "status" not in fields:
+                return None
+            epoch = int(fields.get("text_epoch") or 0)
+        return {
+            "status": fields["status"],
+            "progress": float(fields.get("progress") or 0.0),
+            "tokens": {
+                "input": int(fields.get("tokens_input") or 0),
+                "output": int(fields.get("tokens_output") or 0),
+            },
+            "error": fields.get("error", ""),
+            "text": text or "",
+            "segments": [json.loads(s) for s in raw_segments],
+            "reset": reset,
+            "cursor": {"text": int(text_len), "segments": int(segments_len), "epoch": epoch},
+        }
+
+    def subscribe(self, task_id: str) -> TaskSubscription:
+        """訂閱任務變更；第一次呼叫時啟動本行程的 pub/sub 監聽執行緒（所有任務共用一條連線）。"""
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="task-store-events", daemon=True)
+                self._listener.start()
+        return task_events.subscribe(task_id)
+
+    def _listen(self) -> None:
+        pattern = f"{self.prefix}*:changed"
+        suffix = len(":changed")
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(pattern)
+                # 斷線重連期間可能漏掉通知：叫醒所有訂閱者重新讀取
+                task_events.notify_all()
+                for message in pubsub.listen():
+                    if message.get("type") == "pmessage":
+                        task_events.notify(message["channel"][len(self.prefix) : -suffix])
+            except Exception:
+                time.sleep(1.0)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+    def append_segment(self, task_id: str, start: float, end: float, text: str) -> None:
+        self.commit_chunk(task_id, segments=[{"start": start, "end": end, "text": text}])
+
+    def commit_chunk(
+        self,
+        task_id: str,
+        *,
+        segments: List[Dict[str, Any]],
+        text: str = "",
+        progress: Optional[float] = None,
+    ) -> None:
+        h, text_key, segments_key, _ = self._keys(task_id)
+        ops: List[tuple] = []
+        if segments:
+            ops.append(
+                (
+                    "RPUSH",
+                    segments_key,
+                    *[
+                        json.dumps(
+                            {"start": seg["start"], "end": seg["end"], "text": "" if seg.get("text") is None else str(seg["text"])},
+                            ensure_ascii=False,
+                        )
+                        for seg in segments
+                    ],
+                )
+            )
+        if text:
+            ops.append(("APPEND", text_key, text))
+        if progress is not None:
+            ops.append(("HSET", h, "progress", float(max(0.0, min(100.0, progress)))))
+        self._write(task_id, ops)
+
+    def update_progress(self, task_id: str, progress: float) -> None:
+        self.commit_chunk(task_id, segments=[], progress=progress)
+
+    def _set_fields(self, task_id: str, mapping: Dict[str, Any]) -> None:
+        h = self._keys(task_id)[0]
+        fields = [item for pair in mapping.items() for item in pair]
+        self._write(task_id, [("HSET", h, *fields)])
+
+    def mark_completed(self, task_id: str) -> None:
+        self._set_fields(task_id, {"status": "completed", "progress": 100.0})
+
+    def mark_failed(self, task_id: str, error_message: str) -> None:
+        self._set_fields(task_id, {"status": "failed", "error": error_message})
+
+    def update_partial_text(self, task_id: str, text: str, *, append: bool = True) -> None:
+        h, text_key = self._keys(task_id)[:2]
+        safe_text = "" if text is None else str(text)
+        if append:
+            if not safe_text:
+                return
+            self._write(task_id, [("APPEND", text_key, safe_text)])
+        else:
+            self._write(task_id, [("SET", text_key, safe_text), ("HINCRBY", h, "text_epoch", 1)])
+
+    def increment_tokens(self, task_id: str, input_tokens: int = 0, output_tokens: int = 0) -> None:
+        h = self._keys(task_id)[0]
+        self._write(
+            task_id,
+            [
+                ("HINCRBY", h, "tokens_input", int(max(0, input_tokens))),
+                ("HINCRBY", h, "tokens_output", int(max(0, output_tokens))),
+            ],
+        )
+
+    def set_tokens(self, task_id: str, input_tokens: int | None = None, output_tokens: int | None = None) -> None:
+        mapping: Dict[str, Any] = {}
+        if input_tokens is not None:
+            mapping["tokens_input"] = int(max(0, input_tokens))
+        if output_tokens is not None:
+            mapping["tokens_output"] = int(max(0, output_tokens))
+        if mapping:
+            self._set_fields(task_id, mapping)
+
+    def update_meta(self, task_id: str, key: str, value: Any) -> None:
+        """在 meta 底下記錄附加資訊（例如管線各階段的使用率統計）。"""
+        meta = self._keys(task_id)[3]
+        self._write(task_id, [("HSET", meta, key, json.dumps(value, ensure_ascii=False, default=str))])
+
+    def mark_canceled(self, task_id: str) -> None:
+        self._set_fields(task_id, {"canceled": 1, "status": "canceled"})
+
+    def is_canceled(self, task_id: str) -> bool:
+        return self.redis.hget(self._keys(task_id)[0], "canceled") == "1"
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Dict, Set
+
+
+class TaskSubscription:
+    """單一 WebSocket 對某個任務的變更訂閱；任務有寫入時 wait() 會被喚醒。
+
+    用法：每輪先 clear() 再讀取任務，之後 wait()；讀取期間發生的寫入會讓下一次 wait() 立即返回，不會漏掉。
+    """
+
+    def __init__(self, notifier: "TaskChangeNotifier", task_id: str, loop: asyncio.AbstractEventLoop) -> None:
+        self._notifier = notifier
+        self.task_id = task_id
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def clear(self) -> None:
+        self._event.clear()
+
+    def _set_threadsafe(self) -> None:
+        # 寫入來自工作執行緒（管線、Redis 監聽執行緒），必須透過事件迴圈設定
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # 事件迴圈已關閉
+            pass
+
+    async def wait(self, timeout: float) -> bool:
+        """等到有變更（True）或逾時（False）。"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=max(0.0, timeout))
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def close(self) -> None:
+        self._notifier._remove(self)
+
+    def __enter__(self) -> "TaskSubscription":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class TaskChangeNotifier:
+    """行程內的任務變更通知：TaskStore 每次寫入呼叫 notify()，叫醒該任務的所有訂閱者。
+
+    MemoryTaskStore 直接在寫入時通知；RedisTaskStore 由 pub/sub 監聽執行緒轉發其他行程的寫入。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[TaskSubscription]] = {}
+
+    def subscribe(self, task_id: str) -> TaskSubscription:
+        """必須在事件迴圈內呼叫。"""
+        sub = TaskSubscription(self, task_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(task_id, set()).add(sub)
+        return sub
+
+    def _remove(self, sub: TaskSubscription) -> None:
+        with self._lock:
+            subs = self._subscribers.get(sub.task_id)
+            if subs is None:
+                return
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.task_id]
+
+    def notify(self, task_id: str) -> None:
+        with self._lock:
+            subs = list(self._subscribers.get(task_id, ()))
+        for sub in subs:
+            sub._set_threadsafe()
+
+    def notify_all(self) -> None:
+        """通知來源可能漏訊息時（例如 pub/sub 重新連線）叫醒所有訂閱者重新讀取。"""
+        with self._lock:
+            subs = [sub for group in self._subscribers.values() for sub in group]
+        for sub in subs:
+            sub._set_threadsafe()
+
+
+# 行程共用
+task_events = TaskChangeNotifier()
@@ -1,32 +1,59 @@
 from __future__ import annotations
 
-import asyncio
+from typing import Any, Dict
 
 from .celery_app import celery_app
 from .services.transcription_remote import transcribe_with_remote_llm
-from .storage import save_temp_upload, delete_file_silent, read_file_bytes
+from .spool import SpooledFile, sweep_spool
+from .uploads import sweep_upload_sessions
+from .storage import TaskStore, delete_file_silent
+from .utils.workspace import sweep_stale_workspaces
 from .services.transcription_vertex import transcribe_with_vertex_ai
 
 
+def _open_source(task_id: str, source: Dict[str, Any]) -> SpooledFile | None:
+    spooled = SpooledFile.from_dict(source)
+    try:
+        spooled.verify()
+    except Exception as e:
+        TaskStore.mark_failed(task_id, error_message=str(e))
+        delete_file_silent(spooled.path)
+        return None
+    return spooled
+
+
 @celery_app.task(name="transcribe_remote")
-def transcribe_remote_task(task_id: str, raw_bytes: bytes, start_time: str | None, end_time: str | None) -> None:
-    # 某些 broker/backend 對大型 bytes 支援不佳，可以先落地檔案再讀回
-    path = save_temp_upload(raw_bytes, suffix=".bin")
+def transcribe_remote_task(
+    task_id: str,
+    source: Dict[str, Any],
+    start_time: str | None,
+    end_time: str | None,
+    chunk_length: float | None = None,
+    chunking: str | None = None,
+    vertex_params: Dict[str, Any] | None = None,
+) -> None:
+    # source 為 API 端 spool 檔的描述（path/size/sha256），worker 直接讀取共用目錄
+    spooled = _open_source(task_id, source)
+    if spooled is None:
+        return
     try:
-        data = read_file_bytes(path)
         transcribe_with_remote_llm(
             task_id=task_id,
-            raw_bytes=data,
+            src_path=spooled.path,
             start_time=start_time,
             end_time=end_time,
+            chunk_length_s=float(chunk_length or 30.0),
+            content_sha256=spooled.sha256,
+            chunking=chunking,
+            vertex_params=vertex_params,
         )
     finally:
-        delete_file_silent(path)
+        delete_file_silent(spooled.path)
 
 @celery_app.task(name="transcribe_vertex")
 def transcribe_vertex_task(
     task_id: str,
-    raw_bytes: bytes,
+    source: Dict[str, Any],
     start_time: str | None,
     end_time: str | None,
     language_code: str = "zh-TW",
@@ -37,13 +64,15 @@ def transcribe_vertex_task(
     thinking_budget: int | None = None,
     safety_off: bool | None = None,
     chunk_length: float | None = None,
+    chunking: str | None = None,
 ) -> None:
-    path = save_temp_upload(raw_bytes, suffix=".bin")
+    spooled = _open_source(task_id, source)
+    if spooled is None:
+        return
     try:
-        data = read_file_bytes(path)
         transcribe_with_vertex_ai(
             task_id=task_id,
-            raw_bytes=data,
+            src_path=spooled.path,
             start_time=start_time,
             end_time=end_time,
             chunk_length_s=float(chunk_length or 30.0),
@@ -54,8 +83,13 @@ def transcribe_vertex_task(
             max_output_tokens=int(max_output_tokens or 65535),
             thinking_budget=int(thinking_budget or 0),
             safety_off=bool(safety_off if safety_off is not None else True),
+            content_sha256=spooled.sha256,
+            chunking=chunking,
         )
     finally:
-        delete_file_silent(path)
+        delete_file_silent(spooled.path)
 
 
+@celery_app.task(name="sweep_spool")
+def sweep_spool_task() -> int:
+    return sweep_spool() + sweep_upload_sessions() + sweep_stale_workspaces()
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from .config import settings
+from .spool import SpooledFile, spool_dir, spool_path_for
+from .storage import delete_file_silent, file_sha256
+
+
+_CONTENT_RANGE_RE = re.compile(r"^\s*bytes\s+(\d+)-(\d+)/(\d+|\*)\s*$")
+_UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    """可續傳上傳的錯誤，status_code 對應 HTTP 狀態碼。"""
+
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sessions_dir() -> Path:
+    """上傳工作階段放在 spool 目錄下的獨立子目錄，不受 sweep_spool 的固定 TTL 影響。"""
+    path = spool_dir() / "uploads"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _data_path(upload_id: str) -> Path:
+    return sessions_dir() / f"{upload_id}.upload"
+
+
+def _meta_path(upload_id: str) -> Path:
+    return sessions_dir() / f"{upload_id}.upload.json"
+
+
+def _ranges_path(upload_id: str) -> Path:
+    # 每收到一段就 append 一行 "start end"，多個請求並行寫入也不會互相覆蓋；其修改時間即為最後活動時間
+    return sessions_dir() / f"{upload_id}.upload.ranges"
+
+
+def _load_meta(upload_id: str) -> Dict[str, Any]:
+    if not _UPLOAD_ID_RE.match(upload_id or ""):
+        raise UploadError(404, "找不到此上傳工作階段")
+    try:
+        with open(_meta_path(upload_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadError(404, "找不到此上傳工作階段")
+
+
+def merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    """合併半開區間 [start, end)，回傳排序後不重疊的區間。"""
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _received_ranges(upload_id: str) -> List[List[int]]:
+    ranges: List[List[int]] = []
+    try:
+        with open(_ranges_path(upload_id), "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2:
+                    ranges.append([int(parts[0]), int(parts[1])])
+    except FileNotFoundError:
+        pass
+    return merge_ranges(ranges)
+
+
+def _missing_ranges(received: List[List[int]], size: int) -> List[List[int]]:
+    missing: List[List[int]] = []
+    cursor = 0
+    for start, end in received:
+        if start > cursor:
+            missing.append([cursor, start])
+        cursor = max(cursor, end)
+    if cursor < size:
+        missing.append([cursor, size])
+    return missing
+
+
+def parse_content_range(header: Optional[str], size: int) -> tuple[int, int]:
+    """解析 `Content-Range: bytes start-end/total`，回傳半開區間 [start, end)。"""
+    match = _CONTENT_RANGE_RE.match(header or "")
+    if not match:
+        raise UploadError(400, "缺少或無效的 Content-Range，格式需為 bytes start-end/total")
+    start, last, total = int(match.group(1)), int(match.group(2)), match.group(3)
+    if total != "*" and int(total) != size:
+        raise UploadError(400, "Content-Range 的總長度與建立時宣告的大小不符")
+    if last < start or last >= size:
+        raise UploadError(416, "位元組範圍超出檔案大小")
+    return start, last + 1
+
+
+def create_session(filename: str, size: int) -> Dict[str, Any]:
+    if size <= 0:
+        raise UploadError(400, "檔案大小需大於 0")
+    upload_id = uuid.uuid4().hex
+    meta = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "size": int(size),
+        "created_at": time.time(),
+    }
+    # 先建立完整大小的稀疏檔，之後各段可依任意順序直接寫入對應位置
+    with open(_data_path(upload_id), "wb") as f:
+        f.truncate(int(size))
+    _ranges_path(upload_id).touch()
+    with open(_meta_path(upload_id), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return meta
+
+
+def session_status(upload_id: str) -> Dict[str, Any]:
+    meta = _load_meta(upload_id)
+    size = int(meta["size"])
+    received = _received_ranges(upload_id)
+    missing = _missing_ranges(received, size)
+    return {
+        "upload_id": upload_id,
+        "filename": meta.get("filename", ""),
+        "size": size,
+        "received": received,
+        "missing": missing,
+        "received_bytes": sum(end - start for start, end in received),
+        "complete": not missing,
+    }
+
+
+def _open_for_range(upload_id: str, start: int):
+    try:
+        f = open(_data_path(upload_id), "r+b")
+    except FileNotFoundError:
+        # 已被 finalize、放棄或逾時回收
+        raise UploadError(404, "找不到此上傳工作階段")
+    f.seek(start)
+    return f
+
+
+def _record_range(upload_id: str, start: int, end: int) -> Dict[str, Any]:
+    with open(_ranges_path(upload_id), "a", encoding="utf-8") as f:
+        f.write(f"{start} {end}\n")
+    return session_status(upload_id)
+
+
+async def write_range(upload_id: str, content_range: Optional[str], body: AsyncIterator[bytes]) -> Dict[str, Any]:
+    """將請求內容串流寫入 spool 檔的指定位置，不在記憶體累積整段資料。
+
+    檔案 I/O 都放到 threadpool，避免慢速磁碟阻塞事件迴圈。
+    """
+    meta = await run_in_threadpool(_load_meta, upload_id)
+    start, end = parse_content_range(content_range, int(meta["size"]))
+    written = 0
+    f = await run_in_threadpool(_open_for_range, upload_id, start)
+    try:
+        async for block in body:
+            if not block:
+                continue
+            if written + len(block) > end - start:
+                raise UploadError(400, "請求內容長度超過 Content-Range 宣告的範圍")
+            await run_in_threadpool(f.write, block)
+            written += len(block)
+    finally:
+        await run_in_threadpool(f.close)
+    if written != end - start:
+        raise UploadError(400, f"請求內容長度不符（預期 {end - start}，實際 {written}）")
+    return await run_in_threadpool(_record_range, upload_id, start, end)
+
+
+def finalize_session(upload_id: str, task_id: str) -> SpooledFile:
+    """確認所有區段都已收齊後，將資料檔轉為該任務的 spool 檔（僅 rename，不複製）。"""
+    status = session_status(upload_id)
+    if not status["complete"]:
+        raise UploadError(409, "上傳尚未完成，仍有缺少的位元組範圍")
+    meta = _load_meta(upload_id)
+    target = spool_path_for(task_id, Path(meta.get("filename") or "").suffix.lower())
+    try:
+        # rename 是原子操作：並行或重試的 finalize 只有一個會成功，其餘回報 409
+        os.replace(_data_path(upload_id), target)
+    except FileNotFoundError:
+        raise UploadError(409, "此上傳工作階段已完成 finalize 或已被放棄")
+    discard_session(upload_id)
+    return SpooledFile(path=str(target), size=int(meta["size"]), sha256=file_sha256(str(target)))
+
+
+def discard_session(upload_id: str) -> None:
+    for path in (_data_path(upload_id), _meta_path(upload_id), _ranges_path(upload_id)):
+        delete_file_silent(str(path))
+
+
+def sweep_upload_sessions(ttl_seconds: float | None = None) -> int:
+    """刪除超過 TTL 沒有任何活動（建立或 PUT）的上傳工作階段，回傳刪除數量。"""
+    ttl = settings.upload_session_ttl_seconds if ttl_seconds is None else ttl_seconds
+    if ttl <= 0:
+        return 0
+    cutoff = time.time() - ttl
+    last_activity: Dict[str, float] = {}
+    for entry in sessions_dir().iterdir():
+        upload_id = entry.name.split(".", 1)[0]
+        try:
+            mtime = entry.stat().st_mtime
+        except OSError:
+            continue
+        last_activity[upload_id] = max(last_activity.get(upload_id, 0.0), mtime)
+    removed = 0
+    for upload_id, mtime in last_activity.items():
+        if mtime < cutoff:
+            discard_session(upload_id)
+            removed += 1
+    return removed
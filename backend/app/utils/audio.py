@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import io
+import struct
+from typing import Iterator, Optional, Union
+
+from .ffmpeg import PcmSource, ffmpeg_encode_pcm
+
+try:  # 選用：安裝 soundfile 時可直接在行程內讀取 16 kHz 單聲道 FLAC
+    import soundfile  # type: ignore
+except Exception:  # pragma: no cover - 依部署環境而定
+    soundfile = None
+
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2  # int16
+CHANNELS = 1
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+class PcmBuffer:
+    """16 kHz 單聲道 int16 PCM；offset_s 為第一個樣本在原始音訊中的絕對秒數。
+
+    slice() 回傳 memoryview，分塊時不會複製樣本資料。
+    """
+
+    def __init__(self, data: BytesLike, offset_s: float = 0.0, sample_rate: int = SAMPLE_RATE) -> None:
+        self._view = memoryview(data).cast("B")
+        self.offset_s = float(offset_s)
+        self.sample_rate = int(sample_rate)
+
+    @property
+    def num_samples(self) -> int:
+        return len(self._view) // SAMPLE_WIDTH
+
+    @property
+    def duration_s(self) -> float:
+        return self.num_samples / float(self.sample_rate)
+
+    @property
+    def end_s(self) -> float:
+        return self.offset_s + self.duration_s
+
+    def sample_index(self, seconds: float) -> int:
+        """將絕對秒數換算為 buffer 內的樣本索引（夾在有效範圍內）。"""
+        index = int(round((float(seconds) - self.offset_s) * self.sample_rate))
+        return max(0, min(index, self.num_samples))
+
+    def slice(self, offset_s: float, duration_s: float) -> memoryview:
+        start = self.sample_index(offset_s)
+        end = self.sample_index(offset_s + duration_s)
+        return self._view[start * SAMPLE_WIDTH : end * SAMPLE_WIDTH]
+
+    def release(self) -> None:
+        self._view.release()
+
+
+def wav_header(num_data_bytes: int, sample_rate: int = SAMPLE_RATE, channels: int = CHANNELS, sample_width: int = SAMPLE_WIDTH) -> bytes:
+    """產生 44 bytes 的 PCM WAV 檔頭。"""
+    byte_rate = sample_rate * channels * sample_width
+    block_align = channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + num_data_bytes,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        channels,
+        sample_rate,
+        byte_rate,
+        block_align,
+        sample_width * 8,
+        b"data",
+        num_data_bytes,
+    )
+
+
+def pcm_to_wav_bytes(pcm: BytesLike, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """在記憶體中為 PCM 片段加上 WAV 檔頭（不經過暫存檔）。"""
+    return wav_header(len(pcm), sample_rate=sample_rate) + bytes(pcm)
+
+
+# 分塊上傳格式 → MIME type；flac 為無損，opus 以 Ogg 容器封裝、位元率可調
+PAYLOAD_CODECS = {
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "opus": "audio/ogg",
+}
+
+
+def encode_pcm_payload(pcm: BytesLike, codec: str = "wav", *, bitrate_kbps: int = 24, sample_rate: int = SAMPLE_RATE) -> tuple[bytes, str]:
+    """把 PCM 片段編碼成要上傳的音訊，回傳 (bytes, mime_type)；wav 只加檔頭，其餘經 ffmpeg pipe 編碼。"""
+    codec = (codec or "wav").lower()
+    if codec not in PAYLOAD_CODECS:
+        raise ValueError(f"不支援的音訊格式：{codec}（可用：{', '.join(PAYLOAD_CODECS)}）")
+    if codec == "wav":
+        return pcm_to_wav_bytes(pcm, sample_rate=sample_rate), PAYLOAD_CODECS[codec]
+    if codec == "flac":
+        args = ["-map_metadata", "-1", "-c:a", "flac", "-compression_level", "5", "-f", "flac", "pipe:1"]
+    else:
+        args = [
+            "-map_metadata", "-1", "-c:a", "libopus", "-b:a", f"{max(6, int(bitrate_kbps))}k",
+            "-application", "voip", "-compression_level", "5", "-f", "ogg", "pipe:1",
+        ]
+    return ffmpeg_encode_pcm(pcm, args, sample_rate=sample_rate), PAYLOAD_CODECS[codec]
+
+
+def iter_native_flac(
+    input_path: PcmSource, start_s: float, end_s: Optional[float], block_frames: int = 64 * 1024
+) -> Optional[tuple[float, Iterator[memoryview]]]:
+    """以 soundfile 在行程內逐區塊讀取 16 kHz 單聲道 FLAC 的 [start_s, end_s)。
+
+    回傳 (第一個樣本的絕對秒數, int16 區塊迭代器)；未安裝 soundfile 或格式不符時回傳 None（改用 ffmpeg）。
+    迭代中途的解碼錯誤會直接拋出。
+    """
+    if soundfile is None:
+        return None
+    if not isinstance(input_path, str):
+        input_path = io.BytesIO(input_path)
+    try:
+        f = soundfile.SoundFile(input_path)
+    except Exception:
+        return None
+    if f.samplerate != SAMPLE_RATE or f.channels != CHANNELS:
+        f.close()
+        return None
+    start = max(0, min(int(round(start_s * SAMPLE_RATE)), f.frames))
+    stop = f.frames if end_s is None else max(start, min(int(round(end_s * SAMPLE_RATE)), f.frames))
+
+    def blocks() -> Iterator[memoryview]:
+        with f:
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                data = memoryview(f.buffer_read(min(block_frames, remaining), dtype="int16"))
+                if not data.nbytes:
+                    break
+                yield data
+                remaining -= data.nbytes // SAMPLE_WIDTH
+
+    return start / SAMPLE_RATE, blocks()
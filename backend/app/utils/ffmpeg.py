@@ -3,9 +3,8 @@ from __future__ import annotations
 import os
 import shutil
 import subprocess
-import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Union
 
 
 def _append_ffmpeg_path_from_env() -> None:
@@ -41,79 +40,60 @@ def ensure_ffmpeg_available() -> None:
     _append_ffmpeg_path_from_env()
     if shutil.which("ffmpeg") is None:
         raise RuntimeError("找不到 ffmpeg，請安裝或在 .env 設定 FFMPEG_PATH。")
-    if shutil.which("ffprobe") is None:
-        raise RuntimeError("找不到 ffprobe，請安裝或在 .env 設定 FFMPEG_PATH。")
 
 
-def ffprobe_duration_seconds(input_path: str) -> float:
-    ensure_ffmpeg_available()
-    cmd = [
-        "ffprobe",
-        "-v",
-        "error",
-        "-show_entries",
-        "format=duration",
-        "-of",
-        "default=noprint_wrappers=1:nokey=1",
-        input_path,
-    ]
-    result = subprocess.run(cmd, capture_output=True, check=True)
-    out = result.stdout.decode(errors="ignore").strip()
-    try:
-        return float(out)
-    except Exception:
-        return 0.0
-
-
-def ffmpeg_trim_to_file(
-    input_path: str,
-    output_suffix: str = ".wav",
-    start_seconds: Optional[float] = None,
-    end_seconds: Optional[float] = None,
-) -> str:
-    ensure_ffmpeg_available()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=output_suffix) as tmp:
-        out_path = tmp.name
-
-    cmd = ["ffmpeg", "-y"]
-    if start_seconds is not None:
-        cmd += ["-ss", str(max(0.0, start_seconds))]
-    cmd += ["-i", input_path]
-    if end_seconds is not None and start_seconds is not None and end_seconds > start_seconds:
-        duration = max(0.0, end_seconds - start_seconds)
-        cmd += ["-t", str(duration)]
-    # 輸出為 wav 以相容 downstream
-    cmd += ["-acodec", "pcm_s16le", "-ac", "1", "-ar", "16000", out_path]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return out_path
-
-
-def ffmpeg_extract_segment_to_wav(
-    input_path: str,
-    offset_seconds: float,
-    duration_seconds: float,
-) -> str:
-    ensure_ffmpeg_available()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-        out_path = tmp.name
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-ss",
-        str(max(0.0, offset_seconds)),
-        "-i",
-        input_path,
-        "-t",
-        str(max(0.0, duration_seconds)),
-        "-acodec",
-        "pcm_s16le",
-        "-ac",
-        "1",
-        "-ar",
-        "16000",
-        out_path,
-    ]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return out_path
+PcmSource = Union[str, bytes, bytearray, memoryview]
 
 
+def ffmpeg_pipe(
+    args: List[str],
+    source: PcmSource,
+    *,
+    input_args: Optional[List[str]] = None,
+) -> bytes:
+    """執行 ffmpeg，輸入為檔案路徑或記憶體 buffer（經 stdin），輸出由 stdout 取回。
+
+    args 為 `-i` 之後的參數，最後一個需為 `pipe:1`；input_args 放在 `-i` 之前（例如原始 PCM 的
+    `-f s16le -ar 16000 -ac 1`）。buffer 經 stdin 傳入，只適用於不需 seek 的格式（例如原始 PCM）。
+    """
+    ensure_ffmpeg_available()
+    if isinstance(source, str):
+        cmd = ["ffmpeg", "-v", "error", "-nostdin"]
+        input_arg = source
+        input_data: Optional[Union[bytes, bytearray, memoryview]] = None
+    else:
+        cmd = ["ffmpeg", "-v", "error"]
+        input_arg = "pipe:0"
+        input_data = source
+    result = subprocess.run(
+        cmd + _split_input_args(args, input_arg, input_args or []),
+        input=input_data,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    return result.stdout
+
+
+def _split_input_args(args: List[str], input_arg: str, input_args: List[str]) -> List[str]:
+    # `-ss` 放在 -i 之前做快速 seek，其餘參數放在 -i 之後
+    before: List[str] = list(input_args)
+    after: List[str] = []
+    i = 0
+    while i < len(args):
+        if args[i] == "-ss" and i + 1 < len(args):
+            before += args[i : i + 2]
+            i += 2
+            continue
+        after.append(args[i])
+        i += 1
+    return before + ["-i", input_arg] + after
+
+
+def ffmpeg_encode_pcm(
+    pcm: PcmSource,
+    args: List[str],
+    sample_rate: int = 16000,
+) -> bytes:
+    """把記憶體中的 16-bit 單聲道 PCM 經 stdin 交給 ffmpeg 編碼，args 為輸出參數（以 `pipe:1` 結尾）。"""
+    return ffmpeg_pipe(args, pcm, input_args=["-f", "s16le", "-ar", str(sample_rate), "-ac", "1"])
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import gc
+import logging
+import mmap
+import os
+import struct
+import subprocess
+import threading
+import wave
+from typing import Any, Callable, Optional
+
+from .audio import CHANNELS, SAMPLE_RATE, SAMPLE_WIDTH, PcmBuffer, iter_native_flac
+from .ffmpeg import ensure_ffmpeg_available
+from .workspace import TaskWorkspace, WorkspaceQuotaExceeded
+
+try:  # 選用：提供 NumPy 視圖給 VAD 等向量化運算
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover - 依部署環境而定
+    np = None
+
+
+_MAGIC = b"STTPCM01"
+# magic, sample_rate, channels, sample_width, num_samples, offset_s
+_HEADER = struct.Struct("<8sIHHQd")
+HEADER_SIZE = _HEADER.size
+_COPY_BLOCK = 1024 * 1024
+# ffmpeg 失敗時只保留 stderr 最後這麼多位元組放進例外
+_STDERR_TAIL = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class PcmStore:
+    """解碼後的 PCM 以「小檔頭 + int16 樣本」寫入磁碟，再以唯讀 mmap 開啟。
+
+    buffer / samples() 都是 mmap 的視圖，切片不會複製資料；常駐記憶體只與實際讀取中的分塊有關，
+    不隨錄音長度成長。
+    """
+
+    def __init__(self, path: str, *, delete_on_close: bool = True) -> None:
+        self.path = path
+        self.delete_on_close = delete_on_close
+        self._file = open(path, "rb")
+        header = self._file.read(HEADER_SIZE)
+        magic, sample_rate, channels, sample_width, num_samples, offset_s = _HEADER.unpack(header)
+        if magic != _MAGIC:
+            self._file.close()
+            raise ValueError(f"不是有效的 PCM store：{path}")
+        self.sample_rate = int(sample_rate)
+        self.channels = int(channels)
+        self.sample_width = int(sample_width)
+        self.num_samples = int(num_samples)
+        self.offset_s = float(offset_s)
+        self._mmap: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+        self._buffer: Optional[PcmBuffer] = None
+        self._samples: Any = None
+        if self.num_samples > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap)[HEADER_SIZE : HEADER_SIZE + self.num_samples * self.sample_width]
+            self._buffer = PcmBuffer(self._view, offset_s=self.offset_s, sample_rate=self.sample_rate)
+        else:
+            self._buffer = PcmBuffer(b"", offset_s=self.offset_s, sample_rate=self.sample_rate)
+
+    def __enter__(self) -> "PcmStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @property
+    def buffer(self) -> PcmBuffer:
+        assert self._buffer is not None
+        return self._buffer
+
+    def samples(self) -> Any:
+        """回傳 int16 的 NumPy 視圖（不複製）；未安裝 NumPy 時拋出 RuntimeError。"""
+        if np is None:
+            raise RuntimeError("需要 numpy 才能取得樣本陣列")
+        if self._mmap is None:
+            return np.zeros(0, dtype=np.int16)
+        # 只建立一個視圖並由 close() 釋放；呼叫端的切片都以它為 base
+        if self._samples is None:
+            self._samples = np.frombuffer(self._mmap, dtype="<i2", count=self.num_samples, offset=HEADER_SIZE)
+        return self._samples
+
+    def close(self) -> None:
+        """先釋放所有視圖並關閉 mmap 與檔案，再刪除檔案；Windows 上仍被映射的檔案無法刪除。"""
+        self._samples = None
+        if self._buffer is not None:
+            try:
+                self._buffer.release()
+            except BufferError:
+                pass
+            self._buffer = None
+        if self._view is not None:
+            try:
+                self._view.release()
+            except BufferError:
+                pass
+            self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # 呼叫端仍持有切片（可能在參考循環中）：回收一次後再試
+                gc.collect()
+                try:
+                    self._mmap.close()
+                except BufferError:
+                    logger.warning("PCM store %s 仍有視圖未釋放，mmap 無法關閉", self.path)
+            self._mmap = None
+        self._file.close()
+        if self.delete_on_close:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("無法刪除 PCM store %s：%s", self.path, e)
+
+
+# 每寫入一個區塊前呼叫，超過工作區容量時拋出 WorkspaceQuotaExceeded
+Reserve = Callable[[int], None]
+
+
+def _write_header(f, num_samples: int, offset_s: float) -> None:
+    f.seek(0)
+    f.write(_HEADER.pack(_MAGIC, SAMPLE_RATE, CHANNELS, SAMPLE_WIDTH, int(num_samples), float(offset_s)))
+
+
+def _store_native_wav(input_path: str, start_s: float, end_s: Optional[float], out_path: str, reserve: Reserve) -> Optional[float]:
+    try:
+        with wave.open(input_path, "rb") as wav:
+            if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) != (SAMPLE_RATE, CHANNELS, SAMPLE_WIDTH):
+                return None
+            total = wav.getnframes()
+            start = max(0, min(int(round(start_s * SAMPLE_RATE)), total))
+            end = total if end_s is None else max(start, min(int(round(end_s * SAMPLE_RATE)), total))
+            wav.setpos(start)
+            frames_per_block = _COPY_BLOCK // SAMPLE_WIDTH
+            with open(out_path, "wb") as out:
+                _write_header(out, 0, start / SAMPLE_RATE)
+                remaining = end - start
+                while remaining > 0:
+                    block = wav.readframes(min(frames_per_block, remaining))
+                    if not block:
+                        break
+                    reserve(len(block))
+                    out.write(block)
+                    remaining -= len(block) // SAMPLE_WIDTH
+                written = (out.tell() - HEADER_SIZE) // SAMPLE_WIDTH
+                _write_header(out, written, start / SAMPLE_RATE)
+    except (wave.Error, EOFError):
+        return None
+    return start / SAMPLE_RATE
+
+
+def _store_native_flac(input_path: str, start_s: float, end_s: Optional[float], out_path: str, reserve: Reserve) -> Optional[float]:
+    native = iter_native_flac(input_path, start_s, end_s, block_frames=_COPY_BLOCK // SAMPLE_WIDTH)
+    if native is None:
+        return None
+    offset_s, blocks = native
+    try:
+        with open(out_path, "wb") as out:
+            _write_header(out, 0, offset_s)
+            for block in blocks:
+                reserve(block.nbytes)
+                out.write(block)
+            written = (out.tell() - HEADER_SIZE) // SAMPLE_WIDTH
+            _write_header(out, written, offset_s)
+    except WorkspaceQuotaExceeded:
+        raise
+    except Exception:
+        # 檔案中途損毀等情況交給 ffmpeg 重新解碼（out_path 會被覆寫）
+        return None
+    return offset_s
+
+
+def _store_with_ffmpeg(input_path: str, start_s: float, end_s: Optional[float], out_path: str, reserve: Reserve) -> None:
+    ensure_ffmpeg_available()
+    cmd = ["ffmpeg", "-v", "error", "-nostdin"]
+    if start_s > 0:
+        cmd += ["-ss", str(start_s)]
+    cmd += ["-i", input_path]
+    if end_s is not None:
+        cmd += ["-t", str(max(0.0, end_s - start_s))]
+    cmd += ["-vn", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # stderr 必須同時讀取：損毀的輸入可能輸出大量錯誤訊息，塞滿 pipe 後 ffmpeg 會卡住、stdout 也不再有資料
+    stderr_tail = bytearray()
+
+    def drain_stderr() -> None:
+        assert proc.stderr is not None
+        for line in proc.stderr:
+            stderr_tail.extend(line)
+            if len(stderr_tail) > _STDERR_TAIL:
+                del stderr_tail[: len(stderr_tail) - _STDERR_TAIL]
+
+    drainer = threading.Thread(target=drain_stderr, name="ffmpeg-stderr", daemon=True)
+    drainer.start()
+    try:
+        with open(out_path, "wb") as out:
+            _write_header(out, 0, start_s)
+            assert proc.stdout is not None
+            while True:
+                block = proc.stdout.read(_COPY_BLOCK)
+                if not block:
+                    break
+                reserve(len(block))
+                out.write(block)
+            written = (out.tell() - HEADER_SIZE) // SAMPLE_WIDTH
+            _write_header(out, written, start_s)
+        returncode = proc.wait()
+        drainer.join()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, stderr=bytes(stderr_tail))
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        drainer.join(timeout=5.0)
+
+
+def decode_range_to_store(
+    input_path: str,
+    start_s: float = 0.0,
+    end_s: Optional[float] = None,
+    *,
+    workspace: TaskWorkspace,
+) -> PcmStore:
+    """將 [start_s, end_s) 只解碼一次為 16 kHz 單聲道 int16 PCM，以固定區塊串流寫入任務工作區內的 mmap 檔。
+
+    已是 16 kHz 單聲道的 WAV / FLAC（後者需安裝 soundfile）在行程內逐區塊讀取，其他格式只啟動一次 ffmpeg。
+    檔案計入工作區容量（WORKSPACE_QUOTA_BYTES），並隨工作區清除；worker 當機遺留的由 sweep_stale_workspaces 回收。
+    end_s 為 None 時解碼到檔尾，實際長度以 PcmBuffer.duration_s 為準。
+    """
+    start_s = max(0.0, float(start_s))
+    out_path = workspace.new_path(".pcm")
+    reserve = workspace.reserve
+    try:
+        native_offset = None
+        suffix = os.path.splitext(input_path)[1].lower()
+        if suffix == ".wav":
+            native_offset = _store_native_wav(input_path, start_s, end_s, out_path, reserve)
+        elif suffix == ".flac":
+            native_offset = _store_native_flac(input_path, start_s, end_s, out_path, reserve)
+        if native_offset is None:
+            _store_with_ffmpeg(input_path, start_s, end_s, out_path, reserve)
+        return PcmStore(out_path)
+    except Exception:
+        try:
+            os.remove(out_path)
+        except OSError:
+            pass
+        raise
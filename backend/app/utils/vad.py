@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+
+@dataclass
+class VadConfig:
+    frame_ms: float = 30.0
+    # 相對於噪音底（能量第 10 百分位）的門檻，以及絕對下限（dBFS）
+    energy_margin_db: float = 10.0
+    energy_floor_db: float = -50.0
+    # 噪音底的上限（dBFS）：連續說話、幾乎沒有靜音的錄音，第 10 百分位本身就是語音，
+    # 不設上限時門檻會被墊高到把小聲的語音當成靜音略過
+    noise_floor_max_db: float = -45.0
+    # 能量略低但過零率高的音框（摩擦音等無聲子音）也視為語音
+    zcr_threshold: float = 0.25
+    zcr_energy_slack_db: float = 6.0
+    # 語音區段前後保留的緩衝，以及視為「停頓」的最短靜音
+    hangover_s: float = 0.2
+    min_silence_s: float = 0.3
+    min_speech_s: float = 0.25
+    # 相鄰語音區段之間的靜音超過此秒數就不合併（例如等待音樂），另起新分塊以免把長靜音送出
+    max_gap_s: float = 2.0
+
+
+_BLOCK_FRAMES = 20000
+
+
+def _frame_features(samples: np.ndarray, frame_len: int) -> Tuple[np.ndarray, np.ndarray]:
+    """逐區塊計算每個音框的能量（dBFS）與過零率，避免一次把整段轉成 float。"""
+    n_frames = len(samples) // frame_len
+    energy_db = np.empty(n_frames, dtype=np.float32)
+    zcr = np.empty(n_frames, dtype=np.float32)
+    for start in range(0, n_frames, _BLOCK_FRAMES):
+        stop = min(n_frames, start + _BLOCK_FRAMES)
+        frames = samples[start * frame_len : stop * frame_len].reshape(stop - start, frame_len).astype(np.float32)
+        frames /= 32768.0
+        rms = np.sqrt(np.mean(frames * frames, axis=1) + 1e-12)
+        energy_db[start:stop] = 20.0 * np.log10(rms)
+        signs = np.signbit(frames)
+        zcr[start:stop] = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / float(frame_len - 1)
+    return energy_db, zcr
+
+
+def _runs(mask: np.ndarray) -> List[Tuple[int, int]]:
+    """回傳布林陣列中連續 True 的 [start, end) 音框區間。"""
+    if mask.size == 0:
+        return []
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return [(int(a), int(b)) for a, b in zip(edges[0::2], edges[1::2])]
+
+
+def _fill_short_gaps(speech: np.ndarray, min_gap: int) -> None:
+    """把語音之間短於 min_gap 個音框的空隙補成語音（就地修改；頭尾的靜音不補）。"""
+    for a, b in _runs(~speech):
+        if a > 0 and b < speech.size and b - a < min_gap:
+            speech[a:b] = True
+
+
+def detect_speech_frames(samples: np.ndarray, sample_rate: int, config: VadConfig) -> Tuple[np.ndarray, np.ndarray, int]:
+    frame_len = max(1, int(sample_rate * config.frame_ms / 1000.0))
+    energy_db, zcr = _frame_features(samples, frame_len)
+    if energy_db.size == 0:
+        return np.zeros(0, dtype=bool), energy_db, frame_len
+    noise_floor = min(float(np.percentile(energy_db, 10)), config.noise_floor_max_db)
+    threshold = max(config.energy_floor_db, noise_floor + config.energy_margin_db)
+    speech = (energy_db > threshold) | (
+        (energy_db > threshold - config.zcr_energy_slack_db) & (zcr > config.zcr_threshold)
+    )
+    # 先補上音節之間的短暫低能量（否則逐字說話的每個音節都短於 min_speech_s 而被當成突波去掉），
+    # 再去除過短的突波，最後向前後延伸 hangover，避免切到字首字尾
+    min_gap = int(round(config.min_silence_s * 1000.0 / config.frame_ms))
+    _fill_short_gaps(speech, min_gap)
+    min_speech = max(1, int(round(config.min_speech_s * 1000.0 / config.frame_ms)))
+    for a, b in _runs(speech):
+        if b - a < min_speech:
+            speech[a:b] = False
+    hang = int(round(config.hangover_s * 1000.0 / config.frame_ms))
+    if hang > 0 and speech.any():
+        kernel = np.ones(2 * hang + 1, dtype=np.int32)
+        speech = np.convolve(speech.astype(np.int32), kernel, mode="same") > 0
+    # 延伸後仍比 min_silence_s 短的停頓不值得切開
+    _fill_short_gaps(speech, min_gap)
+    return speech, energy_db, frame_len
+
+
+def plan_vad_chunks(
+    samples: np.ndarray,
+    sample_rate: int,
+    offset_s: float,
+    target_s: float,
+    config: VadConfig | None = None,
+) -> Tuple[List[Tuple[float, float]], Dict[str, Any]]:
+    """依語音活動規劃分塊：在接近 target_s 的停頓處切開，整段靜音（含超過 max_gap_s 的中間靜音）直接略過。
+
+    samples 為 int16 陣列（可為 mmap 視圖），offset_s 為 samples[0] 的絕對秒數；
+    回傳 (offset, duration) 列表（絕對秒數）與統計資訊。
+    """
+    config = config or VadConfig()
+    target_frames_s = max(1.0, float(target_s))
+    speech, energy_db, frame_len = detect_speech_frames(samples, sample_rate, config)
+    frame_s = frame_len / float(sample_rate)
+    target = max(1, int(target_frames_s / frame_s))
+    max_gap = max(0, int(round(config.max_gap_s / frame_s)))
+
+    spans: List[Tuple[int, int]] = []
+    for a, b in _runs(speech):
+        # 合併相鄰語音區段，直到加入下一段會超過目標長度；中間靜音過長時不合併
+        if spans and b - spans[-1][0] <= target and a - spans[-1][1] <= max_gap:
+            spans[-1] = (spans[-1][0], b)
+            continue
+        spans.append((a, b))
+
+    chunks: List[Tuple[int, int]] = []
+    search = max(1, int(target * 0.4))
+    for a, b in spans:
+        # 單一語音區段超過目標長度時，在目標前 40% 範圍內能量最低的音框處切開
+        while b - a > target:
+            window = energy_db[a + target - search : a + target]
+            cut = a + target - search + int(np.argmin(window))
+            chunks.append((a, cut))
+            a = cut
+        chunks.append((a, b))
+
+    total_samples = len(samples)
+    result: List[Tuple[float, float]] = []
+    for a, b in chunks:
+        start_sample = a * frame_len
+        end_sample = total_samples if b >= speech.size else b * frame_len
+        if end_sample > start_sample:
+            result.append((offset_s + start_sample / sample_rate, (end_sample - start_sample) / sample_rate))
+
+    total_s = total_samples / float(sample_rate)
+    speech_s = sum(d for _, d in result)
+    stats = {
+        "mode": "vad",
+        "chunks": len(result),
+        "total_s": round(total_s, 3),
+        "speech_s": round(speech_s, 3),
+        "skipped_s": round(max(0.0, total_s - speech_s), 3),
+        "skipped_ratio": round(max(0.0, total_s - speech_s) / total_s, 4) if total_s > 0 else 0.0,
+    }
+    return result, stats
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from ..config import settings
+from ..storage import task_is_active
+
+
+class WorkspaceQuotaExceeded(RuntimeError):
+    pass
+
+
+def workspace_root() -> Path:
+    """每個任務工作區的上層目錄（WORKSPACE_DIR，預設為系統暫存目錄下的 stt_workspace）。
+
+    工作區會存放整段解碼後的 PCM，長錄音可達數 GB，因此預設放在本機磁碟而非 /dev/shm
+    （容器內 /dev/shm 預設只有 64 MB）；mmap 讀取本來就會經過 page cache。
+    記憶體足夠時可將 WORKSPACE_DIR 設為 /dev/shm 底下的目錄。
+    """
+    root = Path(settings.workspace_dir or Path(tempfile.gettempdir()) / "stt_workspace")
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+class TaskWorkspace:
+    """單一任務專用的暫存目錄，有容量上限，任務結束時整個目錄一起刪除。
+
+    目前存放解碼後的 PCM store；其餘流程（分塊編碼等）都走 ffmpeg pipe，不落地暫存檔。
+    串流寫入者每寫一個區塊前呼叫 reserve()，超過上限時拋出 WorkspaceQuotaExceeded。
+    """
+
+    def __init__(self, task_id: str, quota_bytes: Optional[int] = None, root: Optional[Path] = None) -> None:
+        self.quota_bytes = int(settings.workspace_quota_bytes if quota_bytes is None else quota_bytes)
+        self.path = (root or workspace_root()) / f"{task_id}-{os.getpid()}"
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def __enter__(self) -> "TaskWorkspace":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.cleanup()
+
+    def usage(self) -> int:
+        total = 0
+        for entry in self.path.iterdir():
+            try:
+                total += entry.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def reserve(self, num_bytes: int) -> None:
+        if self.quota_bytes > 0 and self.usage() + int(num_bytes) > self.quota_bytes:
+            raise WorkspaceQuotaExceeded(
+                f"工作區容量不足（上限 {self.quota_bytes} bytes），請調整 WORKSPACE_QUOTA_BYTES。"
+            )
+
+    def new_path(self, suffix: str = ".bin") -> str:
+        return str(self.path / f"{uuid.uuid4().hex}{suffix}")
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def sweep_stale_workspaces(ttl_seconds: Optional[float] = None) -> int:
+    """刪除超過 TTL（WORKSPACE_TTL_SECONDS）未更新的工作區（worker 當機時遺留），回傳刪除數量。
+
+    目錄的 mtime 只在新增或刪除檔案時更新，長時間執行的任務也可能超過 TTL，
+    因此目錄名稱（{task_id}-{pid}）對應的任務仍在執行中時不刪除。
+    """
+    ttl = settings.workspace_ttl_seconds if ttl_seconds is None else ttl_seconds
+    if ttl <= 0:
+        return 0
+    cutoff = time.time() - ttl
+    removed = 0
+    for entry in workspace_root().iterdir():
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff and not task_is_active(entry.name.rsplit("-", 1)[0]):
+                shutil.rmtree(entry, ignore_errors=True)
+                removed += 1
+        except OSError:
+            pass
+    return removed
@@ -0,0 +1 @@
+"""Standalone benchmarks for the backend audio pipeline (run with `python -m benchmarks.<name>`)."""
@@ -0,0 +1,103 @@
+"""比較「每個分塊各啟動一次 ffmpeg」（舊流程）與「單次解碼到 mmap PCM store + 切片」的耗時。
+
+用法（於 backend 目錄）：
+    python -m benchmarks.bench_decode --minutes 30 --chunk 30
+    python -m benchmarks.bench_decode --input 範例.mp3
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+import uuid
+
+from app.services.chunking import iter_offsets
+from app.utils.audio import pcm_to_wav_bytes
+from app.utils.ffmpeg import ensure_ffmpeg_available
+from app.utils.pcm_store import decode_range_to_store
+from app.utils.workspace import TaskWorkspace
+
+
+def _make_sample(minutes: float, suffix: str) -> str:
+    ensure_ffmpeg_available()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        path = tmp.name
+    cmd = [
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={minutes * 60}",
+        "-ar", "44100", "-ac", "2", path,
+    ]
+    subprocess.run(cmd, check=True)
+    return path
+
+
+def _ffprobe_duration(path: str) -> float:
+    cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", path]
+    return float(subprocess.run(cmd, capture_output=True, check=True).stdout.decode().strip() or 0.0)
+
+
+def _extract_segment_to_wav(path: str, offset: float, duration: float) -> str:
+    # 舊流程：每個分塊重新開啟來源、seek、解碼並寫出暫存 WAV
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
+        out_path = tmp.name
+    cmd = [
+        "ffmpeg", "-v", "error", "-y", "-ss", str(offset), "-i", path, "-t", str(duration),
+        "-acodec", "pcm_s16le", "-ac", "1", "-ar", "16000", out_path,
+    ]
+    subprocess.run(cmd, check=True)
+    return out_path
+
+
+def bench_per_chunk(path: str, chunk_s: float) -> tuple[float, int, int]:
+    t0 = time.perf_counter()
+    total = _ffprobe_duration(path)
+    chunks = 0
+    sent = 0
+    for offset, duration in iter_offsets(0.0, total, chunk_s):
+        chunk_wav = _extract_segment_to_wav(path, offset, duration)
+        with open(chunk_wav, "rb") as f:
+            sent += len(f.read())
+        os.remove(chunk_wav)
+        chunks += 1
+    return time.perf_counter() - t0, chunks, sent
+
+
+def bench_mmap_store(path: str, chunk_s: float) -> tuple[float, int, int]:
+    t0 = time.perf_counter()
+    chunks = 0
+    sent = 0
+    with TaskWorkspace(f"bench-{uuid.uuid4()}") as workspace, decode_range_to_store(path, 0.0, None, workspace=workspace) as store:
+        pcm = store.buffer
+        for offset, duration in iter_offsets(pcm.offset_s, pcm.end_s, chunk_s):
+            sent += len(pcm_to_wav_bytes(pcm.slice(offset, duration)))
+            chunks += 1
+    return time.perf_counter() - t0, chunks, sent
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="分塊解碼效能比較")
+    parser.add_argument("--input", default=None, help="音訊檔；未指定時以 ffmpeg 產生測試音")
+    parser.add_argument("--minutes", type=float, default=10.0, help="產生測試音的長度（分鐘）")
+    parser.add_argument("--format", default=".mp3", help="產生測試音的副檔名，例如 .mp3 / .m4a / .wav")
+    parser.add_argument("--chunk", type=float, default=30.0, help="分塊秒數")
+    args = parser.parse_args()
+
+    path = args.input or _make_sample(args.minutes, args.format)
+    try:
+        modes = (
+            ("per-chunk ffmpeg", bench_per_chunk),
+            ("mmap pcm store", bench_mmap_store),
+        )
+        for name, fn in modes:
+            elapsed, chunks, sent = fn(path, args.chunk)
+            print(f"{name:<20} {elapsed:8.2f} s  chunks={chunks:<5} wav_bytes={sent}")
+    finally:
+        if args.input is None:
+            os.remove(path)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
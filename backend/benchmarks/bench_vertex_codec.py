@@ -0,0 +1,125 @@
+"""比較 Vertex 分塊上傳格式（wav / flac / opus）的傳送位元組數、編碼耗時與端到端延遲。
+
+預設只做離線量測（編碼 + 以 --uplink-mbps 估算上傳時間）；加上 --live 時實際呼叫 Vertex，
+需要可用的 VERTEX_PROJECT 憑證。
+用法（於 backend 目錄）：
+    python -m benchmarks.bench_vertex_codec --input 範例.mp3 --chunks 10
+    python -m benchmarks.bench_vertex_codec --input 範例.mp3 --codecs wav,opus --opus-bitrates 16,32 --live
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+import uuid
+from typing import List, Tuple
+
+from app.services.chunking import iter_offsets
+from app.utils.audio import PcmBuffer, encode_pcm_payload
+from app.utils.pcm_store import decode_range_to_store
+from app.utils.workspace import TaskWorkspace
+
+
+def _variants(codecs: List[str], opus_bitrates: List[int]) -> List[Tuple[str, str, int]]:
+    out = []
+    for codec in codecs:
+        if codec == "opus":
+            out += [(f"opus@{b}k", "opus", b) for b in opus_bitrates]
+        else:
+            out.append((codec, codec, 0))
+    return out
+
+
+def bench_codec(
+    pcm: PcmBuffer,
+    spans: List[Tuple[float, float]],
+    codec: str,
+    bitrate_kbps: int,
+    *,
+    uplink_mbps: float,
+    live: bool,
+) -> dict:
+    sizes: List[int] = []
+    encode: List[float] = []
+    latency: List[float] = []
+    chars = 0
+    if live:
+        from app.services.transcription_vertex import _predict_chunk_with_vertex
+        from app.services.vertex_client import VertexCallStats
+        from app.storage import TaskStore
+
+        task_id = f"bench-{uuid.uuid4()}"
+        TaskStore.initialize_task(task_id, "vertex_ai", None, None)
+        call_stats = VertexCallStats()
+    for offset, duration in spans:
+        chunk = pcm.slice(offset, duration)
+        t0 = time.perf_counter()
+        audio, mime_type = encode_pcm_payload(chunk, codec, bitrate_kbps=bitrate_kbps)
+        encode.append(time.perf_counter() - t0)
+        sizes.append(len(audio))
+        if live:
+            t1 = time.perf_counter()
+            text = _predict_chunk_with_vertex(
+                task_id,
+                audio,
+                language_code="zh-TW",
+                duration_s=duration,
+                call_stats=call_stats,
+                mime_type=mime_type,
+            )
+            # 端到端：編碼 + 上傳 + 推論
+            latency.append(time.perf_counter() - t0)
+            chars += len(text or "")
+    total_bytes = sum(sizes)
+    result = {
+        "chunks": len(spans),
+        "bytes": total_bytes,
+        "kb_per_chunk": total_bytes / len(spans) / 1024,
+        "encode_ms": statistics.mean(encode) * 1000,
+        "upload_ms": (total_bytes / len(spans)) * 8 / (uplink_mbps * 1e6) * 1000,
+    }
+    if live:
+        result.update(
+            latency_p50=statistics.median(latency),
+            latency_max=max(latency),
+            chars=chars,
+        )
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Vertex 上傳音訊格式比較")
+    parser.add_argument("--input", required=True, help="音訊檔")
+    parser.add_argument("--chunk", type=float, default=30.0, help="分塊秒數")
+    parser.add_argument("--chunks", type=int, default=10, help="最多量測的分塊數")
+    parser.add_argument("--codecs", default="wav,flac,opus", help="以逗號分隔")
+    parser.add_argument("--opus-bitrates", default="16,24,32", help="opus 位元率（kbps），以逗號分隔")
+    parser.add_argument("--uplink-mbps", type=float, default=10.0, help="估算上傳時間用的上行頻寬")
+    parser.add_argument("--live", action="store_true", help="實際呼叫 Vertex 量測端到端延遲")
+    args = parser.parse_args()
+
+    codecs = [c.strip().lower() for c in args.codecs.split(",") if c.strip()]
+    bitrates = [int(b) for b in args.opus_bitrates.split(",") if b.strip()]
+    with TaskWorkspace(f"bench-{uuid.uuid4()}") as workspace, decode_range_to_store(
+        args.input, 0.0, args.chunk * args.chunks, workspace=workspace
+    ) as store:
+        pcm = store.buffer
+        spans = list(iter_offsets(pcm.offset_s, pcm.end_s, args.chunk))[: args.chunks]
+        if not spans:
+            raise SystemExit("音訊長度為 0")
+        baseline = None
+        for label, codec, bitrate in _variants(codecs, bitrates):
+            r = bench_codec(pcm, spans, codec, bitrate, uplink_mbps=args.uplink_mbps, live=args.live)
+            baseline = baseline or r["bytes"]
+            line = (
+                f"{label:<10} {r['kb_per_chunk']:9.1f} KB/chunk  ratio={baseline / r['bytes']:5.2f}x  "
+                f"encode={r['encode_ms']:7.1f} ms  upload≈{r['upload_ms']:7.1f} ms"
+            )
+            if args.live:
+                line += f"  e2e p50={r['latency_p50']:6.2f} s  max={r['latency_max']:6.2f} s  chars={r['chars']}"
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,70 @@
+"""比較 Vertex 逐塊請求與打包請求（VERTEX_PACK_CHUNKS）的請求數、token 數與總耗時。
+
+每種打包大小都以完整的 transcribe_with_vertex_ai 流程跑同一段音訊（停用分塊快取），
+需要可用的 VERTEX_PROJECT 憑證。
+用法（於 backend 目錄）：
+    python -m benchmarks.bench_vertex_pack --input 範例.mp3 --end 00:05:00 --packs 1,4,10
+"""
+from __future__ import annotations
+
+import argparse
+import time
+import uuid
+
+from app.config import settings
+from app.services.transcription_vertex import transcribe_with_vertex_ai
+from app.storage import TaskStore
+
+
+def run_once(path: str, end_time: str | None, chunk_s: float, pack: int) -> dict:
+    settings.vertex_pack_chunks = pack
+    task_id = f"bench-pack-{uuid.uuid4()}"
+    TaskStore.initialize_task(task_id, "vertex_ai", None, end_time)
+    t0 = time.perf_counter()
+    transcribe_with_vertex_ai(task_id, path, None, end_time, chunk_length_s=chunk_s)
+    wall = time.perf_counter() - t0
+    task = TaskStore.get_task(task_id) or {}
+    vertex = (task.get("meta") or {}).get("vertex") or {}
+    tokens = task.get("tokens") or {}
+    return {
+        "status": task.get("status"),
+        "wall_s": wall,
+        "requests": int(vertex.get("requests", 0)),
+        "input_tokens": int(tokens.get("input", 0)),
+        "output_tokens": int(tokens.get("output", 0)),
+        "segments": len(task.get("segments") or []),
+        "fallback_chunks": (vertex.get("packing") or {}).get("fallback_chunks", 0),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Vertex 打包請求比較")
+    parser.add_argument("--input", required=True, help="音訊檔")
+    parser.add_argument("--end", default="00:05:00", help="只轉錄到此時間（HH:MM:SS）")
+    parser.add_argument("--chunk", type=float, default=30.0, help="分塊秒數")
+    parser.add_argument("--packs", default="1,4,10", help="要比較的 VERTEX_PACK_CHUNKS，以逗號分隔；第一個為基準")
+    args = parser.parse_args()
+
+    # 每次都要實際呼叫 Vertex，不能讓快取命中
+    settings.chunk_cache_enabled = False
+    baseline = None
+    for pack in [int(p) for p in args.packs.split(",") if p.strip()]:
+        r = run_once(args.input, args.end, args.chunk, pack)
+        baseline = baseline or r
+        print(
+            f"pack={pack:<3} {r['status']:<10} wall={r['wall_s']:7.2f} s  requests={r['requests']:<4} "
+            f"in={r['input_tokens']:<7} out={r['output_tokens']:<6} segments={r['segments']:<4} "
+            f"fallback={r['fallback_chunks']}"
+        )
+        if r is not baseline:
+            print(
+                f"         saved vs pack={args.packs.split(',')[0].strip()}: "
+                f"requests={baseline['requests'] - r['requests']}  "
+                f"input_tokens={baseline['input_tokens'] - r['input_tokens']}  "
+                f"wall={baseline['wall_s'] - r['wall_s']:.2f} s"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,10 @@
+import pytest
+
+from app.config import settings
+
+
+@pytest.fixture
+def spool_tmp(tmp_path, monkeypatch):
+    """把 spool 目錄（含上傳工作階段）指到測試專用的暫存目錄。"""
+    monkeypatch.setattr(settings, "spool_dir", str(tmp_path / "spool"))
+    return tmp_path / "spool"
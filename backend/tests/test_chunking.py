@@ -0,0 +1,43 @@
+import pytest
+
+from app.config import settings
+from app.services.chunking import iter_offsets
+
+
+@pytest.fixture
+def grid_align(monkeypatch):
+    monkeypatch.setattr(settings, "chunk_grid_align", True)
+    monkeypatch.setattr(settings, "chunk_min_lead_in_s", 1.0)
+
+
+def _check_contiguous(spans, start_s, end_s):
+    assert spans[0][0] == pytest.approx(start_s)
+    for (o1, d1), (o2, _) in zip(spans, spans[1:]):
+        assert o1 + d1 == pytest.approx(o2)
+    assert spans[-1][0] + spans[-1][1] == pytest.approx(end_s)
+
+
+def test_default_boundaries_start_at_start_time(monkeypatch):
+    monkeypatch.setattr(settings, "chunk_grid_align", False)
+    assert list(iter_offsets(12.5, 100.0, 30.0)) == [(12.5, 30.0), (42.5, 30.0), (72.5, 27.5)]
+
+
+@pytest.mark.parametrize("start_s", [0.0, 10.0, 29.5, 29.9999, 30.0, 59.2])
+def test_grid_aligned_chunks_never_exceed_chunk_length(grid_align, start_s):
+    spans = list(iter_offsets(start_s, 200.0, 30.0))
+    _check_contiguous(spans, start_s, 200.0)
+    assert all(d <= 30.0 + 1e-9 for _, d in spans)
+    # 首段太短時合併再平分，不會留下短於下限的片段
+    assert all(d >= 1.0 for _, d in spans[:-1])
+    # 前導段之後的邊界都在格線上
+    assert spans[-1][0] == pytest.approx(180.0)
+
+
+def test_short_lead_in_is_split_evenly(grid_align):
+    spans = list(iter_offsets(29.5, 100.0, 30.0))
+    assert spans[:2] == [(29.5, pytest.approx(15.25)), (pytest.approx(44.75), pytest.approx(15.25))]
+    assert spans[2] == (60.0, 30.0)
+
+
+def test_short_lead_in_near_end_stays_single(grid_align):
+    assert list(iter_offsets(29.5, 45.0, 30.0)) == [(29.5, 15.5)]
@@ -0,0 +1,102 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+from app.config import settings
+from app.services.hedging import HedgeCanceled, Hedger, get_latency_tracker
+
+
+@pytest.fixture
+def hedger_factory(monkeypatch):
+    monkeypatch.setattr(settings, "hedge_enabled", True)
+    monkeypatch.setattr(settings, "hedge_min_samples", 1)
+    monkeypatch.setattr(settings, "hedge_min_delay_s", 0.0)
+    created = []
+
+    def make(budget=0.1, failover_budget=0.2, warm_latency_s=None):
+        monkeypatch.setattr(settings, "hedge_budget_ratio", budget)
+        monkeypatch.setattr(settings, "hedge_failover_budget_ratio", failover_budget)
+        # 每個測試用獨立的後端名稱，延遲統計不互相影響
+        hedger = Hedger(f"test-{uuid.uuid4().hex}", workers=2)
+        if warm_latency_s is not None:
+            # 足夠多的樣本，讓測試中途記錄的少數慢請求不會改變 p95 門檻
+            for _ in range(50):
+                get_latency_tracker(hedger.backend).record(warm_latency_s)
+        created.append(hedger)
+        return hedger
+
+    yield make
+    for hedger in created:
+        hedger.close()
+
+
+def _failing(cancel):
+    raise ValueError("primary down")
+
+
+def test_failovers_are_limited_by_their_own_budget(hedger_factory):
+    hedger = hedger_factory(failover_budget=0.2)
+    outcomes = []
+    for _ in range(10):
+        try:
+            outcomes.append(hedger.call(_failing, lambda cancel: "backup"))
+        except ValueError as e:
+            outcomes.append(str(e))
+    stats = hedger.stats()
+    assert outcomes.count(("backup", True)) == 2
+    assert outcomes.count("primary down") == 8
+    assert stats["failovers"] == 2
+    assert stats["failover_denied"] == 8
+    # failover 不占用 hedge 預算
+    assert stats["hedges"] == 0
+
+
+def _slow_primary(cancel: threading.Event):
+    if cancel.wait(0.3):
+        raise HedgeCanceled()
+    return "primary"
+
+
+def test_hedges_are_limited_by_the_budget_ratio(hedger_factory):
+    hedger = hedger_factory(budget=0.5, warm_latency_s=0.01)
+    results = [hedger.call(_slow_primary, lambda cancel: "hedge") for _ in range(4)]
+    stats = hedger.stats()
+    assert stats["primaries"] == 4
+    assert stats["hedges"] == 2
+    assert stats["budget_denied"] == 2
+    assert results.count(("hedge", True)) == 2
+    assert results.count(("primary", False)) == 2
+    assert stats["hedges"] <= hedger.budget_ratio * stats["primaries"]
+
+
+def test_declined_hedge_returns_the_primary_and_keeps_the_budget(hedger_factory):
+    hedger = hedger_factory(budget=1.0, warm_latency_s=0.01)
+    result = hedger.call(_slow_primary, lambda cancel: "hedge", may_hedge=lambda: False)
+    stats = hedger.stats()
+    assert result == ("primary", False)
+    assert stats["hedges"] == 0
+    assert stats["hedges_declined"] == 1
+
+
+def test_fast_primary_is_never_hedged(hedger_factory):
+    hedger = hedger_factory(budget=1.0, warm_latency_s=5.0)
+    calls = []
+
+    def hedge(cancel):
+        calls.append(1)
+        return "hedge"
+
+    assert hedger.call(lambda cancel: "primary", hedge) == ("primary", False)
+    assert calls == []
+    assert hedger.stats()["hedges"] == 0
+
+
+def test_losing_primary_is_canceled(hedger_factory):
+    hedger = hedger_factory(budget=1.0, warm_latency_s=0.01)
+    assert hedger.call(_slow_primary, lambda cancel: "hedge") == ("hedge", True)
+    deadline = time.time() + 2.0
+    while hedger.stats()["canceled_losers"] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert hedger.stats()["canceled_losers"] == 1
@@ -0,0 +1,85 @@
+import random
+import threading
+import time
+
+import pytest
+
+from app.services.pipeline import ChunkPipeline, PipelineCanceled
+
+
+def test_commit_follows_input_order_when_results_arrive_out_of_order():
+    rng = random.Random(7)
+    delays = {i: rng.uniform(0.0, 0.02) for i in range(40)}
+    # 前幾個分塊特別慢，迫使後面的結果先完成
+    delays[0] = delays[1] = 0.08
+    committed = []
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def consume(item, payload):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(delays[item])
+        with lock:
+            in_flight -= 1
+        return payload * 10
+
+    pipeline = ChunkPipeline(lambda i: i + 1, consume, lambda i, r: committed.append((i, r)), depth=4, workers=4)
+    stats = pipeline.run(range(40))
+    assert committed == [(i, (i + 1) * 10) for i in range(40)]
+    assert 1 < peak <= 4
+    assert stats["max_in_flight"] <= 4
+
+
+def test_consumers_do_not_run_more_than_twice_the_workers_ahead_of_commit():
+    started = []
+    release = threading.Event()
+
+    def consume(item, payload):
+        started.append(item)
+        if item == 0:
+            release.wait(timeout=2.0)
+        return item
+
+    def commit(item, result):
+        pass
+
+    pipeline = ChunkPipeline(lambda i: i, consume, commit, depth=8, workers=2)
+    runner = threading.Thread(target=pipeline.run, args=(range(20),))
+    runner.start()
+    time.sleep(0.3)
+    # 分塊 0 卡住時，最多只能領先到 index < 0 + 2 × workers
+    assert max(started) < 4
+    release.set()
+    runner.join(timeout=5.0)
+    assert sorted(started) == list(range(20))
+
+
+def test_consume_error_is_raised_from_run():
+    def consume(item, payload):
+        if item == 3:
+            raise ValueError("boom")
+        return item
+
+    committed = []
+    pipeline = ChunkPipeline(lambda i: i, consume, lambda i, r: committed.append(i), workers=2)
+    with pytest.raises(ValueError, match="boom"):
+        pipeline.run(range(10))
+    assert committed == sorted(committed)
+    assert 3 not in committed
+
+
+def test_cancel_stops_before_the_next_commit():
+    committed = []
+    pipeline = ChunkPipeline(
+        lambda i: i,
+        lambda i, p: p,
+        lambda i, r: committed.append(i),
+        should_cancel=lambda: len(committed) >= 3,
+    )
+    with pytest.raises(PipelineCanceled):
+        pipeline.run(range(10))
+    assert committed == [0, 1, 2]
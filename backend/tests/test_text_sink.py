@@ -0,0 +1,70 @@
+import uuid
+
+import pytest
+
+from app.services.text_sink import OrderedTextSink
+from app.storage import TaskStore
+
+
+@pytest.fixture
+def task_id():
+    task_id = str(uuid.uuid4())
+    TaskStore.initialize_task(task_id, "vertex_ai", None, None)
+    return task_id
+
+
+def _task(task_id):
+    return TaskStore.get_task(task_id)
+
+
+def test_only_the_head_chunk_is_shown_while_streaming(task_id):
+    sink = OrderedTextSink(task_id)
+    sink.feed(1, "第二")
+    sink.feed(0, "第一")
+    assert _task(task_id)["partial_text"] == "第一"
+    sink.commit(0, "第一段")
+    # 下一個分塊已串流的片段在 head 前進時一併補上
+    assert _task(task_id)["partial_text"] == "第一段第二"
+    sink.commit(1, "第二段")
+    task = _task(task_id)
+    assert task["partial_text"] == "第一段第二段"
+    assert task["text_epoch"] == 0
+
+
+def test_commit_out_of_order_is_rejected(task_id):
+    sink = OrderedTextSink(task_id)
+    with pytest.raises(RuntimeError):
+        sink.commit(1, "x")
+
+
+def test_mismatched_final_text_rolls_back_the_streamed_head(task_id):
+    sink = OrderedTextSink(task_id)
+    sink.commit(0, "甲")
+    sink.feed(1, "錯誤的")
+    sink.commit(1, "正確")
+    task = _task(task_id)
+    assert task["partial_text"] == "甲正確"
+    assert task["text_epoch"] == 1
+
+
+def test_reset_before_retry_discards_streamed_pieces(task_id):
+    sink = OrderedTextSink(task_id)
+    sink.feed(0, "第一次嘗試")
+    sink.reset(0)
+    sink.feed(0, "重試")
+    sink.commit(0, "重試結果")
+    assert _task(task_id)["partial_text"] == "重試結果"
+
+
+def test_held_chunk_is_not_shown_and_commits_without_rollback(task_id):
+    sink = OrderedTextSink(task_id)
+    sink.feed(0, "已顯示")
+    assert not sink.hold(0)
+    assert sink.hold(1)
+    sink.feed(1, "主請求")
+    sink.commit(0, "已顯示")
+    assert _task(task_id)["partial_text"] == "已顯示"
+    sink.commit(1, "備援結果")
+    task = _task(task_id)
+    assert task["partial_text"] == "已顯示備援結果"
+    assert task["text_epoch"] == 0
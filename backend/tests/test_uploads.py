@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from app.uploads import (
+    UploadError,
+    create_session,
+    finalize_session,
+    merge_ranges,
+    parse_content_range,
+    session_status,
+    write_range,
+)
+
+
+@pytest.mark.parametrize(
+    "ranges, expected",
+    [
+        ([], []),
+        ([[0, 10]], [[0, 10]]),
+        # 相鄰的半開區間要接起來，不可留下 0 位元組的「缺口」
+        ([[0, 5], [5, 10]], [[0, 10]]),
+        ([[20, 30], [0, 10], [5, 15]], [[0, 15], [20, 30]]),
+        ([[0, 100], [10, 20], [30, 40]], [[0, 100]]),
+        ([[10, 20], [10, 20]], [[10, 20]]),
+        ([[0, 1], [2, 3]], [[0, 1], [2, 3]]),
+    ],
+)
+def test_merge_ranges(ranges, expected):
+    assert merge_ranges(ranges) == expected
+
+
+def test_merge_ranges_does_not_mutate_input():
+    ranges = [[5, 10], [0, 6]]
+    merge_ranges(ranges)
+    assert ranges == [[5, 10], [0, 6]]
+
+
+def test_parse_content_range():
+    assert parse_content_range("bytes 0-99/100", 100) == (0, 100)
+    assert parse_content_range("bytes 10-19/*", 100) == (10, 20)
+
+
+@pytest.mark.parametrize(
+    "header, status",
+    [
+        (None, 400),
+        ("bytes=0-99", 400),
+        ("bytes 0-99/200", 400),
+        ("bytes 50-40/100", 416),
+        ("bytes 0-100/100", 416),
+    ],
+)
+def test_parse_content_range_rejects(header, status):
+    with pytest.raises(UploadError) as excinfo:
+        parse_content_range(header, 100)
+    assert excinfo.value.status_code == status
+
+
+def _put(upload_id, data, start, end):
+    async def body():
+        yield data[start:end]
+
+    return asyncio.run(write_range(upload_id, f"bytes {start}-{end - 1}/{len(data)}", body()))
+
+
+def test_out_of_order_parts_finalize_to_the_original_bytes(spool_tmp):
+    data = bytes(range(256)) * 40
+    upload_id = create_session("a.mp3", len(data))["upload_id"]
+    _put(upload_id, data, 6000, len(data))
+    status = _put(upload_id, data, 0, 3000)
+    assert status["missing"] == [[3000, 6000]]
+    assert not status["complete"]
+    with pytest.raises(UploadError) as excinfo:
+        finalize_session(upload_id, "task-1")
+    assert excinfo.value.status_code == 409
+
+    # 重送重疊的區段不影響結果
+    _put(upload_id, data, 2500, 6000)
+    assert session_status(upload_id)["complete"]
+    spooled = finalize_session(upload_id, "task-1")
+    assert open(spooled.path, "rb").read() == data
+    assert spooled.sha256 == hashlib.sha256(data).hexdigest()
+
+    # 第二次 finalize 與之後的 PUT 都是用戶端錯誤，不是 500
+    with pytest.raises(UploadError) as excinfo:
+        finalize_session(upload_id, "task-2")
+    assert excinfo.value.status_code in (404, 409)
+    with pytest.raises(UploadError) as excinfo:
+        _put(upload_id, data, 0, 10)
+    assert excinfo.value.status_code == 404
@@ -0,0 +1,62 @@
+import numpy as np
+
+from app.utils.vad import plan_vad_chunks
+
+SR = 16000
+
+
+def _speech(seconds: float, level_db: float, seed: int = 0) -> np.ndarray:
+    """以 4 Hz 音節包絡調變的帶雜訊諧波，近似連續說話；level_db 為峰值 dBFS。"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SR)) / SR
+    voice = np.sin(2 * np.pi * 180 * t) + 0.5 * np.sin(2 * np.pi * 360 * t) + 0.2 * rng.standard_normal(t.size)
+    envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 4 * t)
+    signal = voice * envelope
+    signal *= 10 ** (level_db / 20) / np.max(np.abs(signal))
+    return signal
+
+
+def _silence(seconds: float, level_db: float = -65.0, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal(int(seconds * SR)) * 10 ** (level_db / 20)
+
+
+def _int16(*parts: np.ndarray) -> np.ndarray:
+    return (np.concatenate(parts) * 32767).astype("<i2")
+
+
+def _covered(chunks, start_s: float, end_s: float) -> float:
+    return sum(max(0.0, min(o + d, end_s) - max(o, start_s)) for o, d in chunks)
+
+
+def test_continuous_speech_keeps_quiet_passages():
+    # 沒有任何靜音：小聲段落不應因噪音底取自語音本身而被當成靜音略過
+    parts = []
+    for i in range(6):
+        parts.append(_speech(8.0, -12.0, seed=i))
+        parts.append(_speech(4.0, -26.0, seed=10 + i))
+    samples = _int16(*parts)
+    chunks, stats = plan_vad_chunks(samples, SR, 0.0, 30.0)
+    total = len(samples) / SR
+    assert _covered(chunks, 0.0, total) >= 0.98 * total
+    for i in range(6):
+        quiet_start = i * 12.0 + 8.0
+        assert _covered(chunks, quiet_start, quiet_start + 4.0) >= 3.9
+    assert all(d <= 30.0 + 1e-6 for _, d in chunks)
+
+
+def test_long_gap_is_skipped_and_not_merged():
+    samples = _int16(_speech(10.0, -15.0), _silence(20.0), _speech(10.0, -15.0, seed=2))
+    chunks, stats = plan_vad_chunks(samples, SR, 5.0, 30.0)
+    assert len(chunks) == 2
+    assert _covered(chunks, 5.0, 15.0) >= 9.9
+    assert _covered(chunks, 45.0 - 10.0, 45.0) >= 9.9
+    # 中間的長靜音（扣掉前後 hangover）不送出
+    assert _covered(chunks, 15.5, 34.5) == 0.0
+    assert stats["skipped_s"] >= 19.0
+
+
+def test_short_pauses_stay_in_one_chunk():
+    samples = _int16(_speech(6.0, -15.0), _silence(1.0), _speech(6.0, -15.0, seed=3))
+    chunks, _ = plan_vad_chunks(samples, SR, 0.0, 30.0)
+    assert len(chunks) == 1
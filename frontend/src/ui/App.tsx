@@ -33,29 +33,68 @@ Key requirements:
 
   useEffect(() => {
     if (!taskId) return
-    const ws = new WebSocket(`${BACKEND.replace('http', 'ws')}/ws/v1/status/${taskId}`)
-    wsRef.current = ws
-    ws.onmessage = (ev) => {
-      try {
-        const data = JSON.parse(ev.data)
-        if (typeof data.progress === 'number') setProgress(data.progress)
-        if (typeof data.partial_text === 'string') setPartialText(data.partial_text)
-        if (data.tokens && typeof data.tokens.input === 'number' && typeof data.tokens.output === 'number') {
-          setTokens({ input: data.tokens.input, output: data.tokens.output })
-        }
-        if (Array.isArray(data.segments)) {
-          setSegments(data.segments as any)
-        }
-        if (data.status === 'completed') setTaskStatus('completed')
-        if (data.status === 'failed') {
+    // 伺服器只推送游標之後的增量；斷線時帶著最後的游標重新連線即可續傳
+    const cursor = { text: 0, segments: 0, epoch: 0 }
+    let closed = false
+    let retryTimer: number | undefined
+    let retries = 0
+
+    const connect = () => {
+      const query = `text=${cursor.text}&segments=${cursor.segments}&epoch=${cursor.epoch}`
+      const ws = new WebSocket(`${BACKEND.replace('http', 'ws')}/ws/v1/status/${taskId}?${query}`)
+      wsRef.current = ws
+      ws.onmessage = (ev) => {
+        try {
+          const data = JSON.parse(ev.data)
+          retries = 0
+          if (typeof data.progress === 'number') setProgress(data.progress)
+          if (typeof data.text === 'string') {
+            const text = data.text
+            if (data.reset) setPartialText(text)
+            else if (text) setPartialText((prev) => prev + text)
+          }
+          if (data.tokens && typeof data.tokens.input === 'number' && typeof data.tokens.output === 'number') {
+            setTokens({ input: data.tokens.input, output: data.tokens.output })
+          }
+          if (Array.isArray(data.segments)) {
+            const added = data.segments as Array<{ start: number; end: number; text: string }>
+            if (data.reset) setSegments(added)
+            else if (added.length) setSegments((prev) => prev.concat(added))
+          }
+          if (data.cursor) {
+            cursor.text = data.cursor.text
+            cursor.segments = data.cursor.segments
+            cursor.epoch = data.cursor.epoch
+          }
+          if (data.status === 'completed') {
+            closed = true
+            setTaskStatus('completed')
+          }
+          if (data.status === 'failed') {
+            closed = true
+            setTaskStatus('failed')
+            if (typeof data.error === 'string') setErrorMsg(data.error)
+          }
+          if (data.status === 'canceled') closed = true
+        } catch {}
+      }
+      ws.onclose = () => {
+        if (closed) return
+        if (retries >= 5) {
           setTaskStatus('failed')
-          if (typeof data.error === 'string') setErrorMsg(data.error)
+          setErrorMsg('與伺服器的連線中斷')
+          return
         }
-      } catch {}
+        retries += 1
+        retryTimer = window.setTimeout(connect, Math.min(8000, 500 * 2 ** retries))
+      }
     }
-    ws.onerror = () => setTaskStatus('failed')
+
+    connect()
     return () => {
-      ws.close()
+      closed = true
+      window.clearTimeout(retryTimer)
+      wsRef.current?.close()
       wsRef.current = null
     }
   }, [taskId])
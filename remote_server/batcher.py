@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+class Histogram:
+    """固定邊界的直方圖，各格為落在 (前一邊界, 該邊界] 的次數；最後一格為 +Inf。"""
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.total += 1
+            self.sum += value
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            labels = [str(b) for b in self.bounds] + ["+Inf"]
+            return {
+                "buckets": dict(zip(labels, self.counts)),
+                "count": self.total,
+                "mean": round(self.sum / self.total, 3) if self.total else 0.0,
+            }
+
+
+class QueueFullError(RuntimeError):
+    """佇列已滿；retry_after 為建議的重試秒數。"""
+
+    def __init__(self, queued: int, retry_after: int) -> None:
+        super().__init__(f"推論佇列已滿（{queued} 筆等待中）")
+        self.queued = queued
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Pending:
+    item: Any
+    future: "asyncio.Future[Any]"
+    enqueued: float = field(default_factory=time.perf_counter)
+
+
+class MicroBatcher:
+    """把同時抵達的請求合併成一次批次推論。
+
+    第一筆請求到達後最多再等 max_wait_ms 收集其他請求，湊滿 batch_size 即立刻送出；
+    run_batch 在專用的推論執行緒中執行（不阻塞事件迴圈），回傳與輸入等長、順序一致的結果列表。
+    等待中的請求超過 max_queue（0 表示不限制）時 submit 直接拋出 QueueFullError，
+    讓呼叫端快速回應 429 而不是排隊到逾時。run_exclusive 的工作同樣占用推論執行緒，
+    等待或執行中的每一筆都計入 queued，admission 與 retry_after 才反映真正的積壓。
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], List[Any]],
+        *,
+        batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        max_queue: int = 0,
+    ) -> None:
+        self.run_batch = run_batch
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait_s = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_queue = max(0, int(max_queue))
+        self.rejected = 0
+        self._running = 0
+        self._exclusive = 0
+        self._avg_batch_s: Optional[float] = None
+        self._avg_exclusive_s: Optional[float] = None
+        # 所有推論（批次與 run_exclusive）都在這一條執行緒上依序執行
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.batch_sizes = Histogram(range(1, self.batch_size + 1))
+        self.queue_wait_ms = Histogram([1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 5000])
+        self._queue: Optional["asyncio.Queue[_Pending]"] = None
+        self._worker: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=False)
+
+    @property
+    def queued(self) -> int:
+        """等待中的批次請求加上尚未完成的 run_exclusive 工作。"""
+        return (self._queue.qsize() if self._queue is not None else 0) + self._exclusive
+
+    def retry_after(self) -> int:
+        """以近期平均批次與獨占工作耗時估計清空目前佇列所需秒數。"""
+        pending = self.queued - self._exclusive
+        batches = math.ceil((pending + self._running) / self.batch_size)
+        seconds = batches * (self._avg_batch_s or 1.0)
+        seconds += self._exclusive * (self._avg_exclusive_s or self._avg_batch_s or 1.0)
+        return max(1, math.ceil(seconds or (self._avg_batch_s or 1.0)))
+
+    def check_admission(self) -> None:
+        if self.max_queue and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(self.queued, self.retry_after())
+
+    async def run_exclusive(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """在推論執行緒上執行不經批次的工作（例如整檔串流的一組推論）。"""
+        def timed() -> Any:
+            # 只計執行時間；排隊時間已由 queued 中排在前面的工作反映
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                elapsed = time.perf_counter() - started
+                self._avg_exclusive_s = (
+                    elapsed if self._avg_exclusive_s is None else 0.8 * self._avg_exclusive_s + 0.2 * elapsed
+                )
+
+        self._exclusive += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self._exclusive -= 1
+
+    async def submit(self, item: Any) -> Any:
+        self.start()
+        assert self._queue is not None
+        self.check_admission()
+        pending = _Pending(item=item, future=asyncio.get_running_loop().create_future())
+        await self._queue.put(pending)
+        return await pending.future
+
+    async def _collect(self) -> List[_Pending]:
+        assert self._queue is not None
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_s
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # 等待時間已到，仍順手帶走已在佇列中的請求
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            for p in batch:
+                self.queue_wait_ms.observe((started - p.enqueued) * 1000.0)
+            self.batch_sizes.observe(len(batch))
+            self._running = len(batch)
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(self._executor, self.run_batch, [p.item for p in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"批次結果數量不符：{len(results)} != {len(batch)}")
+            except Exception as e:
+                for p in batch:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+                continue
+            finally:
+                self._running = 0
+                elapsed = time.perf_counter() - started
+                self._avg_batch_s = elapsed if self._avg_batch_s is None else 0.8 * self._avg_batch_s + 0.2 * elapsed
+            for p, result in zip(batch, results):
+                if not p.future.done():
+                    p.future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batch_size": self.batch_size,
+            "max_wait_ms": round(self.max_wait_s * 1000.0, 3),
+            "queued": self.queued,
+            "running": self._running,
+            "exclusive": self._exclusive,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "avg_batch_s": round(self._avg_batch_s, 3) if self._avg_batch_s is not None else None,
+            "avg_exclusive_s": round(self._avg_exclusive_s, 3) if self._avg_exclusive_s is not None else None,
+            "batch_sizes": self.batch_sizes.to_dict(),
+            "queue_wait_ms": self.queue_wait_ms.to_dict(),
+        }
@@ -0,0 +1,172 @@
+"""比較各推論引擎（fp32 / int8 / onnx）在固定音檔集上的即時率（RTF）與記憶體用量。
+
+每個引擎在獨立子行程中載入與執行，記憶體峰值與執行緒設定互不影響。
+用法（於 remote_server 目錄）：
+    python bench_engines.py --engines fp32,int8,onnx --audio ../範例.mp3 --max-seconds 120
+    python bench_engines.py --audio 測試音檔資料夾 --repeat 3 --json result.json
+    python bench_engines.py --engines fp32,int8 --assistant distil-whisper/distil-large-v3
+
+RTF = 推論耗時 / 音訊長度，小於 1 代表比即時快。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+_AUDIO_SUFFIXES = {".wav", ".mp3", ".m4a", ".flac", ".ogg", ".aac", ".webm"}
+
+
+def _audio_files(paths: List[str]) -> List[Path]:
+    files: List[Path] = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            files += sorted(f for f in p.iterdir() if f.suffix.lower() in _AUDIO_SUFFIXES)
+        else:
+            files.append(p)
+    if not files:
+        raise SystemExit("找不到任何音檔")
+    return files
+
+
+def _decode(path: Path, max_seconds: float) -> np.ndarray:
+    """以 ffmpeg 解碼成 16 kHz 單聲道 float32，固定截取前 max_seconds 秒讓結果可重現。"""
+    cmd = ["ffmpeg", "-v", "error", "-nostdin", "-i", str(path)]
+    if max_seconds > 0:
+        cmd += ["-t", str(max_seconds)]
+    cmd += ["-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "f32le", "pipe:1"]
+    out = subprocess.run(cmd, check=True, capture_output=True).stdout
+    return np.frombuffer(out, dtype="<f4").copy()
+
+
+def _rss_mb() -> Dict[str, float]:
+    """回傳目前行程的記憶體峰值（MB）；Windows 需要 psutil。"""
+    if sys.platform == "win32":
+        import psutil
+
+        info = psutil.Process().memory_info()
+        return {"peak_rss_mb": max(info.peak_wset, info.rss) / 2**20}
+    import resource
+
+    # Linux 的 ru_maxrss 單位為 KiB，macOS 為 bytes
+    scale = 1.0 if sys.platform == "darwin" else 1024.0
+    return {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20}
+
+
+def run_worker(args: argparse.Namespace) -> Dict[str, Any]:
+    from engines import load_pipeline
+
+    audios = [(f.name, _decode(f, args.max_seconds)) for f in _audio_files(args.audio)]
+    audio_s = sum(len(a) for _, a in audios) / SAMPLE_RATE
+    mem_before = _rss_mb()
+    loaded = load_pipeline(
+        args.model,
+        args.worker,
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads,
+        assistant_model_id=args.worker_assistant,
+    )
+    mem_loaded = _rss_mb()
+
+    def transcribe_all() -> List[str]:
+        texts = []
+        for _, audio in audios:
+            out = loaded.pipe(
+                {"raw": audio, "sampling_rate": SAMPLE_RATE},
+                chunk_length_s=30,
+                batch_size=loaded.batch_size(args.batch_size),
+                generate_kwargs=loaded.generate_kwargs,
+                return_timestamps=True,
+            )
+            texts.append(out.get("text", ""))
+        return texts
+
+    for _ in range(args.warmup):
+        transcribe_all()
+    timings = []
+    texts: List[str] = []
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        texts = transcribe_all()
+        timings.append(time.perf_counter() - t0)
+    mem_end = _rss_mb()
+
+    median = statistics.median(timings)
+    return {
+        "engine": loaded.engine,
+        "assistant_model": loaded.assistant_model_id,
+        "device": loaded.device,
+        "options": loaded.options,
+        "files": len(audios),
+        "audio_s": round(audio_s, 2),
+        "load_s": round(loaded.load_s, 2),
+        "median_s": round(median, 3),
+        "rtf": round(median / audio_s, 4) if audio_s else None,
+        "rtf_runs": [round(t / audio_s, 4) for t in timings] if audio_s else [],
+        "model_mb": round(mem_loaded["peak_rss_mb"] - mem_before["peak_rss_mb"], 1),
+        "peak_rss_mb": round(mem_end["peak_rss_mb"], 1),
+        "chars": sum(len(t) for t in texts),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Whisper 推論引擎 RTF / 記憶體比較")
+    parser.add_argument("--model", default=os.getenv("MODEL_NAME", "BELLE-2/Belle-whisper-large-v3-zh-punct"))
+    parser.add_argument("--engines", default="fp32,int8,onnx", help="以逗號分隔")
+    parser.add_argument("--audio", nargs="+", default=[str(Path(__file__).resolve().parents[1] / "範例.mp3")])
+    parser.add_argument("--max-seconds", type=float, default=120.0, help="每個音檔只取前 N 秒；0 表示整檔")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("BATCH_SIZE", "8")))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--intra-op-threads", type=int, default=None)
+    parser.add_argument("--inter-op-threads", type=int, default=None)
+    parser.add_argument("--assistant", default=None, help="額外以此草稿模型做 assisted decoding，與未使用時比較")
+    parser.add_argument("--json", default=None, help="另存結果為 JSON")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-assistant", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args), ensure_ascii=False))
+        return 0
+
+    results = []
+    passthrough = sys.argv[1:]
+    runs = []
+    for engine in [e.strip() for e in args.engines.split(",") if e.strip()]:
+        runs.append((engine, None))
+        if args.assistant and engine != "onnx":
+            runs.append((engine, args.assistant))
+    for engine, assistant in runs:
+        label = f"{engine}+assist" if assistant else engine
+        cmd = [sys.executable, __file__, *passthrough, "--worker", engine]
+        if assistant:
+            cmd += ["--worker-assistant", assistant]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"{label:<12} 失敗：{proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(
+            f"{label:<12} rtf={result['rtf']:<8} median={result['median_s']:>8.2f} s  load={result['load_s']:>7.2f} s  "
+            f"model={result['model_mb']:>8.1f} MB  peak={result['peak_rss_mb']:>8.1f} MB  "
+            f"audio={result['audio_s']} s  chars={result['chars']}"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import torch
+from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+
+
+# fp32：原本的 PyTorch 推論（有 GPU 時為 fp16）
+# int8：CPU 上把 Linear 層做 torch 動態 int8 量化
+# onnx：以 optimum 匯出成 ONNX，交給 ONNX Runtime（CPU）執行
+ENGINES = ("fp32", "int8", "onnx")
+
+
+@dataclass
+class LoadedPipeline:
+    model_id: str
+    engine: str
+    device: str
+    pipe: Any
+    load_s: float
+    options: Dict[str, Any] = field(default_factory=dict)
+    # 呼叫 pipe 時一併傳入（例如 assistant_model）
+    generate_kwargs: Dict[str, Any] = field(default_factory=dict)
+    assistant_model_id: Optional[str] = None
+    # assisted generation 只支援 batch size 1
+    max_batch_size: Optional[int] = None
+    # 權重大小估計（含草稿模型），供模型註冊表計算記憶體預算
+    memory_bytes: int = 0
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_id,
+            "engine": self.engine,
+            "device": self.device,
+            "load_s": round(self.load_s, 2),
+            "memory_mb": round(self.memory_bytes / 2**20, 1),
+            "assistant_model": self.assistant_model_id,
+            **self.options,
+        }
+
+    def batch_size(self, requested: int) -> int:
+        if self.max_batch_size is None:
+            return max(1, requested)
+        return max(1, min(requested, self.max_batch_size))
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def _tensor_bytes(obj: Any) -> int:
+    if torch.is_tensor(obj):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, (tuple, list)):
+        # 動態量化後的 Linear 以 (int8 權重, bias) 的 packed params 存放
+        return sum(_tensor_bytes(o) for o in obj)
+    return 0
+
+
+def _model_bytes(model: Any) -> int:
+    try:
+        return sum(_tensor_bytes(v) for v in model.state_dict().values())
+    except Exception:
+        return 0
+
+
+def _onnx_export_dir(model_id: str) -> Path:
+    root = Path(os.getenv("ONNX_EXPORT_DIR", str(Path(__file__).resolve().parent / "onnx_models")))
+    return root / model_id.replace("/", "__")
+
+
+def _load_onnx_model(model_id: str, intra_op_threads: Optional[int], inter_op_threads: Optional[int]):
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+
+    session_options = ort.SessionOptions()
+    if intra_op_threads:
+        session_options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads:
+        session_options.inter_op_num_threads = inter_op_threads
+        session_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+    # 匯出一次後保存在 ONNX_EXPORT_DIR，之後啟動直接載入
+    export_dir = _onnx_export_dir(model_id)
+    if (export_dir / "config.json").exists():
+        return ORTModelForSpeechSeq2Seq.from_pretrained(
+            export_dir, session_options=session_options, provider="CPUExecutionProvider"
+        )
+    model = ORTModelForSpeechSeq2Seq.from_pretrained(
+        model_id, export=True, session_options=session_options, provider="CPUExecutionProvider"
+    )
+    model.save_pretrained(export_dir)
+    return model
+
+
+def _load_torch_model(model_id: str, engine: str, device: str, torch_dtype: Any):
+    model = AutoModelForSpeechSeq2Seq.from_pretrained(
+        model_id, torch_dtype=torch_dtype, low_cpu_mem_usage=True, use_safetensors=True
+        #,local_files_only=True
+    )
+    model.to(device)
+    if engine == "int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.eval()
+    return model
+
+
+def load_pipeline(
+    model_id: str,
+    engine: str = "fp32",
+    *,
+    intra_op_threads: Optional[int] = None,
+    inter_op_threads: Optional[int] = None,
+    assistant_model_id: Optional[str] = None,
+) -> LoadedPipeline:
+    """依 engine 載入模型並包成 HF ASR pipeline；/transcribe/ 的呼叫方式與輸出格式不變。
+
+    指定 assistant_model_id 時以小型草稿模型做 assisted（speculative）decoding：草稿模型先提出
+    token、主模型一次驗證，輸出與單獨使用主模型相同。草稿模型須與主模型共用 tokenizer
+    （例如 large-v3 搭配以 large-v3 蒸餾的 distil 模型），且僅支援 torch 引擎。
+    """
+    engine = (engine or "fp32").lower()
+    if engine not in ENGINES:
+        raise ValueError(f"未知的推論引擎：{engine}（可用：{', '.join(ENGINES)}）")
+    if assistant_model_id and engine == "onnx":
+        raise ValueError("assistant model 僅支援 fp32 / int8 引擎")
+    intra_op_threads = intra_op_threads or _env_int("INTRA_OP_THREADS")
+    inter_op_threads = inter_op_threads or _env_int("INTER_OP_THREADS")
+
+    started = time.perf_counter()
+    use_cuda = torch.cuda.is_available() and engine == "fp32"
+    device = "cuda:0" if use_cuda else "cpu"
+    torch_dtype = torch.float16 if use_cuda else torch.float32
+    options: Dict[str, Any] = {}
+
+    if engine == "onnx":
+        model = _load_onnx_model(model_id, intra_op_threads, inter_op_threads)
+        options.update(intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+        memory_bytes = sum(f.stat().st_size for f in _onnx_export_dir(model_id).glob("*.onnx*"))
+    else:
+        if device == "cpu":
+            if intra_op_threads:
+                torch.set_num_threads(intra_op_threads)
+            if inter_op_threads:
+                try:
+                    torch.set_interop_threads(inter_op_threads)
+                except RuntimeError:
+                    # 只能在第一次平行運算前設定；同一行程內重複載入時沿用既有設定
+                    pass
+            options.update(intra_op_threads=torch.get_num_threads(), inter_op_threads=torch.get_num_interop_threads())
+        model = _load_torch_model(model_id, engine, device, torch_dtype)
+        memory_bytes = _model_bytes(model)
+
+    generate_kwargs: Dict[str, Any] = {}
+    if assistant_model_id:
+        assistant = _load_torch_model(assistant_model_id, engine, device, torch_dtype)
+        generate_kwargs["assistant_model"] = assistant
+        memory_bytes += _model_bytes(assistant)
+
+    processor = AutoProcessor.from_pretrained(model_id)
+    pipe_kwargs: Dict[str, Any] = {}
+    if engine != "onnx":
+        pipe_kwargs.update(torch_dtype=torch_dtype, device=device)
+    pipe = pipeline(
+        "automatic-speech-recognition",
+        model=model,
+        tokenizer=processor.tokenizer,
+        feature_extractor=processor.feature_extractor,
+        **pipe_kwargs,
+    )
+    pipe.model.config.forced_decoder_ids = (
+        pipe.tokenizer.get_decoder_prompt_ids(
+            language="chinese",
+            task="transcribe"
+        )
+    )
+    return LoadedPipeline(
+        model_id=model_id,
+        engine=engine,
+        device=device,
+        pipe=pipe,
+        load_s=time.perf_counter() - started,
+        options=options,
+        generate_kwargs=generate_kwargs,
+        assistant_model_id=assistant_model_id or None,
+        max_batch_size=1 if assistant_model_id else None,
+        memory_bytes=memory_bytes,
+    )
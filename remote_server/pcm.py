@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import numpy as np
+
+
+# X-Sample-Format 可接受的值 → (NumPy dtype, 換算到 [-1, 1] 的比例)
+PCM_FORMATS = {
+    "s16le": ("<i2", 1.0 / 32768.0),
+    "f32le": ("<f4", 1.0),
+}
+DEFAULT_SAMPLE_RATE = 16000
+
+
+class PcmFormatError(ValueError):
+    pass
+
+
+def _check_format(sample_format: str, sample_rate: int) -> tuple[str, str, float]:
+    fmt = (sample_format or "s16le").lower()
+    if fmt not in PCM_FORMATS:
+        raise PcmFormatError(f"不支援的 X-Sample-Format：{sample_format}（可用：{', '.join(PCM_FORMATS)}）")
+    if sample_rate <= 0:
+        raise PcmFormatError(f"X-Sample-Rate 不正確：{sample_rate}")
+    dtype, scale = PCM_FORMATS[fmt]
+    return fmt, dtype, scale
+
+
+def _to_float32(body: bytes, fmt: str, dtype: str, scale: float) -> np.ndarray:
+    samples = np.frombuffer(body, dtype=dtype)
+    if fmt == "f32le":
+        return samples.astype(np.float32, copy=True)
+    return samples.astype(np.float32) * np.float32(scale)
+
+
+def decode_pcm_body(body: bytes, sample_format: str = "s16le", sample_rate: int = DEFAULT_SAMPLE_RATE) -> dict:
+    """把原始單聲道 PCM 位元組轉成 HF pipeline 可直接使用的 {"raw", "sampling_rate"}。"""
+    fmt, dtype, scale = _check_format(sample_format, sample_rate)
+    itemsize = np.dtype(dtype).itemsize
+    if not body or len(body) % itemsize != 0:
+        raise PcmFormatError(f"PCM 長度 {len(body)} 不是 {itemsize} 位元組的整數倍")
+    return {"raw": _to_float32(body, fmt, dtype, scale), "sampling_rate": int(sample_rate)}
+
+
+class PcmStreamDecoder:
+    """逐段把串流收到的 PCM 位元組轉成 float32 樣本；跨段被切開的樣本位元組會留到下一段。"""
+
+    def __init__(self, sample_format: str = "s16le", sample_rate: int = DEFAULT_SAMPLE_RATE) -> None:
+        self._fmt, self._dtype, self._scale = _check_format(sample_format, sample_rate)
+        self.sample_rate = int(sample_rate)
+        self._itemsize = np.dtype(self._dtype).itemsize
+        self._pending = b""
+        self.num_bytes = 0
+
+    def feed(self, data: bytes) -> np.ndarray:
+        self.num_bytes += len(data)
+        data = self._pending + data if self._pending else data
+        usable = len(data) - len(data) % self._itemsize
+        self._pending = data[usable:]
+        return _to_float32(data[:usable], self._fmt, self._dtype, self._scale)
+
+    def finish(self) -> None:
+        if self._pending or self.num_bytes == 0:
+            raise PcmFormatError(f"PCM 長度 {self.num_bytes} 不是 {self._itemsize} 位元組的整數倍")
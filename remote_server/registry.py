@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from engines import LoadedPipeline, load_pipeline
+
+
+@dataclass
+class ModelSpec:
+    name: str
+    model_id: str
+    engine: str = "fp32"
+    assistant_model_id: Optional[str] = None
+
+
+@dataclass
+class _ModelStats:
+    hits: int = 0
+    loads: int = 0
+    evictions: int = 0
+    last_load_s: float = 0.0
+    total_load_s: float = 0.0
+    last_used: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        requests = self.hits + self.loads
+        return {
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / requests, 4) if requests else 0.0,
+            "last_load_s": round(self.last_load_s, 2),
+            "total_load_s": round(self.total_load_s, 2),
+        }
+
+
+class UnknownModelError(KeyError):
+    pass
+
+
+class ModelRegistry:
+    """以名稱或 model id 取得模型；首次使用時才載入，超過記憶體預算時淘汰最久未用的模型。
+
+    memory_budget_bytes 為 0 表示不限制；正在載入的模型本身永遠不會被淘汰，
+    因此單一模型超過預算時仍可載入，只是其餘模型都會先被釋放。
+    """
+
+    def __init__(
+        self,
+        specs: Dict[str, ModelSpec],
+        default: str,
+        *,
+        memory_budget_bytes: int = 0,
+        loader: Callable[..., LoadedPipeline] = load_pipeline,
+    ) -> None:
+        if default not in specs:
+            raise ValueError(f"預設模型 {default} 未註冊")
+        self.specs = specs
+        self.default = default
+        self.memory_budget_bytes = max(0, int(memory_budget_bytes))
+        self._loader = loader
+        self._resident: "OrderedDict[str, LoadedPipeline]" = OrderedDict()
+        self._stats: Dict[str, _ModelStats] = {name: _ModelStats() for name in specs}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {name: threading.Lock() for name in specs}
+
+    def resolve(self, name: Optional[str]) -> str:
+        """接受註冊名稱或 model id；None 代表預設模型。"""
+        if not name:
+            return self.default
+        if name in self.specs:
+            return name
+        for spec in self.specs.values():
+            if spec.model_id == name:
+                return spec.name
+        raise UnknownModelError(name)
+
+    def peek(self, name: Optional[str] = None) -> Optional[LoadedPipeline]:
+        """回傳已常駐的模型，不觸發載入也不更新 LRU 順序。"""
+        with self._lock:
+            return self._resident.get(self.resolve(name))
+
+    def get(self, name: Optional[str] = None) -> LoadedPipeline:
+        key = self.resolve(name)
+        with self._lock:
+            loaded = self._resident.get(key)
+            if loaded is not None:
+                self._resident.move_to_end(key)
+                self._stats[key].hits += 1
+                self._stats[key].last_used = time.time()
+                return loaded
+        # 同一模型只載入一次；不同模型可同時載入
+        with self._load_locks[key]:
+            with self._lock:
+                loaded = self._resident.get(key)
+                if loaded is not None:
+                    self._resident.move_to_end(key)
+                    self._stats[key].hits += 1
+                    self._stats[key].last_used = time.time()
+                    return loaded
+            spec = self.specs[key]
+            loaded = self._loader(spec.model_id, spec.engine, assistant_model_id=spec.assistant_model_id)
+            with self._lock:
+                stats = self._stats[key]
+                stats.loads += 1
+                stats.last_load_s = loaded.load_s
+                stats.total_load_s += loaded.load_s
+                stats.last_used = time.time()
+                self._resident[key] = loaded
+                self._evict_locked(keep=key)
+        return loaded
+
+    def _resident_bytes_locked(self) -> int:
+        return sum(m.memory_bytes for m in self._resident.values())
+
+    def _evict_locked(self, keep: str) -> None:
+        if not self.memory_budget_bytes:
+            return
+        evicted = False
+        while self._resident_bytes_locked() > self.memory_budget_bytes:
+            victim = next((k for k in self._resident if k != keep), None)
+            if victim is None:
+                break
+            self._resident.pop(victim)
+            self._stats[victim].evictions += 1
+            evicted = True
+        if evicted:
+            # 仍在推論中的請求持有參考，待其結束後才會真正釋放
+            gc.collect()
+            try:
+                import torch
+
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except ImportError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {}
+            for name, spec in self.specs.items():
+                loaded = self._resident.get(name)
+                models[name] = {
+                    "model": spec.model_id,
+                    "engine": spec.engine,
+                    "resident": loaded is not None,
+                    "memory_mb": round(loaded.memory_bytes / 2**20, 1) if loaded is not None else 0.0,
+                    **self._stats[name].to_dict(),
+                }
+            return {
+                "default": self.default,
+                "memory_budget_mb": round(self.memory_budget_bytes / 2**20, 1),
+                "resident_mb": round(self._resident_bytes_locked() / 2**20, 1),
+                "lru_order": list(self._resident),
+                "models": models,
+            }
+
+
+def registry_from_env() -> ModelRegistry:
+    """MODEL_NAME 為預設模型（名稱 default），MODEL_NAME1、MODEL_NAME2… 依序註冊為 model1、model2…。
+
+    各模型可用 INFERENCE_ENGINE{n} / ASSISTANT_MODEL_NAME{n} 覆寫引擎與草稿模型，
+    MODEL_MEMORY_BUDGET_MB 為常駐模型的總記憶體預算（0 表示不限制）。
+    """
+    default_engine = os.getenv("INFERENCE_ENGINE", "fp32")
+    specs: Dict[str, ModelSpec] = {
+        "default": ModelSpec(
+            name="default",
+            model_id=os.getenv("MODEL_NAME", "BELLE-2/Belle-whisper-large-v3-zh-punct"),
+            engine=default_engine,
+            assistant_model_id=os.getenv("ASSISTANT_MODEL_NAME", "").strip() or None,
+        )
+    }
+    index = 1
+    while os.getenv(f"MODEL_NAME{index}"):
+        name = f"model{index}"
+        specs[name] = ModelSpec(
+            name=name,
+            model_id=os.environ[f"MODEL_NAME{index}"],
+            engine=os.getenv(f"INFERENCE_ENGINE{index}", default_engine),
+            assistant_model_id=os.getenv(f"ASSISTANT_MODEL_NAME{index}", "").strip() or None,
+        )
+        index += 1
+    budget_mb = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+    return ModelRegistry(specs, "default", memory_budget_bytes=int(budget_mb * 2**20))
@@ -1,23 +1,26 @@
 from __future__ import annotations
 
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pathlib import Path
 from dotenv import load_dotenv
 from pydantic import BaseModel
-import torch
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+import json
 import tempfile
+import numpy as np
+import threading
 import os
 from opencc import OpenCC
 
+from batcher import MicroBatcher, QueueFullError
+from registry import UnknownModelError, registry_from_env
+from pcm import DEFAULT_SAMPLE_RATE, PCM_FORMATS, PcmFormatError, PcmStreamDecoder, decode_pcm_body
+
 # 初始化轉換器，'s2twp' 表示從簡體（s）轉換到台灣繁體（tw），並包含詞彙轉換（p）
 # s2t: 簡轉繁
 # s2tw: 簡轉臺
 cc = OpenCC('s2twp')  
 
-torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
-
 # Load .env from project root or current folder
 root_env = Path(__file__).resolve().parents[1] / ".env"
 local_env = Path(__file__).resolve().parent / ".env"
@@ -32,29 +35,64 @@ if FFMPEG_PATH:
 app = FastAPI(title="Remote Whisper Inference Server", version="0.1.0")
 
 
-device = "cuda:0" if torch.cuda.is_available() else "cpu"
+# MODEL_NAME 為預設模型，MODEL_NAME1、MODEL_NAME2… 可由請求的 model 參數指定（首次使用時才載入）
+# INFERENCE_ENGINE：fp32 | int8 | onnx，CPU 機器可用 bench_engines.py 比較後選擇
+# ASSISTANT_MODEL_NAME：選用的 assisted decoding 草稿模型（需與主模型共用 tokenizer）
+# MODEL_MEMORY_BUDGET_MB：常駐模型的記憶體預算，超過時淘汰最久未用的模型
+registry = registry_from_env()
+model_id = registry.specs[registry.default].model_id
+# 預設模型於啟動時載入，第一個請求不必等待
+registry.get()
+
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "8"))
+# 第一筆請求到達後，最多再等多久收集同批次的其他請求
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+# 等待推論的請求上限，超過時回 429 + Retry-After（0 表示不限制）
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", str(BATCH_SIZE * 4)))
+# /transcribe/stream 的預設切窗參數（交給 pipeline 的 chunk_length_s / stride_length_s）
+STREAM_CHUNK_LENGTH_S = float(os.getenv("STREAM_CHUNK_LENGTH_S", "30"))
+STREAM_STRIDE_LENGTH_S = float(os.getenv("STREAM_STRIDE_LENGTH_S", "5"))
 
-model_id = os.getenv("MODEL_NAME", "BELLE-2/Belle-whisper-large-v3-zh-punct")
 
-model = AutoModelForSpeechSeq2Seq.from_pretrained(
-    model_id, torch_dtype=torch_dtype, low_cpu_mem_usage=True, use_safetensors=True
-    #,local_files_only=True
-)
-model.to(device)
+# 批次請求與整檔串流共用模型與運算資源，一次只讓一個推論呼叫佔用
+_inference_lock = threading.Lock()
 
-processor = AutoProcessor.from_pretrained(model_id)
 
-BATCH_SIZE = int(os.getenv("BATCH_SIZE", "8"))
+def _run_pipe_batch(items: list) -> list:
+    """items 為 (模型名稱, 輸入)；同一批次內依模型分組推論，再依原順序回傳。"""
+    results: list = [None] * len(items)
+    groups: dict[str, list[int]] = {}
+    for index, (name, _) in enumerate(items):
+        groups.setdefault(name, []).append(index)
+    with _inference_lock:
+        for name, indexes in groups.items():
+            loaded = registry.get(name)
+            # 單筆也走 list 輸入，pipeline 一律回傳與輸入等長的結果列表
+            outputs = loaded.pipe(
+                [items[i][1] for i in indexes],
+                batch_size=loaded.batch_size(len(indexes)),
+                generate_kwargs=loaded.generate_kwargs,
+                return_timestamps=True,
+            )
+            for i, output in zip(indexes, outputs):
+                results[i] = output
+    return results
 
 
-pipe = pipeline(
-    "automatic-speech-recognition",
-    model=model,
-    tokenizer=processor.tokenizer,
-    feature_extractor=processor.feature_extractor,
-    torch_dtype=torch_dtype,
-    device=device,
-)
+def _run_pipe_long(name: str, audio: dict, chunk_length_s: float, stride_length_s: float, batch_size: int) -> dict:
+    with _inference_lock:
+        loaded = registry.get(name)
+        return loaded.pipe(
+            audio,
+            chunk_length_s=chunk_length_s,
+            stride_length_s=stride_length_s,
+            batch_size=loaded.batch_size(batch_size),
+            generate_kwargs=loaded.generate_kwargs,
+            return_timestamps=True,
+        )
+
+
+batcher = MicroBatcher(_run_pipe_batch, batch_size=BATCH_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, max_queue=MAX_QUEUE)
 
 
 class Chunk(BaseModel):
@@ -65,45 +103,263 @@ class TranscriptionResponse(BaseModel):
     chunks: list[Chunk]
 
 
+def _queue_full(e: QueueFullError) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail={"message": str(e), "queued": e.queued, "retry_after": e.retry_after},
+        headers={"Retry-After": str(e.retry_after), "X-Queue-Depth": str(e.queued)},
+    )
+
+
+def _resolve_model(model: str | None) -> str:
+    try:
+        return registry.resolve(model)
+    except UnknownModelError:
+        raise HTTPException(status_code=400, detail=f"未註冊的模型：{model}（可用：{', '.join(registry.specs)}）")
+
+
+@app.middleware("http")
+async def _admit_multipart_uploads(request: Request, call_next):
+    # /transcribe/ 的 UploadFile 參數會在進入 handler（與其 dependency）之前就讀完整個 multipart 本體，
+    # 因此在 middleware 先做 admission，佇列已滿時不讀本體立即回 429
+    if request.method == "POST" and request.url.path == "/transcribe/":
+        try:
+            batcher.check_admission()
+        except QueueFullError as e:
+            err = _queue_full(e)
+            return JSONResponse({"detail": err.detail}, status_code=err.status_code, headers=err.headers)
+    return await call_next(request)
+
+
+@app.on_event("startup")
+async def _start_batcher():
+    batcher.start()
+
+
+@app.on_event("shutdown")
+async def _stop_batcher():
+    await batcher.stop()
+
+
+def _format_chunks(outputs: dict) -> list[dict]:
+    #output = [{'timestamp': (...), 'text': '中文范例说明。'}]
+    chunks_output = []
+    for chunk in outputs.get("chunks", []):
+        timestamp_start = None
+        timestamp_end = None
+        if chunk.get('timestamp') is not None:
+            timestamp_start = chunk['timestamp'][0]
+            timestamp_end = chunk['timestamp'][1]
+
+        chunks_output.append({
+            "text": cc.convert(chunk.get('text', '')),
+            "timestamp": (timestamp_start, timestamp_end)
+        })
+    return chunks_output
+
+
 @app.post("/transcribe/", response_model=TranscriptionResponse)
-async def transcribe_audio(file: UploadFile = File(...)):
+async def transcribe_audio(file: UploadFile = File(...), model: str | None = Query(default=None)):
+    # admission 已在 _admit_multipart_uploads 讀取本體前完成
+    name = _resolve_model(model)
+    tmp_path = None
     try:
         with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
             content = await file.read()
             tmp.write(content)
             tmp_path = tmp.name
 
-        pipe.model.config.forced_decoder_ids = (
-            pipe.tokenizer.get_decoder_prompt_ids(
-                language="chinese", 
-                task="transcribe"
-            )
-        )
+        # 與同時抵達的其他請求合併成一次批次推論
+        outputs = await batcher.submit((name, tmp_path))
+        return {"chunks": _format_chunks(outputs)}
+    except QueueFullError as e:
+        raise _queue_full(e)
+    except Exception as e:
+        return {"chunks": [{"text": f"Error: {str(e)}", "timestamp": (0, 0)}]}
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 
-        outputs = pipe(tmp_path,return_timestamps=True)
-        #output = [{'timestamp': (...), 'text': '中文范例说明。'}]
-        chunks_output = []
-        for chunk in outputs.get("chunks", []):
-            timestamp_start = None
-            timestamp_end = None
-            if chunk.get('timestamp') is not None:
-                timestamp_start = chunk['timestamp'][0]
-                timestamp_end = chunk['timestamp'][1]
-
-            chunks_output.append({
-                "text": cc.convert(chunk.get('text', '')),
-                "timestamp": (timestamp_start, timestamp_end)
-            })
-        
-        os.remove(tmp_path)
-        return {"chunks": chunks_output}
+@app.post("/transcribe/pcm", response_model=TranscriptionResponse)
+async def transcribe_pcm(
+    request: Request,
+    x_sample_rate: int = Header(default=DEFAULT_SAMPLE_RATE),
+    x_sample_format: str = Header(default="s16le"),
+    model: str | None = Query(default=None),
+):
+    """本體為單聲道原始 PCM（s16le 或 f32le），直接轉成陣列送進 pipeline，不落地、不再經 ffmpeg 解碼。"""
+    name = _resolve_model(model)
+    try:
+        # 佇列已滿時不必讀取本體，立即回 429
+        batcher.check_admission()
+    except QueueFullError as e:
+        raise _queue_full(e)
+    try:
+        audio = decode_pcm_body(await request.body(), x_sample_format, x_sample_rate)
+    except PcmFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        outputs = await batcher.submit((name, audio))
+        return {"chunks": _format_chunks(outputs)}
+    except QueueFullError as e:
+        raise _queue_full(e)
     except Exception as e:
         return {"chunks": [{"text": f"Error: {str(e)}", "timestamp": (0, 0)}]}
 
 
+async def _next_block(body) -> bytes | None:
+    """讀取請求本體的下一個非空區塊；本體結束時回傳 None。"""
+    while True:
+        try:
+            block = await body.__anext__()
+        except StopAsyncIteration:
+            return None
+        if block:
+            return block
+
+
+def _own_chunks(chunks: list[dict], left_s: float, piece_s: float, duration_s: float, first: bool, last: bool) -> list[dict]:
+    """把以整個推論片段為基準的時間戳換算成相對於本組 offset，並只保留開始時間落在本組範圍內的句子。
+
+    相鄰兩組在邊界兩側各多推論 stride 秒的重疊音訊，跨界的句子兩組都會聽到完整內容；
+    以句子開始時間決定歸屬，同一句只由一組輸出，不會重複也不會被切斷。
+    """
+    owned = []
+    for chunk in chunks:
+        start, end = chunk["timestamp"]
+        start = left_s if start is None else start
+        # 最後一句可能沒有結束時間，以該片段結尾補上
+        end = piece_s if end is None else end
+        start, end = start - left_s, end - left_s
+        if (start < 0 and not first) or (start >= duration_s and not last):
+            continue
+        owned.append({**chunk, "timestamp": (max(0.0, start), max(0.0, end))})
+    return owned
+
+
+@app.post("/transcribe/stream")
+async def transcribe_stream(
+    request: Request,
+    x_sample_rate: int = Header(default=DEFAULT_SAMPLE_RATE),
+    x_sample_format: str = Header(default="s16le"),
+    chunk_length_s: float = Query(default=STREAM_CHUNK_LENGTH_S, gt=0),
+    stride_length_s: float = Query(default=STREAM_STRIDE_LENGTH_S, ge=0),
+    batch_size: int = Query(default=BATCH_SIZE, ge=1),
+    model: str | None = Query(default=None),
+):
+    """PCM 以串流上傳，伺服器邊收邊切窗推論，每解出一組就以 NDJSON 送回一行。
+
+    每 batch_size 個窗（約 chunk_length_s × batch_size 秒）為一組交給 pipeline，組內以 stride 重疊；
+    組與組之間也在邊界兩側各多推論 stride_length_s 秒，跨界的句子依開始時間只歸屬其中一組。
+    收到足夠本組與右側重疊的音訊就開始推論，不必等整個本體上傳完畢；記憶體只保留約一組的音訊。
+    每行為 {"type": "chunks", "offset", "duration", "chunks"}，chunks 的時間戳相對於該組 offset，
+    最後一行為 {"type": "done"}，推論失敗或本體格式錯誤時為 {"type": "error"}。
+    """
+    if stride_length_s * 2 >= chunk_length_s:
+        raise HTTPException(status_code=400, detail="stride_length_s 必須小於 chunk_length_s 的一半")
+    name = _resolve_model(model)
+    try:
+        batcher.check_admission()
+    except QueueFullError as e:
+        raise _queue_full(e)
+    try:
+        decoder = PcmStreamDecoder(x_sample_format, x_sample_rate)
+    except PcmFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    body = request.stream().__aiter__()
+    first_block = await _next_block(body)
+    if first_block is None:
+        raise HTTPException(status_code=400, detail="PCM 本體為空")
+
+    sr = decoder.sample_rate
+    group = max(1, int(chunk_length_s * batch_size * sr))
+    context = int(stride_length_s * sr)
+
+    async def lines():
+        # parts 保存從 buffer_start（絕對樣本索引）起已收到、仍可能用到的音訊
+        parts = [decoder.feed(first_block)]
+        buffer_start = 0
+        received = len(parts[0])
+        owned_start = 0
+        eof = False
+        while True:
+            # 收齊「本組 + 右側重疊」或本體結束才推論
+            while not eof and received < owned_start + group + context:
+                block = await _next_block(body)
+                if block is None:
+                    eof = True
+                    try:
+                        decoder.finish()
+                    except PcmFormatError as e:
+                        yield json.dumps({"type": "error", "message": str(e)}, ensure_ascii=False) + "\n"
+                        return
+                    break
+                samples = decoder.feed(block)
+                parts.append(samples)
+                received += len(samples)
+            if owned_start >= received:
+                break
+            buffered = np.concatenate(parts) if len(parts) > 1 else parts[0]
+            owned_end = min(received, owned_start + group)
+            piece_start = max(0, owned_start - context)
+            piece_end = min(received, owned_end + context)
+            piece = buffered[piece_start - buffer_start : piece_end - buffer_start]
+            offset = owned_start / sr
+            duration = (owned_end - owned_start) / sr
+            try:
+                # 與批次請求共用同一條推論執行緒，事件迴圈（含 /healthz）不會被卡住
+                outputs = await batcher.run_exclusive(
+                    _run_pipe_long,
+                    name,
+                    {"raw": piece, "sampling_rate": sr},
+                    chunk_length_s,
+                    stride_length_s,
+                    batch_size,
+                )
+            except Exception as e:
+                yield json.dumps({"type": "error", "message": str(e)}, ensure_ascii=False) + "\n"
+                return
+            chunks = _own_chunks(
+                _format_chunks(outputs),
+                left_s=(owned_start - piece_start) / sr,
+                piece_s=(piece_end - piece_start) / sr,
+                duration_s=duration,
+                first=owned_start == 0,
+                last=eof and owned_end >= received,
+            )
+            line = {"type": "chunks", "offset": offset, "duration": duration, "chunks": chunks}
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+            # 下一組只需要從其左側重疊開始的音訊
+            keep_from = max(buffer_start, owned_end - context)
+            parts = [buffered[keep_from - buffer_start :]]
+            buffer_start = keep_from
+            owned_start = owned_end
+        yield json.dumps({"type": "done", "duration": received / sr}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @app.get("/healthz")
 async def healthz():
-        return JSONResponse({"ok": True, "device": device, "model": model_id})
+        default = registry.peek()
+        return JSONResponse({
+            "ok": True,
+            "device": default.device if default is not None else None,
+            "model": model_id,
+            "engine": default.describe() if default is not None else None,
+            # 各模型的常駐狀態、載入耗時與命中率
+            "models": registry.stats(),
+            "batcher": batcher.stats(),
+            # 讓客戶端判斷是否可改用原始 PCM 上傳
+            "pcm_ingest": {"path": "/transcribe/pcm", "formats": list(PCM_FORMATS), "sample_rate": DEFAULT_SAMPLE_RATE},
+            "stream": {
+                "path": "/transcribe/stream",
+                "chunk_length_s": STREAM_CHUNK_LENGTH_S,
+                "stride_length_s": STREAM_STRIDE_LENGTH_S,
+                "batch_size": BATCH_SIZE,
+            },
+        })
     
 if __name__ == "__main__":
     import uvicorn
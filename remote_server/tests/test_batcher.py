@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from batcher import MicroBatcher, QueueFullError
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_requests_are_batched_and_results_keep_their_order():
+    seen = []
+
+    def run_batch(items):
+        seen.append(list(items))
+        return [item * 2 for item in items]
+
+    async def main():
+        batcher = MicroBatcher(run_batch, batch_size=4, max_wait_ms=50)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(i) for i in range(8))), batcher.stats()
+        finally:
+            await batcher.stop()
+
+    results, stats = _run(main())
+    assert results == [i * 2 for i in range(8)]
+    assert all(len(batch) <= 4 for batch in seen)
+    assert sum(len(batch) for batch in seen) == 8
+    assert stats["batch_sizes"]["count"] == len(seen)
+
+
+def test_admission_rejects_when_the_queue_is_full():
+    release = threading.Event()
+
+    def run_batch(items):
+        release.wait(timeout=2.0)
+        return items
+
+    async def main():
+        batcher = MicroBatcher(run_batch, batch_size=1, max_wait_ms=0, max_queue=2)
+        batcher.start()
+        try:
+            first = asyncio.ensure_future(batcher.submit("running"))
+            await asyncio.sleep(0.05)
+            queued = [asyncio.ensure_future(batcher.submit(f"q{i}")) for i in range(2)]
+            await asyncio.sleep(0.05)
+            assert batcher.queued == 2
+            with pytest.raises(QueueFullError) as excinfo:
+                await batcher.submit("rejected")
+            assert excinfo.value.queued == 2
+            assert excinfo.value.retry_after >= 1
+            release.set()
+            await asyncio.gather(first, *queued)
+            return batcher.stats()
+        finally:
+            release.set()
+            await batcher.stop()
+
+    stats = _run(main())
+    assert stats["rejected"] == 1
+    assert stats["queued"] == 0
+
+
+def test_exclusive_jobs_count_towards_admission_and_retry_after():
+    async def main():
+        batcher = MicroBatcher(lambda items: items, batch_size=2, max_queue=2)
+        batcher.start()
+        try:
+            jobs = [asyncio.ensure_future(batcher.run_exclusive(time.sleep, 0.2)) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            stats = batcher.stats()
+            assert stats["queued"] == 2
+            assert stats["exclusive"] == 2
+            with pytest.raises(QueueFullError) as excinfo:
+                batcher.check_admission()
+            assert excinfo.value.queued == 2
+            # 沒有歷史耗時時每個獨占工作以 1 秒估計
+            assert excinfo.value.retry_after == 2
+            await asyncio.gather(*jobs)
+            stats = batcher.stats()
+            assert stats["queued"] == 0
+            assert stats["exclusive"] == 0
+            assert stats["avg_exclusive_s"] == pytest.approx(0.2, abs=0.1)
+            batcher.check_admission()
+            assert await batcher.submit("ok") == "ok"
+        finally:
+            await batcher.stop()
+
+    _run(main())
+
+
+def test_exclusive_job_errors_release_their_slot():
+    def boom():
+        raise RuntimeError("inference failed")
+
+    async def main():
+        batcher = MicroBatcher(lambda items: items, max_queue=1)
+        batcher.start()
+        try:
+            with pytest.raises(RuntimeError):
+                await batcher.run_exclusive(boom)
+            assert batcher.queued == 0
+            batcher.check_admission()
+        finally:
+            await batcher.stop()
+
+    _run(main())